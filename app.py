@@ -1,14 +1,21 @@
+import os
+
 import streamlit as st
-from pymongo import MongoClient
 
-# Initialize connection to MongoDB
+import metrics
+import storage
+
+# Initialize storage: STORAGE_URL (or [storage] url in secrets), else the Mongo cluster
+def storage_url():
+    url = os.environ.get("STORAGE_URL") or st.secrets.get("storage", {}).get("url")
+    return url or st.secrets["mongo"]["uri"]
+
 @st.cache_resource
-def init_connection():
-    return MongoClient(st.secrets["mongo"]["uri"])
+def init_storage():
+    metrics.start()
+    return storage.open_storage(storage_url())
 
-client = init_connection()
-db = client["Q_and_A"]  # Database Name
-collection = db["content_data"]  # Collection Name
+store = init_storage()
 
 # Streamlit UI
 st.title("📖 Fetch Content from MongoDB")
@@ -17,7 +24,7 @@ st.subheader("🔍 Enter Content ID to Fetch Content")
 content_id_input = st.text_input("Enter Content ID (e.g., 000001):")
 
 if st.button("Fetch Content"):
-    content_data = collection.find_one({"content_id": content_id_input})
+    content_data = store.get_content(content_id_input)
 
     if content_data:
         st.subheader("📜 Retrieved Content")
@@ -1,6 +1,9 @@
+import os
+
 import streamlit as st
-from pymongo import MongoClient
-from datetime import datetime
+
+import metrics
+import storage
 
 # ------------------------------------------------------------------------------
 # 0) LANGUAGE DICTIONARY
@@ -27,6 +30,7 @@ LANG_DICT = {
         "save_changes": "Save Changes",
         "changes_saved": "✅ Changes saved successfully!",
         "deleted_questions": "✅ Deleted selected questions!",
+        "merge_conflict": "⚠️ Someone else changed some of these questions at the same time; their version was kept.",
         "add_new_question": "📝 Add a New Question",
         "enter_new_question": "Enter New Question:",
         "save_question": "Save Question",
@@ -56,6 +60,7 @@ LANG_DICT = {
         "save_changes": "మార్పులను సేవ్ చేయండి",
         "changes_saved": "✅ మార్పులు విజయవంతంగా సేవ్ అయ్యాయి!",
         "deleted_questions": "✅ ఎంపిక చేసిన ప్రశ్నలు తొలగించబడ్డాయి!",
+        "merge_conflict": "⚠️ ఈ ప్రశ్నలలో కొన్నింటిని మరొకరు అదే సమయంలో మార్చారు; వారి మార్పులు ఉంచబడ్డాయి.",
         "add_new_question": "📝 కొత్త ప్రశ్నను జోడించండి",
         "enter_new_question": "కొత్త ప్రశ్నను నమోదు చేయండి:",
         "save_question": "ప్రశ్నను సేవ్ చేయండి",
@@ -67,16 +72,19 @@ LANG_DICT = {
 }
 
 # ------------------------------------------------------------------------------
-# 1) MONGODB CONNECTION
+# 1) STORAGE CONNECTION
 # ------------------------------------------------------------------------------
+def storage_url():
+    """STORAGE_URL (or [storage] url in secrets), else the Mongo cluster."""
+    url = os.environ.get("STORAGE_URL") or st.secrets.get("storage", {}).get("url")
+    return url or st.secrets["mongo"]["uri"]
+
 @st.cache_resource
-def init_connection():
-    return MongoClient(st.secrets["mongo"]["uri"])
+def init_storage():
+    metrics.start()
+    return storage.open_storage(storage_url())
 
-client = init_connection()
-db = client["Q_and_A"]
-users_collection = db["users"]
-content_collection = db["content_data"]
+store = init_storage()
 
 # ------------------------------------------------------------------------------
 # 2) USER AUTHENTICATION (Username-Only Login)
@@ -88,43 +96,35 @@ def login_user(username):
     st.session_state["authenticated_user"] = username
 
 def logout_user():
+    # Hand the open passage back to the queue.
+    current_id = st.session_state.pop("current_content_id", None)
+    if current_id:
+        store.release(current_id, st.session_state["authenticated_user"])
+    st.session_state.pop("questions", None)
     st.session_state.pop("authenticated_user", None)
 
 def authenticate_or_register_user(username):
     """Logs in an existing user or registers a new one automatically."""
-    if not users_collection.find_one({"username": username}):
-        users_collection.insert_one({"username": username})  # Auto-register if new user
+    store.ensure_user(username)  # Auto-register if new user
     login_user(username)
 
 # ------------------------------------------------------------------------------
 # 3) FETCH NEXT CONTENT (Prioritizing Empty Questions)
 # ------------------------------------------------------------------------------
+def open_passage(doc):
+    """Keep the questions and version the edit widgets are drawn from, and
+    that saves merge against."""
+    st.session_state["current_content_id"] = doc["content_id"]
+    st.session_state["questions"] = doc.get("questions", [])
+    st.session_state["version"] = doc.get("version", 0)
+
 def fetch_next_content():
-    if "skipped_ids" not in st.session_state:
-        st.session_state["skipped_ids"] = []
-
-    # Priority 1: Fetch content with empty questions
-    doc = content_collection.find_one({
-        "questions": {"$size": 0},
-        "content_id": {"$nin": st.session_state["skipped_ids"]}
-    })
-
-    # Priority 2: Fetch content with <6 questions
-    if not doc:
-        doc = content_collection.find_one({
-            "$expr": {"$lt": [{"$size": "$questions"}, 6]},
-            "content_id": {"$nin": st.session_state["skipped_ids"]}
-        })
-
-    # Priority 3: Fetch skipped content
-    if not doc and st.session_state["skipped_ids"]:
-        doc = content_collection.find_one({
-            "content_id": st.session_state["skipped_ids"].pop(0)
-        })
+    # Empty questions first, then <6 questions, then skipped content, oldest
+    # first; the passage is leased so nobody else is given it meanwhile.
+    doc = store.fetch_next(st.session_state["authenticated_user"])
 
     if doc:
-        st.session_state["current_content_id"] = doc["content_id"]
-        st.session_state["questions"] = doc.get("questions", [])
+        open_passage(doc)
     else:
         st.warning(LANG_DICT[st.session_state["lang"]]["no_content_available"])
 
@@ -132,10 +132,12 @@ def fetch_next_content():
 # 4) SEARCH FOR CONTENT BY `content_id`
 # ------------------------------------------------------------------------------
 def fetch_content_by_id(content_id):
-    found = content_collection.find_one({"content_id": content_id})
+    found = store.get_content(content_id)
     if found:
-        st.session_state["current_content_id"] = found["content_id"]
-        st.session_state["questions"] = found.get("questions", [])
+        previous_id = st.session_state.get("current_content_id")
+        if previous_id and previous_id != found["content_id"]:
+            store.release(previous_id, st.session_state["authenticated_user"])
+        open_passage(found)
     else:
         st.error(f"{LANG_DICT[st.session_state['lang']]['no_content_found']} {content_id}")
 
@@ -143,20 +145,7 @@ def fetch_content_by_id(content_id):
 # 5) LOG USER ACTIONS
 # ------------------------------------------------------------------------------
 def log_user_action(content_id, action):
-    timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    content_collection.update_one(
-        {"content_id": content_id},
-        {
-            "$push": {
-                "users": {
-                    "username": st.session_state["authenticated_user"],
-                    "action": action,
-                    "datetime": timestamp_str
-                }
-            }
-        },
-        upsert=True
-    )
+    store.log_action(st.session_state["authenticated_user"], content_id, action)
 
 # ------------------------------------------------------------------------------
 # 6) CONTENT MANAGEMENT FUNCTION
@@ -173,7 +162,7 @@ def content_management():
         fetch_next_content()
 
     if "current_content_id" in st.session_state:
-        content_data = content_collection.find_one({"content_id": st.session_state["current_content_id"]})
+        content_data = store.get_content(st.session_state["current_content_id"])
         st.subheader(f"{LANG_DICT[lang]['retrieved_content_id']} {content_data['content_id']})")
         st.text_area(
             LANG_DICT[lang]["content_label"],
@@ -182,51 +171,56 @@ def content_management():
             disabled=True
         )
 
-        questions = content_data.get("questions", [])
+        # The snapshot the widgets are drawn from, not what is stored now.
+        questions = st.session_state["questions"]
         st.write(f"{LANG_DICT[lang]['total_questions']} {len(questions)}")
 
         updated_questions = []
-        delete_indices = []
+        deleted_qids = []
         for idx, q in enumerate(questions, start=1):
             question_text = st.text_area(
                 f"{LANG_DICT[lang]['edit_question']} {idx}",
                 value=q["question"],
-                key=f"edit_q_{idx}"
+                key=f"edit_q_{q['qid']}"
             )
-            delete_flag = st.checkbox(f"{LANG_DICT[lang]['delete_question']} {idx}", key=f"delete_{idx}")
+            delete_flag = st.checkbox(f"{LANG_DICT[lang]['delete_question']} {idx}", key=f"delete_{q['qid']}")
             if delete_flag:
-                delete_indices.append(idx - 1)
-            updated_questions.append({"question": question_text})
+                deleted_qids.append(q["qid"])
+            updated_questions.append({**q, "question": question_text})
 
         if st.button(LANG_DICT[lang]["save_changes"]):
-            content_collection.update_one(
-                {"content_id": content_data["content_id"]},
-                {"$set": {"questions": updated_questions}}
+            saved, conflicts = store.save_question_edits(
+                content_data["content_id"], st.session_state["version"], questions, updated_questions
             )
-            log_user_action(content_data["content_id"], "edited questions")
-            st.success(LANG_DICT[lang]["changes_saved"])
+            if saved:
+                log_user_action(content_data["content_id"], "edited questions")
+            open_passage(store.get_content(content_data["content_id"]))
+            if conflicts:
+                st.warning(LANG_DICT[lang]["merge_conflict"])
+            else:
+                st.success(LANG_DICT[lang]["changes_saved"])
             st.rerun()
 
-        if delete_indices:
-            new_questions = [q for i, q in enumerate(questions) if i not in delete_indices]
-            content_collection.update_one(
-                {"content_id": content_data["content_id"]},
-                {"$set": {"questions": new_questions}}
+        if deleted_qids:
+            saved, conflicts = store.save_question_edits(
+                content_data["content_id"], st.session_state["version"], questions, questions, deleted=deleted_qids
             )
-            log_user_action(content_data["content_id"], "deleted questions")
-            st.success(LANG_DICT[lang]["deleted_questions"])
+            if saved:
+                log_user_action(content_data["content_id"], "deleted questions")
+            open_passage(store.get_content(content_data["content_id"]))
+            if conflicts:
+                st.warning(LANG_DICT[lang]["merge_conflict"])
+            else:
+                st.success(LANG_DICT[lang]["deleted_questions"])
             st.rerun()
 
         st.subheader(LANG_DICT[lang]["add_new_question"])
         new_question = st.text_area(LANG_DICT[lang]["enter_new_question"])
         if st.button(LANG_DICT[lang]["save_question"]):
             if new_question.strip():
-                content_collection.update_one(
-                    {"content_id": content_data["content_id"]},
-                    {"$push": {"questions": {"question": new_question}}},
-                    upsert=True
-                )
+                store.add_question(content_data["content_id"], {"question": new_question})
                 log_user_action(content_data["content_id"], "added question")
+                open_passage(store.get_content(content_data["content_id"]))
                 st.success(LANG_DICT[lang]["question_added"])
                 st.rerun()
             else:
@@ -234,7 +228,7 @@ def content_management():
 
     if st.button(LANG_DICT[lang]["skip_and_next"]):
         log_user_action(st.session_state["current_content_id"], LANG_DICT[lang]["skipped"])
-        st.session_state["skipped_ids"].append(st.session_state["current_content_id"])
+        store.skip(st.session_state["authenticated_user"], st.session_state["current_content_id"])
         st.session_state.pop("current_content_id")
         st.session_state.pop("questions", None)
         fetch_next_content()
@@ -1,6 +1,9 @@
+import os
+
 import streamlit as st
-from pymongo import MongoClient
-from datetime import datetime
+
+import metrics
+import storage
 
 # ------------------------------------------------------------------------------
 # 0) USER AUTHENTICATION
@@ -12,74 +15,63 @@ if not username.strip():
     st.stop()
 
 # ------------------------------------------------------------------------------
-# 1) MongoDB CONNECTION INITIALIZATION
+# 1) STORAGE INITIALIZATION
 # ------------------------------------------------------------------------------
+def storage_url():
+    """STORAGE_URL (or [storage] url in secrets), else the Mongo cluster."""
+    url = os.environ.get("STORAGE_URL") or st.secrets.get("storage", {}).get("url")
+    return url or st.secrets["mongo"]["uri"]
+
 @st.cache_resource
-def init_connection():
-    return MongoClient(st.secrets["mongo"]["uri"])
+def init_storage():
+    metrics.start()
+    return storage.open_storage(storage_url())
 
-client = init_connection()
-db = client["Q_and_A"] 
-collection = db["content_data"]
+store = init_storage()
 
 # ------------------------------------------------------------------------------
 # 2) FUNCTION: LOG USER ACTIONS
 # ------------------------------------------------------------------------------
 def log_user_action(content_id, action):
-    timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    collection.update_one(
-        {"content_id": content_id},
-        {
-            "$push": {
-                "users": {
-                    "username": username,
-                    "action": action,
-                    "datetime": timestamp_str
-                }
-            }
-        },
-        upsert=True
-    )
-
-# ------------------------------------------------------------------------------
-# 3) SESSION STATE INITIALIZATION
-# ------------------------------------------------------------------------------
-if "skipped_ids" not in st.session_state:
-    st.session_state["skipped_ids"] = []
+    store.log_action(username, content_id, action)
+
+def open_passage(doc):
+    """Keep the questions and version the edit widgets are drawn from, and
+    that saves merge against."""
+    st.session_state["current_content_id"] = doc["content_id"]
+    st.session_state["questions"] = doc.get("questions", [])
+    st.session_state["version"] = doc.get("version", 0)
+
+def reload_passage(content_id, kind, message):
+    """After a write: refresh the snapshot and rerun, showing `message`
+    with st.<kind> on the rerun."""
+    open_passage(store.get_content(content_id))
+    st.session_state["flash"] = (kind, message)
+    st.rerun()
 
 # ------------------------------------------------------------------------------
-# 4) SEARCH BOX
+# 3) SEARCH BOX
 # ------------------------------------------------------------------------------
 st.subheader("🔍 Search for Specific Content")
 search_id = st.text_input("Search content_id:")
 if st.button("Search"):
-    found = collection.find_one({"content_id": search_id})
+    found = store.get_content(search_id)
     if found:
-        st.session_state["current_content_id"] = found["content_id"]
-        st.session_state["questions"] = found.get("questions", [])
+        if st.session_state.get("current_content_id") not in (None, found["content_id"]):
+            store.release(st.session_state["current_content_id"], username)
+        open_passage(found)
     else:
         st.error(f"❌ No content found for content_id: {search_id}")
 
 # ------------------------------------------------------------------------------
-# 5) AUTO-FETCH CONTENT BASED ON PRIORITY
+# 4) AUTO-FETCH CONTENT BASED ON PRIORITY
 # ------------------------------------------------------------------------------
 def fetch_next_content():
     """Fetches next content based on priority: empty questions → less than 6 questions → skipped."""
-    
-    query_empty = {"questions": {"$size": 0}, "content_id": {"$nin": st.session_state["skipped_ids"]}}
-    doc = collection.find_one(query_empty)
-
-    if not doc:
-        query_lt6 = {"$expr": {"$lt": [{"$size": "$questions"}, 6]}, "content_id": {"$nin": st.session_state["skipped_ids"]}}
-        doc = collection.find_one(query_lt6)
-
-    if not doc and st.session_state["skipped_ids"]:
-        skipped_id = st.session_state["skipped_ids"].pop(0)
-        doc = collection.find_one({"content_id": skipped_id})
+    doc = store.fetch_next(username)
 
     if doc:
-        st.session_state["current_content_id"] = doc["content_id"]
-        st.session_state["questions"] = doc.get("questions", [])
+        open_passage(doc)
     else:
         st.warning("✅ No more content available to process!")
         st.stop()
@@ -88,79 +80,88 @@ if "current_content_id" not in st.session_state:
     fetch_next_content()
 
 # ------------------------------------------------------------------------------
-# 6) DISPLAY, EDIT & DELETE CONTENT
+# 5) DISPLAY, EDIT & DELETE CONTENT
 # ------------------------------------------------------------------------------
 if "current_content_id" in st.session_state:
-    content_data = collection.find_one({"content_id": st.session_state["current_content_id"]})
+    content_data = store.get_content(st.session_state["current_content_id"])
     if content_data:
         st.subheader(f"📜 Content (ID: {content_data['content_id']})")
         st.text_area("Content:", value=content_data.get("content", ""), height=300, disabled=True)
 
-        questions_list = content_data.get("questions", [])
+        if "flash" in st.session_state:
+            kind, message = st.session_state.pop("flash")
+            getattr(st, kind)(message)
+
+        # The snapshot the widgets are drawn from, not what is stored now.
+        questions_list = st.session_state["questions"]
         st.write(f"📌 **Total Questions:** {len(questions_list)}")
 
-        # 6a) EDIT EXISTING QUESTIONS
+        # 5a) EDIT EXISTING QUESTIONS
         if questions_list:
             st.write("📝 **Edit or Delete Questions**")
             updated_questions = []
-            delete_indices = []
+            deleted_qids = []
 
             for idx, q in enumerate(questions_list, start=1):
                 col1, col2 = st.columns([8, 1])
                 with col1:
-                    question_text = st.text_area(f"Edit Question {idx}", value=q["question"], key=f"edit_q_{idx}")
+                    question_text = st.text_area(f"Edit Question {idx}", value=q["question"], key=f"edit_q_{q['qid']}")
                     difficulty = st.selectbox(f"Difficulty {idx}", ["easy", "medium", "hard"], 
-                                              index=["easy", "medium", "hard"].index(q["difficulty"]), key=f"edit_d_{idx}")
+                                              index=["easy", "medium", "hard"].index(q["difficulty"]), key=f"edit_d_{q['qid']}")
                 with col2:
-                    delete_flag = st.checkbox(f"🗑️", key=f"delete_{idx}")
+                    delete_flag = st.checkbox(f"🗑️", key=f"delete_{q['qid']}")
                     if delete_flag:
-                        delete_indices.append(idx - 1)
+                        deleted_qids.append(q["qid"])
 
-                answer_text = q.get("answer", "")
-                updated_questions.append({"question": question_text, "difficulty": difficulty, "answer": answer_text})
+                updated_questions.append({**q, "question": question_text, "difficulty": difficulty})
 
             # Save Changes
             if st.button("Save Changes"):
-                collection.update_one({"content_id": content_data["content_id"]}, {"$set": {"questions": updated_questions}})
-                log_user_action(content_data["content_id"], "edited questions")
-                st.success("✅ Changes saved successfully!")
-                st.rerun()
+                saved, conflicts = store.save_question_edits(
+                    content_data["content_id"], st.session_state["version"], questions_list, updated_questions
+                )
+                if saved:
+                    log_user_action(content_data["content_id"], "edited questions")
+                if conflicts:
+                    reload_passage(content_data["content_id"], "warning", "⚠ Someone else changed some of these questions; their version was kept.")
+                else:
+                    reload_passage(content_data["content_id"], "success", "✅ Changes saved successfully!")
 
             # Delete Selected Questions
-            if delete_indices:
+            if deleted_qids:
                 if st.button("Delete Selected Questions"):
-                    new_questions = [q for i, q in enumerate(questions_list) if i not in delete_indices]
-                    collection.update_one({"content_id": content_data["content_id"]}, {"$set": {"questions": new_questions}})
-                    log_user_action(content_data["content_id"], "deleted questions")
-                    st.success("✅ Selected questions deleted successfully!")
-                    st.rerun()
-
-        # 6b) ADD A NEW QUESTION
+                    saved, conflicts = store.save_question_edits(
+                        content_data["content_id"], st.session_state["version"], questions_list, questions_list,
+                        deleted=deleted_qids
+                    )
+                    if saved:
+                        log_user_action(content_data["content_id"], "deleted questions")
+                    if conflicts:
+                        reload_passage(content_data["content_id"], "warning", "⚠ Someone else changed some of these questions; their version was kept.")
+                    else:
+                        reload_passage(content_data["content_id"], "success", "✅ Selected questions deleted successfully!")
+
+        # 5b) ADD A NEW QUESTION
         st.subheader("➕ Add a New Question")
         new_question = st.text_area("Enter New Question:", height=100)
         new_difficulty = st.selectbox("Select Difficulty Level:", ["easy", "medium", "hard"])
 
         if st.button("Save Question"):
             if new_question.strip():
-                collection.update_one(
-                    {"content_id": content_data["content_id"]},
-                    {"$push": {"questions": {"question": new_question, "difficulty": new_difficulty, "answer": ""}}},
-                    upsert=True
-                )
+                store.add_question(content_data["content_id"], {"question": new_question, "difficulty": new_difficulty, "answer": ""})
                 log_user_action(content_data["content_id"], "added question")
-                st.success("✅ New question added successfully!")
-                st.rerun()
+                reload_passage(content_data["content_id"], "success", "✅ New question added successfully!")
             else:
                 st.error("⚠ Please enter a question before saving!")
 
 # ------------------------------------------------------------------------------
-# 7) FETCH NEXT CONTENT (SKIP) BUTTON
+# 6) FETCH NEXT CONTENT (SKIP) BUTTON
 # ------------------------------------------------------------------------------
 st.subheader("🔄 Skip & Fetch Next Content")
 if st.button("Fetch Next Content"):
     current_id = st.session_state.get("current_content_id")
     if current_id:
-        st.session_state["skipped_ids"].append(current_id)
+        store.skip(username, current_id)
         log_user_action(current_id, "skipped")
         st.session_state.pop("current_content_id")
         st.session_state.pop("questions", None)
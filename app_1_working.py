@@ -1,7 +1,28 @@
+import os
+
 import streamlit as st
-from pymongo import MongoClient
+import streamlit.components.v1 as components
 from datetime import datetime
-import bcrypt  # Requires "pip install bcrypt"
+
+import content_cache
+import content_ops
+import dedup
+import events
+import metrics
+import passwords
+import progress
+import search_index
+import sessions
+import storage
+import work_queue
+
+# Times this whole script run (a no-op unless metrics are enabled, see metrics.py).
+rerun_timer = metrics.RerunTimer("app_1_working")
+
+def stop_run():
+    """st.stop(), recording how long this run took."""
+    rerun_timer.finish("stop")
+    st.stop()
 
 # ------------------------------------------------------------------------------
 # 0) Translation Data & Instructions
@@ -22,11 +43,19 @@ LANG_TEXT = {
         "login_btn": "Login",
         "login_error": "Invalid username or password.",
         "login_fill_error": "Please enter both username and password.",
+        "throttled": "Too many attempts. Please try again in {seconds} s.",
+        "password_busy": "The server is busy signing people in. Please try again in a moment.",
         "fill_error": "Please enter both username and password.",
         "welcome_user": "Welcome, {username}!",
+        "logout_btn": "Logout",
         "search_id": "Search content_id:",
         "search_btn": "Search",
         "search_err": "No content found for content_id: {search_id}",
+        "text_search": "Search passages and questions by text:",
+        "text_search_btn": "Search Text",
+        "text_search_short": "Enter at least one word of 3 or more letters.",
+        "text_search_none": "No passages match.",
+        "text_search_open": "Open {content_id}",
         "no_more_items": "No more items. Nothing with empty or < 6 questions, and no skipped items remain.",
         "content_id_retrieved": "📜 Retrieved Content (ID: {content_id})",
         "content_box_label": "Content:",
@@ -38,14 +67,34 @@ LANG_TEXT = {
         "delete_warning": "Marked question {idx} for deletion.",
         "save_changes_btn": "Save Changes",
         "changes_saved": "✅ Changes saved successfully!",
+        "no_changes": "Nothing was changed, so there was nothing to save.",
+        "merge_conflict": "⚠️ Someone else changed question(s) {nums} at the same time. Their version was kept for those; your other changes were saved.",
         "add_new_question_subheader": "📝 Add a New Question",
         "enter_new_q_label": "Enter New Question:",
         "difficulty_select_label": "Select Difficulty Level:",
         "save_question_btn": "Save Question",
+        "duplicate_warning": "⚠️ This looks like question(s) that already exist. Click Save Question again to add it anyway:",
+        "duplicate_item": "- {similarity:.0%} similar (content {content_id}): {question}",
         "empty_q_error": "⚠️ Please enter a question before saving!",
         "fetch_next_subheader": "🔄 Fetch Next Content (Skip this one)",
         "fetch_next_btn": "Fetch Next Content",
-        "instructions_btn": "Instructions"
+        "instructions_btn": "Instructions",
+        "dashboard_toggle": "Progress dashboard",
+        "dashboard_title": "📊 Corpus Progress",
+        "dashboard_pending": "Progress numbers are being computed; check back in a moment.",
+        "dashboard_total": "Passages",
+        "dashboard_empty": "0 questions",
+        "dashboard_partial": "1–5 questions",
+        "dashboard_complete": "≥ 6 questions",
+        "dashboard_balanced": "2+ per level",
+        "dashboard_difficulty": "Questions per difficulty level",
+        "dashboard_updated": "Updated {when} UTC; refreshed every {minutes} min.",
+        "leaderboard_title": "🏆 Annotator Leaderboard",
+        "leaderboard_period": "Period:",
+        "leaderboard_periods": ["Today", "Last 7 days", "Last 30 days"],
+        "leaderboard_user": "User",
+        "leaderboard_total": "Total",
+        "leaderboard_empty": "No activity in this period."
     },
     "Telugu": {
         "app_title": "📖 ప్రశ్న ఇన్సర్టర్ సాధనం @vipplavAI",
@@ -62,11 +111,19 @@ LANG_TEXT = {
         "login_btn": "లాగిన్",
         "login_error": "చెల్లని యూజర్ పేరు లేదా పాస్వర్డ్.",
         "login_fill_error": "దయచేసి వినియోగదారు పేరు మరియు పాస్‌వర్డ్ రెండింటినీ నమోదు చేయండి.",
+        "throttled": "చాలా ప్రయత్నాలు జరిగాయి. దయచేసి {seconds} సెకన్ల తర్వాత మళ్ళీ ప్రయత్నించండి.",
+        "password_busy": "సర్వర్ ప్రస్తుతం బిజీగా ఉంది. దయచేసి కొద్దిసేపటి తర్వాత మళ్ళీ ప్రయత్నించండి.",
         "fill_error": "దయచేసి వినియోగదారు పేరు మరియు పాస్‌వర్డ్ రెండింటినీ నమోదు చేయండి.",
         "welcome_user": "సుస్వాగతం, {username}!",
+        "logout_btn": "లాగ్ అవుట్",
         "search_id": "కంటెంట్ ఐడి వెతకండి:",
         "search_btn": "వెతకండి",
         "search_err": "ఈ కంటెంట్ ఐడికి `{search_id}` అనువైన విషయం లేదు.",
+        "text_search": "పాఠ్యం ద్వారా కంటెంట్ మరియు ప్రశ్నలను వెతకండి:",
+        "text_search_btn": "పాఠ్యం వెతకండి",
+        "text_search_short": "కనీసం 3 అక్షరాలు ఉన్న ఒక పదాన్ని నమోదు చేయండి.",
+        "text_search_none": "సరిపోలే కంటెంట్ లేదు.",
+        "text_search_open": "{content_id} తెరవండి",
         "no_more_items": "మరిన్ని అంశాలు లేవు. ఖాళీ ప్రశ్నలు లేవు లేదా < 6 ప్రశ్నలు లేవు, అలాగే స్కిప్ చేసినవి లేవు.",
         "content_id_retrieved": "📜 తిరిగి పొందిన కంటెంట్ (ID: {content_id})",
         "content_box_label": "కంటెంట్:",
@@ -78,14 +135,34 @@ LANG_TEXT = {
         "delete_warning": "{idx} ప్రశ్న తొలగించబడింది.",
         "save_changes_btn": "మార్పులు సేవ్ చేయండి",
         "changes_saved": "✅ మార్పులు విజయవంతంగా సేవ్ అయ్యాయి!",
+        "no_changes": "ఏ మార్పులూ చేయలేదు, కాబట్టి సేవ్ చేయడానికి ఏమీ లేదు.",
+        "merge_conflict": "⚠️ ప్రశ్న(లు) {nums}ని మరొకరు అదే సమయంలో మార్చారు. వాటికి వారి మార్పులు ఉంచబడ్డాయి; మీ ఇతర మార్పులు సేవ్ అయ్యాయి.",
         "add_new_question_subheader": "📝 కొత్త ప్రశ్న చేర్చండి",
         "enter_new_q_label": "కొత్త ప్రశ్నను నమోదు చేయండి:",
         "difficulty_select_label": "సమస్య స్థాయిని ఎంచుకోండి:",
         "save_question_btn": "ప్రశ్నని సేవ్ చేయండి",
+        "duplicate_warning": "⚠️ ఇది ఇప్పటికే ఉన్న ప్రశ్న(ల)లా ఉంది. అయినా జోడించడానికి ప్రశ్నని సేవ్ చేయండి మళ్ళీ నొక్కండి:",
+        "duplicate_item": "- {similarity:.0%} పోలిక (కంటెంట్ {content_id}): {question}",
         "empty_q_error": "⚠️ సేవ్ చేసే ముందు దయచేసి ఒక ప్రశ్నను నమోదు చేయండి!,",
         "fetch_next_subheader": "🔄 మరో కంటెంట్ తీసుకురండి (ఇది స్కిప్ చేయండి)",
         "fetch_next_btn": "తదుపరి కంటెంట్ తీసుకురండి",
-        "instructions_btn": "నిర్దేశాలు"
+        "instructions_btn": "నిర్దేశాలు",
+        "dashboard_toggle": "పురోగతి డాష్‌బోర్డ్",
+        "dashboard_title": "📊 కార్పస్ పురోగతి",
+        "dashboard_pending": "పురోగతి గణాంకాలు లెక్కించబడుతున్నాయి; కొద్దిసేపటి తర్వాత చూడండి.",
+        "dashboard_total": "కంటెంట్‌లు",
+        "dashboard_empty": "0 ప్రశ్నలు",
+        "dashboard_partial": "1–5 ప్రశ్నలు",
+        "dashboard_complete": "≥ 6 ప్రశ్నలు",
+        "dashboard_balanced": "ప్రతి స్థాయికి 2+",
+        "dashboard_difficulty": "క్లిష్టత స్థాయి వారీగా ప్రశ్నలు",
+        "dashboard_updated": "{when} UTCకి నవీకరించబడింది; ప్రతి {minutes} నిమిషాలకు రిఫ్రెష్ అవుతుంది.",
+        "leaderboard_title": "🏆 వ్యాఖ్యాతల లీడర్‌బోర్డ్",
+        "leaderboard_period": "కాలం:",
+        "leaderboard_periods": ["ఈ రోజు", "గత 7 రోజులు", "గత 30 రోజులు"],
+        "leaderboard_user": "వాడుకరి",
+        "leaderboard_total": "మొత్తం",
+        "leaderboard_empty": "ఈ కాలంలో ఎటువంటి కార్యకలాపం లేదు."
     }
 }
 
@@ -215,77 +292,113 @@ Once reviewed, click Submit Questions to finalize.
 
 
 # ------------------------------------------------------------------------------
-# 1) Initialize connection to MongoDB
+# 1) Initialize storage
 # ------------------------------------------------------------------------------
+def storage_url():
+    """STORAGE_URL (or [storage] url in secrets), else the Mongo cluster."""
+    url = os.environ.get("STORAGE_URL") or st.secrets.get("storage", {}).get("url")
+    return url or st.secrets["mongo"]["uri"]
+
+@st.cache_resource
+def init_storage():
+    """Process-wide storage backend. On Mongo, audit events are written
+    behind and passage bodies are served from an LRU shared by all sessions."""
+    metrics.start()
+    url = storage_url()
+    if not storage.is_mongo_url(url):
+        return storage.open_storage(url)
+    store = storage.open_storage(url, write_behind=True, body_cache=content_cache.LRUCache())
+    dedup.ensure_indexes(store.db["question_signatures"])
+    sessions.ensure_indexes(store.db["sessions"])
+    return store
+
+store = init_storage()
+# Search, duplicate checks, dashboards and login sessions work on the Mongo
+# collections directly; on the local backends they are left out.
+db = store.db if isinstance(store, storage.MongoStorage) else None
+
 @st.cache_resource
-def init_connection():
-    return MongoClient(st.secrets["mongo"]["uri"])
+def get_session_store():
+    """Process-wide session token store; the signing key comes from secrets or SESSION_SECRET."""
+    secret = st.secrets.get("session", {}).get("secret")
+    return sessions.SessionStore(
+        init_storage().db["sessions"],
+        secret=secret.encode("utf-8") if secret else None,
+    )
 
-client = init_connection()
-db = client["Q_and_A"]
+@st.cache_resource
+def get_progress_stats():
+    """Process-wide progress numbers, recomputed in the background."""
+    return progress.ProgressStats(init_storage().db["content_data"])
 
-content_collection = db["content_data"]
-users_collection = db["users"]
+@st.cache_resource
+def get_search_index():
+    """Process-wide full-text index, kept in step with content_data in the background."""
+    index = search_index.SearchIndex()
+    index.start_sync(init_storage().db["content_data"])
+    return index
 
 # ------------------------------------------------------------------------------
 # 2) Authentication Helpers
 # ------------------------------------------------------------------------------
-def hash_password(password: str) -> bytes:
-    """Generate salted hash for the given password."""
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+# bcrypt runs in the bounded pool in passwords.py, never on the script thread.
+LOGIN_ATTEMPTS_PER_USER = 5
+LOGIN_ATTEMPTS_PER_IP = 30
 
-def check_password(password: str, hashed: bytes) -> bool:
-    """Compare a plain password with the hashed password."""
-    return bcrypt.checkpw(password.encode("utf-8"), hashed)
+# Reverse proxies in front of Streamlit that each append the address they
+# received from to X-Forwarded-For. 0 (the default) ignores the header.
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", "0"))
 
-def register_user(username: str, password: str) -> bool:
-    existing_user = users_collection.find_one({"username": username})
-    if existing_user:
-        return False
-    hashed_pw = hash_password(password)
-    new_user = {
-        "username": username,
-        "hashed_password": hashed_pw,
-        "activity_logs": []
-    }
-    users_collection.insert_one(new_user)
-    return True
-
-def login_user(username: str, password: str) -> bool:
-    user_doc = users_collection.find_one({"username": username})
-    if not user_doc:
-        return False
-    hashed_pw = user_doc["hashed_password"]
-    return check_password(password, hashed_pw)
+@st.cache_resource
+def get_login_throttles():
+    """Process-wide attempt limits: (per username, per client IP), per minute."""
+    return passwords.Throttle(LOGIN_ATTEMPTS_PER_USER), passwords.Throttle(LOGIN_ATTEMPTS_PER_IP)
+
+def client_ip():
+    """Client address as appended by the outermost trusted proxy, or None.
+
+    Entries left of it come from the client and can be anything. Streamlit
+    does not expose the peer address itself, so without a trusted proxy
+    the client is unknown.
+    """
+    if not TRUSTED_PROXIES:
+        return None
+    hops = [h.strip() for h in st.context.headers.get("X-Forwarded-For", "").split(",") if h.strip()]
+    return hops[-TRUSTED_PROXIES] if len(hops) >= TRUSTED_PROXIES else None
+
+def throttle_wait(username: str) -> float:
+    """Seconds this client must wait before another password attempt (0 if none).
+    The per-IP limit only applies when the client address is known."""
+    user_throttle, ip_throttle = get_login_throttles()
+    ip = client_ip()
+    return max(ip_throttle.hit(ip) if ip else 0, user_throttle.hit(username) if username else 0)
 
 def log_user_action(content_id, action, username):
-    timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    content_collection.update_one(
-        {"content_id": content_id},
-        {
-            "$push": {
-                "users": {
-                    "username": username,
-                    "action": action,
-                    "datetime": timestamp_str
-                }
-            }
-        },
-        upsert=True
-    )
-    users_collection.update_one(
-        {"username": username},
-        {
-            "$push": {
-                "activity_logs": {
-                    "content_id": content_id,
-                    "action": action,
-                    "datetime": timestamp_str
-                }
-            }
-        }
+    store.log_action(username, content_id, action)
+
+def set_session_cookie(token, max_age):
+    """Store the session token in a cookie from the browser (max_age=0
+    deletes it); st.context.cookies sees it from the next connection on."""
+    components.html(
+        "<script>parent.document.cookie = "
+        f"'{sessions.COOKIE_NAME}={token}; path=/; max-age={max_age}; SameSite=Strict'"
+        " + (parent.location.protocol === 'https:' ? '; Secure' : '');</script>",
+        height=0,
     )
 
+def logout():
+    """Give back the open passage, end the session server-side and drop the cookie."""
+    current_id = st.session_state.get("current_content_id")
+    if current_id:
+        store.release(current_id, st.session_state["username"])
+    if "session_token" in st.session_state:
+        get_session_store().revoke(st.session_state["session_token"])
+    language = st.session_state["language"]
+    st.session_state.clear()
+    st.session_state.update(language=language, session_checked=True, clear_cookie=True)
+    rerun_timer.finish("rerun")
+    st.rerun()
+
 # ------------------------------------------------------------------------------
 # 4) Session State Defaults
 # ------------------------------------------------------------------------------
@@ -297,8 +410,24 @@ if "username" not in st.session_state:
     st.session_state["username"] = None
 if "show_instructions" not in st.session_state:
     st.session_state["show_instructions"] = False
-if "skipped_ids" not in st.session_state:
-    st.session_state["skipped_ids"] = []
+
+# Older links carried the session token in the URL; never leave it there.
+if "session" in st.query_params:
+    del st.query_params["session"]
+
+# A reload or reconnect starts a fresh session_state; the session cookie
+# logs the annotator back in without bcrypt and reopens their passage.
+if db is not None and not st.session_state["logged_in"] and not st.session_state.get("session_checked"):
+    st.session_state["session_checked"] = True
+    token = st.context.cookies.get(sessions.COOKIE_NAME)
+    restored = get_session_store().resolve(token) if token else None
+    if restored:
+        st.session_state["logged_in"] = True
+        st.session_state["username"] = restored["username"]
+        st.session_state["session_token"] = token
+        st.session_state["remembered_content_id"] = restored["content_id"]
+        if restored["content_id"]:
+            st.session_state["resume_content_id"] = restored["content_id"]
 
 L = LANG_TEXT[st.session_state["language"]]
 
@@ -335,6 +464,8 @@ if st.session_state["show_instructions"]:
 # 7) Login / Register if not logged in
 # ------------------------------------------------------------------------------
 if not st.session_state["logged_in"]:
+    if st.session_state.pop("clear_cookie", False):
+        set_session_cookie("", 0)
     auth_choice = st.radio(L["choose_action"], [L["login_label"], L["register_label"]], key="auth_radio")
     
     if auth_choice == L["register_label"]:
@@ -342,11 +473,19 @@ if not st.session_state["logged_in"]:
         reg_password = st.text_input(L["new_password"], type="password", key="reg_pass")
         if st.button(L["register_btn"], key="register_btn"):
             if reg_username.strip() and reg_password.strip():
-                success = register_user(reg_username, reg_password)
-                if success:
-                    st.success(L["register_success"])
+                wait = throttle_wait(reg_username)
+                if wait:
+                    st.error(L["throttled"].format(seconds=int(wait) + 1))
                 else:
-                    st.error(L["register_error"])
+                    try:
+                        success = store.register_user(reg_username, reg_password)
+                    except passwords.PasswordBusy:
+                        st.error(L["password_busy"])
+                    else:
+                        if success:
+                            st.success(L["register_success"])
+                        else:
+                            st.error(L["register_error"])
             else:
                 st.error(L["fill_error"])
     else:
@@ -354,88 +493,233 @@ if not st.session_state["logged_in"]:
         log_password = st.text_input(L["login_password"], type="password", key="login_pass")
         if st.button(L["login_btn"], key="login_btn"):
             if log_username.strip() and log_password.strip():
-                success = login_user(log_username, log_password)
-                if success:
-                    st.session_state["logged_in"] = True
-                    st.session_state["username"] = log_username
-                    st.session_state["show_instructions"] = True
-                    st.stop()
+                wait = throttle_wait(log_username)
+                if wait:
+                    st.error(L["throttled"].format(seconds=int(wait) + 1))
                 else:
-                    st.error(L["login_error"])
+                    try:
+                        success = store.login_user(log_username, log_password)
+                    except passwords.PasswordBusy:
+                        st.error(L["password_busy"])
+                    else:
+                        if success:
+                            st.session_state["logged_in"] = True
+                            st.session_state["username"] = log_username
+                            if db is not None:
+                                st.session_state["session_token"] = get_session_store().issue(log_username)
+                                set_session_cookie(st.session_state["session_token"], sessions.SESSION_SECONDS)
+                            st.session_state["show_instructions"] = True
+                            stop_run()
+                        else:
+                            st.error(L["login_error"])
             else:
                 st.error(L["login_fill_error"])
     
-    st.stop()
+    stop_run()
 else:
     st.markdown(L["welcome_user"].format(username=st.session_state["username"]))
+    if st.sidebar.button(L["logout_btn"], key="logout_btn"):
+        logout()
+
+# ------------------------------------------------------------------------------
+# 7b) PROGRESS DASHBOARD
+# ------------------------------------------------------------------------------
+@st.fragment(run_every=60)
+def progress_dashboard():
+    """Show the latest background snapshot; never runs the aggregation itself."""
+    st.subheader(L["dashboard_title"])
+    stats = get_progress_stats().snapshot()
+    if not stats:
+        st.info(L["dashboard_pending"])
+        return
+    cols = st.columns(5)
+    cols[0].metric(L["dashboard_total"], stats["passages"])
+    cols[1].metric(L["dashboard_empty"], stats["empty"])
+    cols[2].metric(L["dashboard_partial"], stats["partial"])
+    cols[3].metric(L["dashboard_complete"], stats["complete"])
+    cols[4].metric(L["dashboard_balanced"], stats["balanced"])
+    st.write(f"**{L['dashboard_difficulty']}**")
+    st.bar_chart({"questions": stats["difficulty"]})
+    st.caption(L["dashboard_updated"].format(
+        when=stats["computed_at"].strftime("%Y-%m-%d %H:%M"),
+        minutes=progress.REFRESH_SECONDS // 60,
+    ))
+
+LEADERBOARD_DAYS = (1, 7, 30)
+
+def leaderboard_view():
+    """Per-annotator totals read straight from the daily counters."""
+    st.subheader(L["leaderboard_title"])
+    period = st.selectbox(L["leaderboard_period"], range(len(LEADERBOARD_DAYS)),
+                          format_func=lambda i: L["leaderboard_periods"][i], key="leaderboard_period")
+    rows = events.leaderboard(db["events"], *events.day_range(LEADERBOARD_DAYS[period]))
+    if not rows:
+        st.info(L["leaderboard_empty"])
+        return
+    st.dataframe(
+        [{L["leaderboard_user"]: r["username"], L["leaderboard_total"]: r["total"], **r["counts"]} for r in rows],
+        hide_index=True,
+    )
+
+if db is not None and st.sidebar.toggle(L["dashboard_toggle"], key="show_dashboard"):
+    progress_dashboard()
+    leaderboard_view()
+    stop_run()
 
 # ------------------------------------------------------------------------------
 # 8) SEARCH BOX
 # ------------------------------------------------------------------------------
+def open_passage(doc):
+    """Make `doc` the passage being edited.
+
+    Its questions and version are kept in session_state as the snapshot
+    the edit widgets are drawn from and Save Changes merges against, so
+    saves by others only show up when this user saves or reopens it.
+    """
+    st.session_state["current_content_id"] = doc["content_id"]
+    st.session_state["questions"] = doc.get("questions", [])
+    st.session_state["version"] = doc.get("version", 0)
+    # Drawn from on the next render instead of reading the passage again.
+    st.session_state["opened_doc"] = doc
+
+def reload_passage(content_id, kind, message, doc=None):
+    """After this user's own write: refresh the snapshot and rerun at once,
+    showing `message` with st.<kind> on the rerun. Pass `doc` if the
+    passage has just been re-read anyway.
+
+    A widget whose value changes is a new widget, so if the page were left
+    as drawn from the old snapshot, the next edit typed into it would be
+    dropped.
+    """
+    doc = doc or store.get_content(content_id)
+    if doc:
+        open_passage(doc)
+    st.session_state["flash"] = (kind, message)
+    rerun_timer.finish("rerun")
+    st.rerun()
+
+def open_content(content_id):
+    """Switch the editor to `content_id`, giving up the lease on the previous item."""
+    found = store.get_content(content_id)
+    if not found:
+        return False
+    previous_id = st.session_state.get("current_content_id")
+    if previous_id and previous_id != found["content_id"]:
+        store.release(previous_id, st.session_state["username"])
+    open_passage(found)
+    return True
+
 search_id = st.text_input(L["search_id"], key="search_box")
 search_button = st.button(L["search_btn"], key="search_btn")
 if search_button:
-    found = content_collection.find_one({"content_id": search_id})
-    if found:
-        st.session_state["current_content_id"] = found["content_id"]
-        st.session_state["questions"] = found.get("questions", [])
-    else:
+    if not open_content(search_id):
         st.error(L["search_err"].format(search_id=search_id))
 
+# 8b) FULL-TEXT SEARCH
+if db is not None:
+    text_query = st.text_input(L["text_search"], key="text_search_box")
+    if st.button(L["text_search_btn"], key="text_search_btn"):
+        if search_index.match_expression(text_query):
+            st.session_state["text_results"] = get_search_index().search(text_query)
+        else:
+            st.session_state.pop("text_results", None)
+            st.error(L["text_search_short"])
+    if "text_results" in st.session_state:
+        if not st.session_state["text_results"]:
+            st.info(L["text_search_none"])
+        for hit in st.session_state["text_results"]:
+            hit_left, hit_right = st.columns([6, 2])
+            with hit_left:
+                st.markdown(hit["question_snippet"] or hit["snippet"])
+            with hit_right:
+                if st.button(L["text_search_open"].format(content_id=hit["content_id"]), key=f"open_{hit['content_id']}"):
+                    open_content(hit["content_id"])
+                    st.session_state.pop("text_results", None)
+                    rerun_timer.finish("rerun")
+                    st.rerun()
+
 # ------------------------------------------------------------------------------
 # 9) AUTO-FETCH LOGIC
 # ------------------------------------------------------------------------------
 def fetch_next_content():
-    query_empty = {
-        "questions": {"$size": 0},
-        "content_id": {"$nin": st.session_state["skipped_ids"]},
-    }
-    doc = content_collection.find_one(query_empty)
-    if not doc:
-        query_lt6 = {
-            "$expr": {"$lt": [{"$size": "$questions"}, 6]},
-            "content_id": {"$nin": st.session_state["skipped_ids"]},
-        }
-        doc = content_collection.find_one(query_lt6)
-
-    if not doc:
-        if st.session_state["skipped_ids"]:
-            skipped_id = st.session_state["skipped_ids"].pop(0)
-            doc = content_collection.find_one({"content_id": skipped_id})
+    username = st.session_state["username"]
+    if "prefetch" not in st.session_state:
+        st.session_state["prefetch"] = store.prefetch_buffer(username)
+
+    # Claim the next passage nobody else is working on (empty first, then < 6),
+    # then skipped items, oldest first, passing over any claimed by others.
+    doc = store.fetch_next(username, buffer=st.session_state["prefetch"])
 
     if doc:
-        st.session_state["current_content_id"] = doc["content_id"]
-        st.session_state["questions"] = doc.get("questions", [])
+        open_passage(doc)
+        st.session_state["lease_renewed_at"] = datetime.now()
     else:
         st.warning(L["no_more_items"])
-        st.stop()
+        stop_run()
+
+@st.fragment(run_every=work_queue.HEARTBEAT_SECONDS)
+def lease_heartbeat():
+    """Keep the current passage reserved while it is open, even with no interaction."""
+    current_id = st.session_state.get("current_content_id")
+    last_renewed = st.session_state.get("lease_renewed_at")
+    if not current_id:
+        return
+    if last_renewed and (datetime.now() - last_renewed).total_seconds() < work_queue.HEARTBEAT_SECONDS:
+        return
+    store.renew(current_id, st.session_state["username"])
+    st.session_state["lease_renewed_at"] = datetime.now()
+
+if "resume_content_id" in st.session_state:
+    # Back after a reload: reopen the passage if nobody else has taken it since.
+    resumed = store.claim(st.session_state.pop("resume_content_id"), st.session_state["username"])
+    if resumed:
+        open_passage(resumed)
+        st.session_state["lease_renewed_at"] = datetime.now()
 
 if "current_content_id" not in st.session_state:
     fetch_next_content()
 
+lease_heartbeat()
+
 # ------------------------------------------------------------------------------
 # 10) SHOW & EDIT CURRENT CONTENT
 # ------------------------------------------------------------------------------
 if "current_content_id" in st.session_state:
-    content_data = content_collection.find_one({"content_id": st.session_state["current_content_id"]})
+    if "session_token" in st.session_state and st.session_state.get("remembered_content_id") != st.session_state["current_content_id"]:
+        get_session_store().remember_content(st.session_state["session_token"], st.session_state["current_content_id"])
+        st.session_state["remembered_content_id"] = st.session_state["current_content_id"]
+    content_data = st.session_state.pop("opened_doc", None)
+    if not content_data or content_data["content_id"] != st.session_state["current_content_id"]:
+        content_data = store.get_content(st.session_state["current_content_id"])
+    if db is not None:
+        cache_stats = store.body_cache.stats()
+        st.sidebar.caption(
+            f"Content cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} entries ({cache_stats['bytes'] // 1024} KiB)"
+        )
+        st.sidebar.caption(f"Audit queue depth: {store.event_writer.depth()}")
     if content_data:
         st.subheader(L["content_id_retrieved"].format(content_id=content_data["content_id"]))
         st.text_area(L["content_box_label"], value=content_data.get("content", ""), height=300, disabled=True)
 
-        questions_list = content_data.get("questions", [])
+        # The snapshot taken when the passage was opened, not what is stored
+        # now: the widgets keep what this user typed, and Save Changes merges
+        # from the version they started editing.
+        questions_list = st.session_state["questions"]
         st.write(L["total_questions"].format(count=len(questions_list)))
 
         # 10a) EDIT/DELETE
         if questions_list:
             st.write(L["existing_questions"])
-            updated_questions = []
+            edited_questions = []
+            deleted_qids = []
             for idx, q in enumerate(questions_list, start=1):
                 st.write(f"**{L['edit_question_label'].format(idx=idx)}**")
 
                 question_text = st.text_area(
                     f"{L['edit_question_label'].format(idx=idx)}",
                     value=q["question"],
-                    key=f"edit_q_{idx}"
+                    key=f"edit_q_{q['qid']}"
                 )
                 diff_options = ["easy", "medium", "hard"]
                 difficulty_index = diff_options.index(q["difficulty"])
@@ -444,34 +728,63 @@ if "current_content_id" in st.session_state:
                     difficulty_label,
                     diff_options,
                     index=difficulty_index,
-                    key=f"edit_d_{idx}"
+                    key=f"edit_d_{q['qid']}"
                 )
                 answer_text = q.get("answer", "")
 
                 # "Delete question" checkbox
-                delete_flag = st.checkbox(L["delete_question_label"].format(idx=idx), key=f"delete_{idx}")
-                if not delete_flag:
-                    updated_questions.append({
-                        "question": question_text,
-                        "difficulty": difficulty_choice,
-                        "answer": answer_text
-                    })
-                else:
+                delete_flag = st.checkbox(L["delete_question_label"].format(idx=idx), key=f"delete_{q['qid']}")
+                edited_questions.append({
+                    "question": question_text,
+                    "difficulty": difficulty_choice,
+                    "answer": answer_text
+                })
+                if delete_flag:
+                    deleted_qids.append(q["qid"])
                     st.warning(L["delete_warning"].format(idx=idx))
 
             if st.button(L["save_changes_btn"], key="save_changes_btn"):
-                content_collection.update_one(
-                    {"content_id": content_data["content_id"]},
-                    {"$set": {"questions": updated_questions}}
+                # Only the questions/fields that changed are written, guarded on the
+                # version we loaded; concurrent edits to other questions are merged.
+                changes = content_ops.question_changes(questions_list, edited_questions)
+                saved, conflicts = store.save_question_edits(
+                    content_data["content_id"],
+                    st.session_state["version"],
+                    questions_list,
+                    edited_questions,
+                    deleted=deleted_qids
                 )
-                # Log user actions
-                if len(updated_questions) < len(questions_list):
+                stored = store.get_content(content_data["content_id"]) if saved or conflicts else None
+
+                # Log and release on what actually landed, not on what was asked for.
+                if saved and any(qid not in conflicts for qid in deleted_qids):
                     log_user_action(content_data["content_id"], "deleted question(s)", st.session_state["username"])
-                if updated_questions != questions_list:
+                if saved and any(qid not in conflicts and qid not in deleted_qids for qid in changes):
                     log_user_action(content_data["content_id"], "edited questions", st.session_state["username"])
+                if saved and stored and len(stored.get("questions", [])) >= content_ops.TARGET_QUESTIONS:
+                    store.release(content_data["content_id"], st.session_state["username"])
+                if db is not None:
+                    dedup.reindex_edits(
+                        db["question_signatures"],
+                        content_data["content_id"],
+                        changes,
+                        deleted=deleted_qids,
+                        skip=conflicts
+                    )
+                    get_search_index().refresh(db["content_data"], content_data["content_id"])
+
+                if conflicts:
+                    positions = {q["qid"]: i for i, q in enumerate(questions_list, start=1)}
+                    reload_passage(content_data["content_id"], "warning", L["merge_conflict"].format(
+                        nums=", ".join(str(positions[qid]) for qid in conflicts)), doc=stored)
+                elif saved:
+                    reload_passage(content_data["content_id"], "success", L["changes_saved"], doc=stored)
+                else:
+                    st.info(L["no_changes"])
 
-                st.success(L["changes_saved"])
-                # Do NOT call st.stop() here, so the rest of the page (including "Fetch Next") is visible.
+        if "flash" in st.session_state:
+            kind, message = st.session_state.pop("flash")
+            getattr(st, kind)(message)
 
         # 10b) ADD NEW
         st.subheader(L["add_new_question_subheader"])
@@ -479,23 +792,28 @@ if "current_content_id" in st.session_state:
         new_difficulty = st.selectbox(L["difficulty_select_label"], ["easy", "medium", "hard"], key="new_diff")
 
         if st.button(L["save_question_btn"], key="save_question_btn"):
-            if new_question.strip():
-                content_collection.update_one(
-                    {"content_id": content_data["content_id"]},
-                    {
-                        "$push": {
-                            "questions": {
-                                "question": new_question,
-                                "difficulty": new_difficulty,
-                                "answer": ""
-                            }
-                        }
-                    },
-                    upsert=True
-                )
+            # Warn once about near-duplicates; a second click with the same text saves anyway.
+            duplicates = []
+            if db is not None and new_question.strip() and st.session_state.get("duplicate_confirmed") != new_question:
+                duplicates = dedup.find_similar(db["question_signatures"], new_question)
+            if duplicates:
+                st.session_state["duplicate_confirmed"] = new_question
+                st.warning(L["duplicate_warning"] + "\n" + "\n".join(L["duplicate_item"].format(**d) for d in duplicates))
+            elif new_question.strip():
+                st.session_state.pop("duplicate_confirmed", None)
+                new_entry = {
+                    "question": new_question,
+                    "difficulty": new_difficulty,
+                    "answer": ""
+                }
+                store.add_question(content_data["content_id"], new_entry)
+                if db is not None:
+                    dedup.index_question(db["question_signatures"], content_data["content_id"], new_entry["qid"], new_question)
+                    get_search_index().refresh(db["content_data"], content_data["content_id"])
                 log_user_action(content_data["content_id"], "added question", st.session_state["username"])
-                st.success(L["changes_saved"])
-                # Again, do NOT call st.stop() so the "Fetch Next Content" button is shown.
+                if len(questions_list) + 1 >= content_ops.TARGET_QUESTIONS:
+                    store.release(content_data["content_id"], st.session_state["username"])
+                reload_passage(content_data["content_id"], "success", L["changes_saved"])
             else:
                 st.error(L["empty_q_error"])
 
@@ -506,8 +824,11 @@ st.subheader(L["fetch_next_subheader"])
 if st.button(L["fetch_next_btn"], key="fetch_next_btn"):
     current_id = st.session_state.get("current_content_id")
     if current_id:
-        st.session_state["skipped_ids"].append(current_id)
+        store.skip(st.session_state["username"], current_id)
         log_user_action(current_id, "skipped", st.session_state["username"])
         st.session_state.pop("current_content_id", None)
         st.session_state.pop("questions", None)
-    st.stop()
+        st.session_state.pop("version", None)
+    stop_run()
+
+rerun_timer.finish()
@@ -0,0 +1,344 @@
+"""Microbenchmarks for the data-access hot paths, with stored baselines.
+
+Each case times one storage operation the app runs on every interaction:
+
+    fetch_next      Fetch Next Content (claim; the lease is released untimed)
+    get_content     loading the open passage
+    save_edits      Save Changes (one question's text edited)
+    add_question    Save Question
+    log_action      log_user_action
+    register_user   Register (bcrypt at BCRYPT_ROUNDS)
+    login_user      Login (bcrypt at BCRYPT_ROUNDS)
+
+and, on Mongo only:
+
+    fetch_prefetched  Fetch Next Content as the app runs it, through the
+                      session's prefetch buffer
+    progress          the progress dashboard's $facet aggregation
+
+on backends seeded with synthetic corpora of each size and
+questions-per-passage distribution. memory and sqlite run by default;
+`--backend mongo` runs against a real server (--mongo-url), configured as
+app_1_working.py configures it, so fetch_next times the keyset claim and
+save_edits the arrayFilters bulk_write. Its database (--database,
+Q_and_A_bench by default) is dropped and reseeded for every corpus. A
+result key is backend/size/distribution/case; each result holds the
+median and p95 per operation in microseconds.
+
+Usage:
+    python bench.py --save bench_baseline.json
+    python bench.py --compare bench_baseline.json [--threshold 0.2]
+    python bench.py --backend sqlite --sizes 10000 --distributions mixed
+    python bench.py --backend mongo --mongo-url mongodb://localhost:27017 --sizes 10000,100000
+
+--compare exits with status 1 if any case's median is slower than the
+baseline by more than --threshold (a fraction). Compare runs made on the
+same machine; the file records where a baseline came from.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from pymongo import MongoClient
+
+import content_cache
+import content_ops
+import passwords
+import progress
+import storage
+from loadtest import percentile, synthetic_text
+
+# Run by default; "mongo" needs a server and is only run when asked for.
+BACKENDS = ("memory", "sqlite")
+ALL_BACKENDS = (*BACKENDS, "mongo")
+MONGO_URL = "mongodb://localhost:27017"
+MONGO_DATABASE = "Q_and_A_bench"
+SIZES = (10_000, 100_000, 1_000_000)
+
+# Questions per passage when the corpus is seeded.
+DISTRIBUTIONS = {
+    # A fresh import: nothing annotated yet.
+    "empty": lambda rng: 0,
+    # Work in progress: every count from 0 to TARGET_QUESTIONS equally likely.
+    "mixed": lambda rng: rng.randint(0, content_ops.TARGET_QUESTIONS),
+    # Near the end: 90% of passages complete, the queue is the remaining 10%.
+    "nearly_done": lambda rng: (
+        content_ops.TARGET_QUESTIONS if rng.random() < 0.9 else rng.randint(0, content_ops.TARGET_QUESTIONS - 1)
+    ),
+}
+
+# Timed operations per case; bcrypt cases and full-corpus aggregations are deliberately few.
+ITERATIONS = {"register_user": 20, "login_user": 20, "progress": 20}
+DEFAULT_ITERATIONS = 1000
+WARMUP = 10
+
+SEED_BATCH = 10_000
+
+# ------------------------------------------------------------------------------
+# 1) Corpus
+# ------------------------------------------------------------------------------
+def open_backend(name, workdir, mongo_url=MONGO_URL, database=MONGO_DATABASE):
+    """A fresh, empty backend."""
+    if name == "memory":
+        return storage.MemoryStorage()
+    if name == "mongo":
+        client = MongoClient(mongo_url)
+        client.drop_database(database)
+        return storage.MongoStorage(client[database], write_behind=True, body_cache=content_cache.LRUCache())
+    return storage.SQLiteStorage(os.path.join(workdir, "bench.sqlite"))
+
+def seed(store, size, distribution, rng):
+    """Import `size` synthetic passages whose question counts follow `distribution`."""
+    count_for = DISTRIBUTIONS[distribution]
+    for start in range(0, size, SEED_BATCH):
+        store.import_documents([
+            {
+                "content_id": f"b-{i:07d}",
+                "content": synthetic_text(rng, 30),
+                "questions": [
+                    {"question": synthetic_text(rng, 8) + "?", "difficulty": content_ops.DIFFICULTIES[j % 3], "answer": ""}
+                    for j in range(count_for(rng))
+                ],
+            }
+            for i in range(start, min(start + SEED_BATCH, size))
+        ])
+
+# ------------------------------------------------------------------------------
+# 2) Cases
+# ------------------------------------------------------------------------------
+# A case is set up once per corpus and returns (op, before, after): `op(arg)`
+# is the timed operation, `before()` prepares its argument and `after(result)`
+# cleans up, both untimed.
+def random_id(size, rng):
+    return f"b-{rng.randrange(size):07d}"
+
+def case_fetch_next(store, size, rng):
+    # Release every claim, so each fetch sees the same queue a new session would.
+    return (
+        lambda _: store.fetch_next("bench-user"),
+        None,
+        lambda doc: doc and store.release(doc["content_id"], "bench-user"),
+    )
+
+def case_fetch_prefetched(store, size, rng):
+    buffer = store.prefetch_buffer("bench-user")
+    return (
+        lambda _: store.fetch_next("bench-user", buffer=buffer),
+        None,
+        lambda doc: doc and store.release(doc["content_id"], "bench-user"),
+    )
+
+def case_get_content(store, size, rng):
+    return (lambda content_id: store.get_content(content_id)), (lambda: random_id(size, rng)), None
+
+def case_save_edits(store, size, rng):
+    # Edit within a fixed pool of passages, given a question first if they
+    # have none (as in the "empty" corpus).
+    pool = list(dict.fromkeys(random_id(size, rng) for _ in range(100)))
+    for content_id in pool:
+        if not store.get_content(content_id)["questions"]:
+            store.add_question(content_id, {"question": synthetic_text(rng, 8) + "?", "difficulty": "easy", "answer": ""})
+
+    def before():
+        doc = store.get_content(rng.choice(pool))
+        edited = [dict(q) for q in doc["questions"]]
+        edited[rng.randrange(len(edited))]["question"] = synthetic_text(rng, 8) + "?"
+        return doc, edited
+
+    def op(arg):
+        doc, edited = arg
+        return store.save_question_edits(doc["content_id"], doc["version"], doc["questions"], edited)
+    return op, before, None
+
+def case_add_question(store, size, rng):
+    def before():
+        question = {"question": synthetic_text(rng, 8) + "?", "difficulty": rng.choice(content_ops.DIFFICULTIES), "answer": ""}
+        return random_id(size, rng), question
+    return (lambda arg: store.add_question(*arg)), before, None
+
+def case_log_action(store, size, rng):
+    return (lambda content_id: store.log_action("bench-user", content_id, "added question")), (lambda: random_id(size, rng)), None
+
+def case_progress(store, size, rng):
+    return (lambda _: progress.compute_progress(store.content_collection)), None, None
+
+def case_register_user(store, size, rng):
+    names = iter(range(10**9))
+    return (lambda name: store.register_user(name, "bench-password")), (lambda: f"bench-{next(names)}"), None
+
+def case_login_user(store, size, rng):
+    store.register_user("bench-login", "bench-password")
+    return (lambda _: store.login_user("bench-login", "bench-password")), None, None
+
+CORPUS_CASES = {
+    "fetch_next": case_fetch_next,
+    "get_content": case_get_content,
+    "save_edits": case_save_edits,
+    "add_question": case_add_question,
+    "log_action": case_log_action,
+}
+# Need the Mongo collections.
+MONGO_CASES = {
+    "fetch_prefetched": case_fetch_prefetched,
+    "progress": case_progress,
+}
+# Independent of the corpus: run once per backend.
+USER_CASES = {
+    "register_user": case_register_user,
+    "login_user": case_login_user,
+}
+
+# ------------------------------------------------------------------------------
+# 3) Timing
+# ------------------------------------------------------------------------------
+def measure(op, before=None, after=None, iterations=DEFAULT_ITERATIONS, warmup=WARMUP):
+    """{"median_us", "p95_us", "iterations"} over `iterations` timed calls."""
+    samples = []
+    for i in range(warmup + iterations):
+        arg = before() if before else None
+        started = time.perf_counter_ns()
+        result = op(arg)
+        elapsed = time.perf_counter_ns() - started
+        if after:
+            after(result)
+        if i >= warmup:
+            samples.append(elapsed / 1000)
+    samples.sort()
+    return {"median_us": percentile(samples, 50), "p95_us": percentile(samples, 95), "iterations": iterations}
+
+def run(backends=BACKENDS, sizes=SIZES, distributions=tuple(DISTRIBUTIONS), cases=None, scale=1.0, seed_value=0,
+        mongo_url=MONGO_URL, database=MONGO_DATABASE, out=sys.stderr):
+    """Run every selected case; returns {key: result}."""
+    results = {}
+
+    def selected(table):
+        return {name: factory for name, factory in table.items() if cases is None or name in cases}
+
+    for backend in backends:
+        workdir = tempfile.mkdtemp(prefix="bench-")
+        corpus_cases = {**CORPUS_CASES, **(MONGO_CASES if backend == "mongo" else {})}
+        try:
+            store = open_backend(backend, workdir, mongo_url, database)
+            for name, factory in selected(USER_CASES).items():
+                op, before, after = factory(store, 0, random.Random(f"{seed_value}/{name}"))
+                results[f"{backend}/{name}"] = measure(op, before, after, max(1, int(ITERATIONS[name] * scale)), warmup=2)
+                print(f"{backend}/{name}: {results[f'{backend}/{name}']['median_us']:,.1f} us", file=out)
+            store.close()
+
+            for size in sizes:
+                for distribution in distributions:
+                    store = open_backend(backend, tempfile.mkdtemp(dir=workdir), mongo_url, database)
+                    started = time.perf_counter()
+                    seed(store, size, distribution, random.Random(seed_value))
+                    print(f"{backend}/{size}/{distribution}: seeded in {time.perf_counter() - started:.1f}s", file=out)
+                    for name, factory in selected(corpus_cases).items():
+                        # Each case draws from its own generator, so its inputs do not
+                        # depend on which other cases ran before it.
+                        op, before, after = factory(store, size, random.Random(f"{seed_value}/{name}"))
+                        key = f"{backend}/{size}/{distribution}/{name}"
+                        results[key] = measure(op, before, after, max(1, int(ITERATIONS.get(name, DEFAULT_ITERATIONS) * scale)))
+                        print(f"{key}: {results[key]['median_us']:,.1f} us", file=out)
+                    store.close()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+# ------------------------------------------------------------------------------
+# 4) Baselines
+# ------------------------------------------------------------------------------
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "bcrypt_rounds": passwords.ROUNDS,
+        "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+def save_baseline(path, results):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def compare(baseline, results, threshold=0.2):
+    """Rows of (key, baseline median, current median, ratio, regressed) for
+    every key in both, slowest change first."""
+    rows = []
+    for key, current in results.items():
+        before = baseline["results"].get(key)
+        if not before or not before["median_us"]:
+            continue
+        ratio = current["median_us"] / before["median_us"]
+        rows.append((key, before["median_us"], current["median_us"], ratio, ratio > 1 + threshold))
+    rows.sort(key=lambda row: row[3], reverse=True)
+    return rows
+
+def print_comparison(rows, baseline, threshold, out=sys.stdout):
+    env = baseline.get("environment", {})
+    print(f"Baseline from {env.get('recorded_at', '?')} on {env.get('platform', '?')} "
+          f"(bcrypt rounds {env.get('bcrypt_rounds', '?')})", file=out)
+    print(f"{'case':<44}{'baseline us':>14}{'now us':>14}{'change':>10}", file=out)
+    for key, before, now, ratio, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{key:<44}{before:>14,.1f}{now:>14,.1f}{ratio - 1:>+10.1%}{flag}", file=out)
+    regressions = sum(row[4] for row in rows)
+    print(f"{regressions} regression(s) over {threshold:.0%} in {len(rows)} case(s).", file=out)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", action="append", choices=ALL_BACKENDS,
+                        help=f"Repeatable; default {', '.join(BACKENDS)}.")
+    parser.add_argument("--mongo-url", default=MONGO_URL, help="Server for --backend mongo.")
+    parser.add_argument("--database", default=MONGO_DATABASE, help="Mongo database, dropped and reseeded per corpus.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="Comma-separated corpus sizes.")
+    parser.add_argument("--distributions", default=",".join(DISTRIBUTIONS),
+                        help=f"Comma-separated, from: {', '.join(DISTRIBUTIONS)}.")
+    parser.add_argument("--case", action="append", choices=[*CORPUS_CASES, *MONGO_CASES, *USER_CASES],
+                        help="Repeatable; default all.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the iterations per case.")
+    parser.add_argument("--seed", type=int, default=0)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--save", metavar="FILE", help="Write the results as a baseline.")
+    mode.add_argument("--compare", metavar="FILE", help="Compare with a saved baseline.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown before a case is flagged.")
+    args = parser.parse_args(argv)
+
+    distributions = args.distributions.split(",")
+    unknown = [d for d in distributions if d not in DISTRIBUTIONS]
+    if unknown:
+        parser.error(f"unknown distribution(s): {', '.join(unknown)}")
+    if args.database == "Q_and_A":
+        parser.error("refusing to benchmark the production database; pass another --database")
+    results = run(
+        backends=args.backend or BACKENDS,
+        sizes=[int(size) for size in args.sizes.split(",")],
+        distributions=distributions,
+        cases=args.case,
+        scale=args.scale,
+        seed_value=args.seed,
+        mongo_url=args.mongo_url,
+        database=args.database,
+    )
+    if args.save:
+        save_baseline(args.save, results)
+        print(f"Wrote {len(results)} result(s) to {args.save}.")
+    elif args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if print_comparison(compare(baseline, results, args.threshold), baseline, args.threshold):
+            sys.exit(1)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+if __name__ == "__main__":
+    main()
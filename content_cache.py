@@ -0,0 +1,106 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from pymongo import UpdateOne
+
+import metrics
+from content_ops import BODY_FIELDS, QUESTIONS_FIELDS
+
+# Upper bound on the UTF-8 size of all cached passage bodies.
+MAX_BYTES = 64 * 1024 * 1024
+
+def content_hash(content):
+    """Fingerprint of a passage body, stored as `content_hash` next to it."""
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+# ------------------------------------------------------------------------------
+# 1) LRU Cache
+# ------------------------------------------------------------------------------
+class LRUCache:
+    """Thread-safe LRU mapping bounded by the total size of its string values.
+
+    One instance is shared by every Streamlit session in the process (see
+    `st.cache_resource` in the apps), so the hit/miss counters reflect the
+    whole server.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._size -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self._size -= evicted
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._data), "bytes": self._size}
+
+# ------------------------------------------------------------------------------
+# 2) Read Path
+# ------------------------------------------------------------------------------
+def load_content(content_collection, cache, content_id):
+    """Fetch a passage for display, reading only the mutable fields from Mongo.
+
+    Returns the document with `content` filled in from the cache (one
+    extra query on a miss), or None if the content_id does not exist.
+    """
+    doc = content_collection.find_one({"content_id": content_id}, QUESTIONS_FIELDS)
+    if not doc:
+        return None
+    key = (content_id, doc.get("content_hash"))
+    body = cache.get(key)
+    metrics.inc("content_cache_requests_total", result="miss" if body is None else "hit")
+    if body is None:
+        body_doc = content_collection.find_one({"content_id": content_id}, BODY_FIELDS) or {}
+        body = body_doc.get("content", "")
+        cache.put(key, body)
+    doc["content"] = body
+    return doc
+
+# ------------------------------------------------------------------------------
+# 3) One-time Backfill
+# ------------------------------------------------------------------------------
+def backfill_content_hash(content_collection, batch_size=1000):
+    """Store `content_hash` on documents that lack it, streaming in batches."""
+    modified = 0
+    ops = []
+    cursor = content_collection.find(
+        {"content_hash": {"$exists": False}, "content": {"$type": "string"}},
+        {"_id": 1, "content": 1},
+        batch_size=batch_size,
+    )
+    for doc in cursor:
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"content_hash": content_hash(doc["content"])}}))
+        if len(ops) >= batch_size:
+            modified += content_collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        modified += content_collection.bulk_write(ops, ordered=False).modified_count
+    return modified
@@ -0,0 +1,364 @@
+import logging
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+
+import text_norm
+
+logger = logging.getLogger(__name__)
+
+# Number of questions a passage needs before it leaves the work queue
+# (2 easy + 2 medium + 2 hard, see instructions.py).
+TARGET_QUESTIONS = 6
+DIFFICULTIES = ("easy", "medium", "hard")
+PER_DIFFICULTY = TARGET_QUESTIONS // len(DIFFICULTIES)
+
+# ------------------------------------------------------------------------------
+# 0) Projections
+# ------------------------------------------------------------------------------
+# Every read names the fields it needs, so the unbounded `users` and
+# `activity_logs` arrays never travel over the wire.
+QUEUE_FIELDS = {"_id": 0, "content_id": 1, "questions": 1, "question_count": 1, "version": 1}
+QUESTIONS_FIELDS = {"_id": 0, "content_id": 1, "content_hash": 1, "questions": 1, "question_count": 1, "version": 1}
+BODY_FIELDS = {"_id": 0, "content": 1}
+DISPLAY_FIELDS = {"_id": 0, "content_id": 1, "content": 1, "questions": 1}
+EXISTS_FIELDS = {"_id": 1}
+PASSWORD_FIELDS = {"_id": 0, "hashed_password": 1}
+
+# ------------------------------------------------------------------------------
+# 1) Indexes
+# ------------------------------------------------------------------------------
+# Server error for an index that exists under the same name with other options.
+INDEX_OPTIONS_CONFLICT = 85
+
+def ensure_indexes(content_collection):
+    """Create the indexes the fetch queries rely on (no-op if they exist).
+
+    `content_id` is unique, so concurrent upserts by id cannot create
+    duplicate passages. Databases indexed before that have a plain index
+    of the same name, which `make_content_id_unique` replaces.
+    """
+    try:
+        content_collection.create_index([("content_id", ASCENDING)], unique=True)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        logger.warning("content_id is not uniquely indexed yet; run `python manage.py unique-content-id`")
+    content_collection.create_index([("question_count", ASCENDING)])
+    content_collection.create_index([("updated_at", ASCENDING)])
+
+def make_content_id_unique(content_collection, limit=20):
+    """Replace a plain `content_id` index with a unique one.
+
+    Returns up to `limit` content_ids stored more than once, in which case
+    nothing is changed; merge or remove those documents and run it again.
+    """
+    duplicates = [
+        d["_id"] for d in content_collection.aggregate([
+            {"$group": {"_id": "$content_id", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$limit": limit},
+        ], allowDiskUse=True)
+    ]
+    if duplicates:
+        return duplicates
+    existing = content_collection.index_information().get("content_id_1")
+    if existing and not existing.get("unique"):
+        content_collection.drop_index("content_id_1")
+    content_collection.create_index([("content_id", ASCENDING)], unique=True)
+    return []
+
+# ------------------------------------------------------------------------------
+# 2) Fetch Queries
+# ------------------------------------------------------------------------------
+def empty_content_query(skipped_ids):
+    """Passages nobody has written a question for yet."""
+    return {"question_count": 0, "content_id": {"$nin": skipped_ids}}
+
+def incomplete_content_query(skipped_ids):
+    """Passages that still need questions to reach TARGET_QUESTIONS."""
+    return {"question_count": {"$lt": TARGET_QUESTIONS}, "content_id": {"$nin": skipped_ids}}
+
+# ------------------------------------------------------------------------------
+# 3) Write Helpers (keep `question_count` and `version` in step with `questions`)
+# ------------------------------------------------------------------------------
+# Every write that changes exported data stamps `updated_at` with the
+# server's clock; the delta export (export.py) selects on it.
+TOUCH = {"updated_at": True}
+
+def new_question_id():
+    """Stable id stored as `qid` on each question when it is first saved."""
+    return str(ObjectId())
+
+def with_question_id(question):
+    if not question.get("qid"):
+        question["qid"] = new_question_id()
+    return question
+
+def prepare_question(question):
+    """Give a question about to be stored its `qid` and `question_norm`."""
+    return text_norm.with_normalized_question(with_question_id(question))
+
+def set_questions(content_collection, content_id, questions):
+    """Replace the whole questions array and its denormalized count."""
+    questions = [prepare_question(q) for q in questions]
+    return content_collection.update_one(
+        {"content_id": content_id},
+        {
+            "$set": {"questions": questions, "question_count": len(questions)},
+            "$inc": {"version": 1},
+            "$currentDate": TOUCH
+        }
+    )
+
+def push_question(content_collection, content_id, question):
+    """Append one question (with a fresh `qid`) and bump the denormalized count."""
+    return content_collection.update_one(
+        {"content_id": content_id},
+        {
+            "$push": {"questions": prepare_question(question)},
+            "$inc": {"question_count": 1, "version": 1},
+            "$currentDate": TOUCH
+        },
+        upsert=True
+    )
+
+# ------------------------------------------------------------------------------
+# 4) Diff-based Question Writes with Optimistic Concurrency
+# ------------------------------------------------------------------------------
+# Fields an annotator can change on an existing question.
+EDITABLE_FIELDS = ("question", "difficulty")
+
+# How often a save is re-merged and retried after losing a version race.
+MAX_SAVE_ATTEMPTS = 3
+
+def question_changes(original, edited):
+    """Map qid -> {field: new value} for the fields that differ between
+    `original[i]` and the widget state `edited[i]`."""
+    changes = {}
+    for before, after in zip(original, edited):
+        changed = {f: after.get(f) for f in EDITABLE_FIELDS if _comparable(f, after) != _comparable(f, before)}
+        if changed:
+            changes[before["qid"]] = changed
+    return changes
+
+def _comparable(field, question):
+    # Retyping a question with different whitespace or Unicode form is not an
+    # edit; a change of case or punctuation is.
+    value = question.get(field)
+    return text_norm.canonical(value) if field == "question" and value else value
+
+def _version_match(version):
+    # Documents written before versioning have no `version`; treat that as 0.
+    return version if version else {"$in": [0, None]}
+
+def question_write_ops(content_id, version, changes, deleted=(), added=(), write_id=None):
+    """Translate an edit of the questions array into targeted update operators.
+
+    Questions are addressed by `qid` rather than position: changed fields
+    are written as `$set questions.$[q<n>].<field>` with a matching array
+    filter, deleted qids are removed with one `$pull`, and `added`
+    questions are appended with `$push`.
+
+    Each op only applies to the exact `version` it expects and bumps it by
+    one, so the whole list behaves as a compare-and-set on the document.
+    Ops after the first are additionally tied to `write_id` (stamped as
+    `last_write` by the first op), so they can never land on top of
+    someone else's write that happens to carry the same version number.
+    Returns a list of UpdateOne for one ordered bulk_write (empty if
+    nothing changed).
+    """
+    write_id = write_id or new_question_id()
+    deleted = list(dict.fromkeys(deleted))
+    updates = []
+
+    if changes:
+        sets = {}
+        array_filters = []
+        for qid, fields in changes.items():
+            ident = f"q{len(array_filters)}"
+            array_filters.append({f"{ident}.qid": qid})
+            for field, value in fields.items():
+                sets[f"questions.$[{ident}].{field}"] = value
+            if "question" in fields:
+                sets[f"questions.$[{ident}].question_norm"] = text_norm.normalize(fields["question"])
+        updates.append(({"$set": sets}, array_filters))
+    if deleted:
+        updates.append(({
+            "$pull": {"questions": {"qid": {"$in": deleted}}},
+            "$inc": {"question_count": -len(deleted)}
+        }, None))
+    if added:
+        added = [prepare_question(q) for q in added]
+        updates.append(({
+            "$push": {"questions": {"$each": added}},
+            "$inc": {"question_count": len(added)}
+        }, None))
+
+    ops = []
+    for step, (update, array_filters) in enumerate(updates):
+        filter_ = {"content_id": content_id, "version": _version_match(version + step)}
+        if step:
+            filter_["last_write"] = write_id
+        update.setdefault("$set", {})["last_write"] = write_id
+        update.setdefault("$inc", {})["version"] = 1
+        update["$currentDate"] = TOUCH
+        ops.append(UpdateOne(filter_, update, array_filters=array_filters))
+    return ops
+
+def merge_question_edits(base, changes, deleted, added, theirs):
+    """Three-way merge of one user's edits onto the current questions.
+
+    `base` is the questions array the user loaded, `changes`/`deleted`/
+    `added` are their edits relative to it, and `theirs` is what is stored
+    now. Per question and per field: edits nobody else touched are kept,
+    edits that someone else already made identically are dropped, and a
+    field changed to different values on both sides (or a question edited
+    on one side and deleted on the other) is a conflict, resolved in
+    favour of the stored version. Returns (changes, deleted, added,
+    conflicts) to apply on top of `theirs`; conflicts is a list of qids.
+    """
+    base_by_qid = {q["qid"]: q for q in base}
+    theirs_by_qid = {q.get("qid"): q for q in theirs}
+    merged_changes = {}
+    merged_deleted = []
+    conflicts = []
+
+    for qid, fields in changes.items():
+        if qid in deleted:
+            continue
+        current = theirs_by_qid.get(qid)
+        if current is None:
+            conflicts.append(qid)
+            continue
+        keep = {}
+        for field, value in fields.items():
+            ours_base = base_by_qid.get(qid, {}).get(field)
+            if current.get(field) == value:
+                continue
+            if current.get(field) == ours_base:
+                keep[field] = value
+            else:
+                conflicts.append(qid)
+        if keep:
+            merged_changes[qid] = keep
+
+    for qid in deleted:
+        current = theirs_by_qid.get(qid)
+        if current is None:
+            continue
+        original = base_by_qid.get(qid, {})
+        if any(current.get(f) != original.get(f) for f in EDITABLE_FIELDS):
+            conflicts.append(qid)
+        else:
+            merged_deleted.append(qid)
+
+    merged_added = [q for q in added if q.get("qid") not in theirs_by_qid]
+    return merged_changes, merged_deleted, merged_added, list(dict.fromkeys(conflicts))
+
+def save_question_edits(content_collection, content_id, version, original, edited, deleted=(), added=()):
+    """Save an edit of the questions array without losing concurrent edits.
+
+    The first attempt is a single ordered bulk_write of targeted ops
+    guarded on `version`. If another save got there first, the current
+    questions are re-read, the edit is three-way merged onto them and
+    written again. Returns (saved, conflicts): whether anything was
+    written, and the qids whose edits were dropped because someone else
+    changed the same field or question.
+    """
+    changes = question_changes(original, edited)
+    deleted = list(deleted)
+    added = [prepare_question(q) for q in added]
+    pending = (changes, deleted, added)
+    conflicts = []
+    saved = False
+
+    for _ in range(MAX_SAVE_ATTEMPTS):
+        ops = question_write_ops(content_id, version, *pending)
+        if not ops:
+            break
+        result = content_collection.bulk_write(ops, ordered=True)
+        saved = saved or result.modified_count > 0
+        if result.modified_count == len(ops):
+            break
+        # Lost the race (possibly after applying a prefix of our ops): merge
+        # the user's edits onto what is stored now and try again.
+        current = content_collection.find_one({"content_id": content_id}, {"_id": 0, "questions": 1, "version": 1}) or {}
+        version = current.get("version", 0)
+        *pending, conflicts = merge_question_edits(original, changes, deleted, added, current.get("questions", []))
+    return saved, conflicts
+
+# ------------------------------------------------------------------------------
+# 5) One-time Backfill
+# ------------------------------------------------------------------------------
+def backfill_question_count(content_collection):
+    """Set `question_count` from the size of `questions` on every document.
+
+    Runs server-side as a single pipeline update, so nothing is pulled
+    into this process. Returns the number of documents modified.
+    """
+    result = content_collection.update_many(
+        {},
+        [{"$set": {"question_count": {"$size": {"$ifNull": ["$questions", []]}}}}]
+    )
+    return result.modified_count
+
+def assign_question_ids(content_collection, doc):
+    """Give `qid`s to any questions in a loaded `doc` that lack one, in Mongo
+    and in place.
+
+    Each write is guarded on the slot still lacking a qid, so two sessions
+    racing to assign ids cannot overwrite each other's. If any write did not
+    match (someone else assigned ids first, or the array changed), the stored
+    questions and version are re-read into `doc`, so callers only ever hold
+    qids that exist in Mongo. Returns the number of ids this call stored.
+    """
+    assigned = 0
+    for _ in range(MAX_SAVE_ATTEMPTS):
+        questions = doc.get("questions", [])
+        ops = []
+        for i, q in enumerate(questions):
+            if not q.get("qid"):
+                q["qid"] = new_question_id()
+                ops.append(UpdateOne(
+                    {"content_id": doc["content_id"], f"questions.{i}.qid": {"$exists": False}},
+                    {"$set": {f"questions.{i}.qid": q["qid"]}, "$currentDate": TOUCH}
+                ))
+        if not ops:
+            break
+        result = content_collection.bulk_write(ops, ordered=False)
+        assigned += result.modified_count
+        if result.modified_count == len(ops):
+            break
+        current = content_collection.find_one(
+            {"content_id": doc["content_id"]}, {"_id": 0, "questions": 1, "question_count": 1, "version": 1}
+        ) or {}
+        doc["questions"] = current.get("questions", [])
+        doc["question_count"] = current.get("question_count", len(doc["questions"]))
+        doc["version"] = current.get("version", 0)
+    return assigned
+
+def backfill_question_ids(content_collection, batch_size=1000):
+    """Assign `qid`s to every question that lacks one, streaming in batches."""
+    modified = 0
+    ops = []
+    cursor = content_collection.find(
+        {"questions": {"$elemMatch": {"qid": {"$exists": False}}}},
+        {"_id": 1, "questions.qid": 1},
+        batch_size=batch_size,
+    )
+    for doc in cursor:
+        missing = {
+            f"questions.{i}.qid": new_question_id()
+            for i, q in enumerate(doc.get("questions", []))
+            if not q.get("qid")
+        }
+        if missing:
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": missing, "$currentDate": TOUCH}))
+        if len(ops) >= batch_size:
+            modified += content_collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        modified += content_collection.bulk_write(ops, ordered=False).modified_count
+    return modified
@@ -1,13 +1,19 @@
-import pymongo
+import os
+
 import streamlit as st
-from pymongo.server_api import ServerApi
 
-# Secure MongoDB connection using Streamlit Secrets
+import metrics
+import storage
+
+# Storage selected by STORAGE_URL (or [storage] url in secrets), else the Mongo cluster
+def storage_url():
+    url = os.environ.get("STORAGE_URL") or st.secrets.get("storage", {}).get("url")
+    return url or st.secrets["mongo"]["uri"]
+
 @st.cache_resource
-def init_connection():
-    return pymongo.MongoClient(st.secrets["mongo"]["uri"], server_api=ServerApi('1'))
+def init_storage():
+    metrics.start()
+    return storage.open_storage(storage_url())
 
-# Initialize DB connection
-client = init_connection()
-db = client["Q_and_A"]  # Your database name
-collection = db["content_data"]  # Your collection name
+# Initialize storage (see storage.py for the backends)
+store = init_storage()
@@ -0,0 +1,243 @@
+"""Near-duplicate question detection with MinHash and LSH.
+
+Each question is reduced to shingles of 3 consecutive aksharas
+(`text_norm.graphemes`, so a consonant is never split from its vowel sign
+or virama) of its `text_norm.match_key` (no punctuation, case or
+joiners), then to a 64-value MinHash signature. The signature is cut
+into 16 bands of 4; two questions whose signatures agree on any whole
+band share a band key and become candidates. Band keys are stored in the
+`question_signatures` collection under a multikey index, so checking a
+new question is one indexed `$in` query plus a comparison of at most
+MAX_CANDIDATES signatures.
+
+Hashing is deterministic (crc32 and a fixed-seed permutation table), so
+signatures written by one process can be compared by any other.
+"""
+import itertools
+import json
+import sys
+import time
+import zlib
+
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+
+import text_norm
+
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+THRESHOLD = 0.7
+
+# Cap on the candidates compared per lookup, so a very common template
+# cannot make the check slow.
+MAX_CANDIDATES = 200
+# Batch mode pairs up at most this many members of one bucket, so a common
+# template cannot blow up the pair count.
+MAX_BUCKET = 50
+
+_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(20250301)
+_A = _rng.randint(1, int(_PRIME), NUM_PERM).astype(np.uint64)[:, None]
+_B = _rng.randint(0, int(_PRIME), NUM_PERM).astype(np.uint64)[:, None]
+_BAND_MULT = (_rng.randint(1, 1 << 62, ROWS, dtype=np.int64).astype(np.uint64) | np.uint64(1))
+_BAND_SALT = np.arange(BANDS, dtype=np.uint64) << np.uint64(56)
+
+MATCH_FIELDS = {"_id": 0, "qid": 1, "content_id": 1, "question": 1, "sig": 1}
+PAIR_FIELDS = {"_id": 0, "qid": 1, "content_id": 1, "sig": 1, "bands": 1}
+
+# ------------------------------------------------------------------------------
+# 1) Signatures
+# ------------------------------------------------------------------------------
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    clusters = text_norm.graphemes(text_norm.match_key(text))
+    if len(clusters) <= size:
+        grams = {"".join(clusters)} if clusters else set()
+    else:
+        grams = {"".join(clusters[i:i + size]) for i in range(len(clusters) - size + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)) % _PRIME
+
+def signatures(texts):
+    """MinHash signatures for many texts at once: an (n, NUM_PERM) uint32
+    array, plus a boolean mask of texts that had any shingles."""
+    hashes = [shingle_hashes(t) for t in texts]
+    lengths = np.array([len(h) for h in hashes], dtype=np.int64)
+    present = lengths > 0
+    sigs = np.zeros((len(texts), NUM_PERM), dtype=np.uint32)
+    if present.any():
+        flat = np.concatenate([h for h in hashes if len(h)])
+        offsets = np.concatenate(([0], np.cumsum(lengths[present])[:-1]))
+        permuted = (_A * flat[None, :] + _B) % _PRIME
+        sigs[present] = np.minimum.reduceat(permuted, offsets, axis=1).T
+    return sigs, present
+
+def signature(text):
+    sigs, present = signatures([text])
+    return sigs[0] if present[0] else None
+
+def band_keys(sigs):
+    """One int64 key per band per signature, shape (n, BANDS)."""
+    rows = sigs.astype(np.uint64).reshape(len(sigs), BANDS, ROWS)
+    return ((rows * _BAND_MULT).sum(axis=2) ^ _BAND_SALT).view(np.int64)
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of the two shingle sets."""
+    return float(np.mean(np.asarray(sig_a, dtype=np.uint32) == np.asarray(sig_b, dtype=np.uint32)))
+
+# ------------------------------------------------------------------------------
+# 2) Index in Mongo (one document per question)
+# ------------------------------------------------------------------------------
+def ensure_indexes(signatures_collection):
+    signatures_collection.create_index([("qid", ASCENDING)], unique=True)
+    signatures_collection.create_index([("bands", ASCENDING)])
+    signatures_collection.create_index([("indexed_at", ASCENDING)])
+
+def _index_op(content_id, qid, text, sig, bands, now):
+    return UpdateOne(
+        {"qid": qid},
+        {"$set": {
+            "content_id": content_id,
+            "question": text,
+            "sig": sig.tolist(),
+            "bands": bands.tolist(),
+            "indexed_at": now,
+        }},
+        upsert=True,
+    )
+
+def index_question(signatures_collection, content_id, qid, text):
+    """Add or refresh one question in the index (call after it is saved)."""
+    sig = signature(text)
+    if sig is None:
+        return remove_questions(signatures_collection, [qid])
+    signatures_collection.bulk_write([_index_op(content_id, qid, text, sig, band_keys(sig[None])[0], time.time())])
+
+def remove_questions(signatures_collection, qids):
+    if qids:
+        signatures_collection.delete_many({"qid": {"$in": list(qids)}})
+
+def reindex_edits(signatures_collection, content_id, changes, deleted=(), skip=()):
+    """Keep the index in step with a Save Changes: `changes` is
+    qid -> {field: value} and `skip` lists qids whose edit was not applied."""
+    for qid, fields in changes.items():
+        if "question" in fields and qid not in skip:
+            index_question(signatures_collection, content_id, qid, fields["question"])
+    remove_questions(signatures_collection, [qid for qid in deleted if qid not in skip])
+
+def find_similar(signatures_collection, text, threshold=THRESHOLD, limit=5):
+    """Indexed questions whose estimated similarity to `text` is at least
+    `threshold`, most similar first, as {qid, content_id, question, similarity}."""
+    sig = signature(text)
+    if sig is None:
+        return []
+    bands = band_keys(sig[None])[0].tolist()
+    matches = []
+    for doc in signatures_collection.find({"bands": {"$in": bands}}, MATCH_FIELDS).limit(MAX_CANDIDATES):
+        score = similarity(sig, doc.pop("sig"))
+        if score >= threshold:
+            matches.append({**doc, "similarity": score})
+    matches.sort(key=lambda m: m["similarity"], reverse=True)
+    return matches[:limit]
+
+# ------------------------------------------------------------------------------
+# 3) Batch Mode: rebuild the index and list duplicate pairs for the corpus
+# ------------------------------------------------------------------------------
+def _iter_questions(content_collection, batch_size):
+    cursor = content_collection.find(
+        {"question_count": {"$gt": 0}},
+        {"_id": 0, "content_id": 1, "questions.qid": 1, "questions.question": 1},
+        batch_size=batch_size,
+    )
+    for doc in cursor:
+        for q in doc.get("questions", []):
+            if q.get("qid"):
+                yield doc["content_id"], q["qid"], q.get("question", "")
+
+def _buckets(signatures_collection, batch_size):
+    """(band, qids) for every band key shared by two or more indexed
+    questions, read in band key order so only one bucket is held at a time.
+    Keys are salted per band, so equal keys are always in the same band."""
+    cursor = signatures_collection.aggregate([
+        {"$project": {"_id": 0, "qid": 1, "key": "$bands"}},
+        {"$unwind": {"path": "$key", "includeArrayIndex": "band"}},
+        {"$sort": {"key": ASCENDING, "qid": ASCENDING}},
+    ], allowDiskUse=True, batchSize=batch_size)
+    for _, rows in itertools.groupby(cursor, key=lambda row: row["key"]):
+        members = list(itertools.islice(rows, MAX_BUCKET))
+        if len(members) > 1:
+            yield members[0]["band"], [row["qid"] for row in members]
+
+def _score_buckets(signatures_collection, buckets, threshold):
+    """Pairs within each (band, qids) bucket at or above `threshold`, as
+    (doc_a, doc_b, similarity). A pair that shares several bands is only
+    reported from the first of them."""
+    qids = list({qid for _, members in buckets for qid in members})
+    docs = {doc["qid"]: doc for doc in signatures_collection.find({"qid": {"$in": qids}}, PAIR_FIELDS)}
+    for band, members in buckets:
+        members = [docs[qid] for qid in members if qid in docs]
+        sigs = np.array([doc["sig"] for doc in members], dtype=np.uint32)
+        keys = np.array([doc["bands"][:band] for doc in members], dtype=np.int64).reshape(len(members), band)
+        scores = (sigs[:, None, :] == sigs[None, :, :]).mean(axis=2)
+        earlier = (keys[:, None, :] == keys[None, :, :]).any(axis=2)
+        for a, b in zip(*np.triu_indices(len(members), 1)):
+            if scores[a, b] >= threshold and not earlier[a, b]:
+                yield members[a], members[b], float(scores[a, b])
+
+def scan_corpus(content_collection, signatures_collection, threshold=THRESHOLD, batch_size=1000, out=sys.stdout):
+    """Recompute every signature, refresh the index, and write one JSON line
+    per near-duplicate pair to `out`. Signatures are computed a batch at a
+    time with numpy; candidate pairs come from the refreshed index sorted by
+    band key, so memory use depends on the batch size, not the corpus.
+    Returns (questions indexed, pairs written)."""
+    ensure_indexes(signatures_collection)
+    started = time.time()
+    indexed = 0
+
+    def flush(batch):
+        sigs, present = signatures([text for _, _, text in batch])
+        keys = band_keys(sigs)
+        ops = [
+            _index_op(content_id, qid, text, sigs[i], keys[i], started)
+            for i, (content_id, qid, text) in enumerate(batch) if present[i]
+        ]
+        if ops:
+            signatures_collection.bulk_write(ops, ordered=False)
+        return len(ops)
+
+    batch = []
+    for item in _iter_questions(content_collection, batch_size):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            indexed += flush(batch)
+            batch = []
+    if batch:
+        indexed += flush(batch)
+    # Questions deleted since the last scan.
+    signatures_collection.delete_many({"indexed_at": {"$lt": started}})
+
+    written = 0
+
+    def write_pairs(buckets):
+        nonlocal written
+        for a, b, score in _score_buckets(signatures_collection, buckets, threshold):
+            out.write(json.dumps({
+                "qid_a": a["qid"], "content_id_a": a["content_id"],
+                "qid_b": b["qid"], "content_id_b": b["content_id"],
+                "similarity": round(score, 3),
+                "same_passage": a["content_id"] == b["content_id"],
+            }, ensure_ascii=False) + "\n")
+            written += 1
+
+    # Buckets are scored a batch of questions at a time.
+    buckets = []
+    size = 0
+    for bucket in _buckets(signatures_collection, batch_size):
+        buckets.append(bucket)
+        size += len(bucket[1])
+        if size >= batch_size:
+            write_pairs(buckets)
+            buckets, size = [], 0
+    if buckets:
+        write_pairs(buckets)
+    return indexed, written
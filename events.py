@@ -0,0 +1,329 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, DESCENDING, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Format of the `datetime` strings in the old embedded logs.
+LEGACY_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Projection used by the history readers.
+EVENT_FIELDS = {"_id": 0, "ts": 1, "username": 1, "content_id": 1, "action": 1}
+
+# Per-user, per-day action counters, kept next to `events` in the same database.
+DAILY_COUNTS = "daily_counts"
+DAY_FORMAT = "%Y-%m-%d"
+
+# ------------------------------------------------------------------------------
+# 1) Indexes
+# ------------------------------------------------------------------------------
+def ensure_indexes(events_collection):
+    events_collection.create_index([("content_id", ASCENDING), ("ts", ASCENDING)])
+    events_collection.create_index([("username", ASCENDING), ("ts", ASCENDING)])
+    counts_collection = events_collection.database[DAILY_COUNTS]
+    counts_collection.create_index([("username", ASCENDING), ("day", ASCENDING)], unique=True)
+    counts_collection.create_index([("day", ASCENDING)])
+
+# ------------------------------------------------------------------------------
+# 2) Writing
+# ------------------------------------------------------------------------------
+def make_event(username, content_id, action, ts=None):
+    """Build one event document. `ts` is a real BSON date, not a string."""
+    return {
+        "ts": ts or datetime.now(timezone.utc),
+        "username": username,
+        "content_id": content_id,
+        "action": action,
+    }
+
+def _count_key(action):
+    # Actions become field names under `counts`; keep them valid.
+    return str(action).replace(".", "_").replace("$", "_")
+
+def count_ops(batch):
+    """One `$inc` upsert per (user, day) for a batch of written events."""
+    tally = {}
+    for event in batch:
+        key = (event["username"], event["ts"].strftime(DAY_FORMAT))
+        tally.setdefault(key, Counter())[_count_key(event["action"])] += 1
+    return [
+        UpdateOne(
+            {"username": username, "day": day},
+            {"$inc": {f"counts.{action}": n for action, n in counter.items()}},
+            upsert=True,
+        )
+        for (username, day), counter in tally.items()
+    ]
+
+def update_counts(events_collection, batch):
+    ops = count_ops(batch)
+    if ops:
+        events_collection.database[DAILY_COUNTS].bulk_write(ops, ordered=False)
+
+def log_event(events_collection, username, content_id, action):
+    """Append one audit event and bump the user's counter for the day.
+    Never touches content_data or users."""
+    event = make_event(username, content_id, action)
+    events_collection.insert_one(event)
+    update_counts(events_collection, [event])
+
+class EventWriter:
+    """Write-behind logger: queue events in memory, insert them in batches.
+
+    `log` only enqueues, so the Streamlit script never waits on the audit
+    write. A daemon thread drains the queue with insert_many, retrying
+    failed batches with backoff. `close` (also registered with atexit)
+    flushes whatever is still queued before the process exits. When the
+    queue is full, `log` waits briefly and then writes synchronously
+    rather than dropping the event. Each written batch also bumps the
+    per-day counters with one `$inc` per user.
+    """
+
+    def __init__(self, events_collection, max_queue=10000, batch_size=500, flush_interval=0.5, max_retries=5):
+        self.events_collection = events_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def depth(self):
+        """Number of events waiting to be written."""
+        return self._queue.qsize()
+
+    def log(self, username, content_id, action):
+        event = make_event(username, content_id, action)
+        try:
+            self._queue.put(event, timeout=1)
+        except queue.Full:
+            self._write([event])
+
+    def _take_batch(self, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        for attempt in range(self.max_retries):
+            try:
+                self.events_collection.insert_many(batch, ordered=False)
+                self._written(batch)
+                return
+            except BulkWriteError as e:
+                # Documents that made it in keep their _id; retry the rest only.
+                failed_indexes = {err["index"] for err in e.details["writeErrors"] if err["code"] != 11000}
+                self._written([ev for i, ev in enumerate(batch) if i not in failed_indexes])
+                batch = [ev for i, ev in enumerate(batch) if i in failed_indexes]
+                if not batch:
+                    return
+            except PyMongoError:
+                pass
+            time.sleep(min(2 ** attempt * 0.1, 5))
+        self.failed += len(batch)
+        logger.error("Dropped %d audit event(s) after %d attempts", len(batch), self.max_retries)
+
+    def _written(self, batch):
+        self.written += len(batch)
+        try:
+            update_counts(self.events_collection, batch)
+        except PyMongoError:
+            # The events are safe; `rebuild_daily_counts` can recount from them.
+            logger.exception("Failed to update daily counts for %d event(s)", len(batch))
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch(self.flush_interval)
+            if batch:
+                self._write(batch)
+
+    def close(self, timeout=10):
+        """Stop the background thread and write out everything still queued."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        while True:
+            batch = self._take_batch(0)
+            if not batch:
+                break
+            self._write(batch)
+
+# ------------------------------------------------------------------------------
+# 3) Reading
+# ------------------------------------------------------------------------------
+def _as_legacy(event, key_field):
+    return {
+        key_field: event[key_field],
+        "action": event["action"],
+        "datetime": event["ts"].strftime(LEGACY_DATETIME_FORMAT),
+    }
+
+def content_history(events_collection, content_id, limit=0):
+    """Who did what to a passage, oldest first, shaped like the old `content_data.users` entries."""
+    cursor = events_collection.find({"content_id": content_id}, EVENT_FIELDS).sort("ts", ASCENDING).limit(limit)
+    return [_as_legacy(e, "username") for e in cursor]
+
+def user_history(events_collection, username, limit=0):
+    """What a user did, oldest first, shaped like the old `users.activity_logs` entries."""
+    cursor = events_collection.find({"username": username}, EVENT_FIELDS).sort("ts", ASCENDING).limit(limit)
+    return [_as_legacy(e, "content_id") for e in cursor]
+
+def leaderboard(events_collection, first_day, last_day=None, limit=50):
+    """Per-user action totals between two days (inclusive), busiest first.
+
+    Reads only the `daily_counts` documents in the range, so the cost is
+    users x days whatever the number of events. Returns a list of
+    {"username", "total", "counts": {action: n}}.
+    """
+    last_day = last_day or first_day
+    cursor = events_collection.database[DAILY_COUNTS].aggregate([
+        {"$match": {"day": {"$gte": first_day.strftime(DAY_FORMAT), "$lte": last_day.strftime(DAY_FORMAT)}}},
+        {"$project": {"_id": 0, "username": 1, "counts": {"$objectToArray": "$counts"}}},
+        {"$unwind": "$counts"},
+        {"$group": {"_id": {"username": "$username", "action": "$counts.k"}, "n": {"$sum": "$counts.v"}}},
+        {"$group": {
+            "_id": "$_id.username",
+            "counts": {"$push": {"k": "$_id.action", "v": "$n"}},
+            "total": {"$sum": "$n"},
+        }},
+        {"$sort": {"total": DESCENDING, "_id": ASCENDING}},
+        {"$limit": limit},
+    ])
+    return [
+        {"username": row["_id"], "total": row["total"], "counts": {c["k"]: c["v"] for c in row["counts"]}}
+        for row in cursor
+    ]
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+def day_range(days):
+    """(first, last) covering the last `days` UTC days, today included."""
+    today = utc_today()
+    return today - timedelta(days=days - 1), today
+
+# ------------------------------------------------------------------------------
+# 4) Migration from the embedded arrays
+# ------------------------------------------------------------------------------
+def _parse_legacy_datetime(value):
+    try:
+        return datetime.strptime(value, LEGACY_DATETIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+def _insert_ignoring_duplicates(events_collection, ops):
+    """Insert a batch; events already copied by an earlier, interrupted run are skipped."""
+    try:
+        return events_collection.bulk_write(ops, ordered=False).inserted_count
+    except BulkWriteError as e:
+        if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+            raise
+        return e.details["nInserted"]
+
+def migrate_embedded_logs(db, batch_size=1000):
+    """Move `content_data.users` into `events` and drop `users.activity_logs`.
+
+    Both arrays record the same actions (log_user_action wrote each one
+    twice), so only the content-side copy is migrated. Documents are
+    streamed one cursor batch at a time; each migrated entry gets a
+    deterministic `_id`, so an interrupted run can simply be restarted.
+    Returns (events inserted, content documents cleared, user documents cleared).
+    """
+    content_collection = db["content_data"]
+    events_collection = db["events"]
+    ensure_indexes(events_collection)
+
+    inserted = 0
+    cleared = 0
+    ops = []
+    pending_ids = []
+
+    def flush():
+        nonlocal inserted, cleared, ops, pending_ids
+        if ops:
+            inserted += _insert_ignoring_duplicates(events_collection, ops)
+        if pending_ids:
+            cleared += content_collection.update_many(
+                {"_id": {"$in": pending_ids}}, {"$unset": {"users": ""}}
+            ).modified_count
+        ops = []
+        pending_ids = []
+
+    cursor = content_collection.find(
+        {"users": {"$exists": True}},
+        {"_id": 1, "content_id": 1, "users": 1},
+        batch_size=batch_size,
+    )
+    for doc in cursor:
+        for i, entry in enumerate(doc.get("users") or []):
+            event = make_event(
+                entry.get("username"),
+                doc.get("content_id"),
+                entry.get("action"),
+                ts=_parse_legacy_datetime(entry.get("datetime")),
+            )
+            event["_id"] = f"{doc['_id']}:{i}"
+            ops.append(InsertOne(event))
+        pending_ids.append(doc["_id"])
+        if len(ops) >= batch_size or len(pending_ids) >= batch_size:
+            flush()
+    flush()
+
+    users_cleared = db["users"].update_many(
+        {"activity_logs": {"$exists": True}}, {"$unset": {"activity_logs": ""}}
+    ).modified_count
+    return inserted, cleared, users_cleared
+
+def _count_key_expr(action):
+    # Server-side twin of _count_key.
+    key = {"$toString": action}
+    for char in (".", "$"):
+        key = {"$replaceAll": {"input": key, "find": {"$literal": char}, "replacement": "_"}}
+    return key
+
+def rebuild_daily_counts(db):
+    """Recompute `daily_counts` from every event, server-side.
+
+    Only needed once for events written before the counters existed, or
+    after counter updates failed; it replaces the affected days wholesale.
+    Returns the number of (user, day) counter documents.
+    """
+    events_collection = db["events"]
+    ensure_indexes(events_collection)
+    events_collection.aggregate([
+        {"$match": {"ts": {"$type": "date"}}},
+        {"$group": {
+            "_id": {
+                "username": "$username",
+                "day": {"$dateToString": {"format": DAY_FORMAT, "date": "$ts"}},
+                "action": "$action",
+            },
+            "n": {"$sum": 1},
+        }},
+        {"$group": {
+            "_id": {"username": "$_id.username", "day": "$_id.day"},
+            "counts": {"$push": {"k": _count_key_expr("$_id.action"), "v": "$n"}},
+        }},
+        {"$project": {"_id": 0, "username": "$_id.username", "day": "$_id.day", "counts": {"$arrayToObject": "$counts"}}},
+        {"$merge": {"into": DAILY_COUNTS, "on": ["username", "day"], "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ], allowDiskUse=True)
+    return db[DAILY_COUNTS].count_documents({})
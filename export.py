@@ -0,0 +1,553 @@
+"""Streaming export of the finished Q&A dataset.
+
+`content_data` is read through a projected cursor in `content_id` order
+and written to size-bounded shards, as JSONL (optionally gzip) and/or
+Parquet (needs `pip install pyarrow`). Only one cursor batch and one
+Parquet row group are held in memory at a time, whatever the corpus size.
+
+After a full export, `export_delta` brings the shards up to date from the
+documents whose `updated_at` is past the watermark in manifest.json, and
+`follow` does the same continuously from a change stream. Both look the
+changed ids up in `index.sqlite` (content_id -> shard) and rewrite only
+the shards that hold them, so their cost follows the number of edits
+rather than the size of the corpus.
+"""
+import gzip
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+from content_ops import DIFFICULTIES
+
+EXPORT_FIELDS = {
+    "_id": 0,
+    "content_id": 1,
+    "content": 1,
+    "questions.qid": 1,
+    "questions.question": 1,
+    "questions.difficulty": 1,
+    "questions.answer": 1,
+}
+
+INDEX_FILE = "index.sqlite"
+
+# The watermark is taken from the server clock a little before the export
+# starts, so writes racing the export are picked up again by the next delta.
+WATERMARK_SLACK = timedelta(seconds=60)
+
+# ------------------------------------------------------------------------------
+# 1) Selection
+# ------------------------------------------------------------------------------
+def export_query(min_questions=0, per_difficulty=0):
+    """Filter on the indexed `question_count`, plus an optional per-difficulty
+    completeness check (at least `per_difficulty` questions of each level)."""
+    query = {}
+    floor = max(min_questions, per_difficulty * len(DIFFICULTIES))
+    if floor:
+        query["question_count"] = {"$gte": floor}
+    if per_difficulty:
+        query["$expr"] = {
+            "$and": [
+                {"$gte": [
+                    {"$size": {"$filter": {
+                        "input": {"$ifNull": ["$questions", []]},
+                        "cond": {"$eq": ["$$this.difficulty", level]},
+                    }}},
+                    per_difficulty,
+                ]}
+                for level in DIFFICULTIES
+            ]
+        }
+    return query
+
+def record_matches(record, min_questions=0, per_difficulty=0):
+    """Client-side twin of export_query, for documents a delta has already read."""
+    questions = record["questions"]
+    if len(questions) < max(min_questions, per_difficulty * len(DIFFICULTIES)):
+        return False
+    return all(
+        sum(q["difficulty"] == level for q in questions) >= per_difficulty
+        for level in DIFFICULTIES
+    )
+
+def to_record(doc):
+    return {
+        "content_id": doc["content_id"],
+        "content": doc.get("content", ""),
+        "questions": [
+            {
+                "qid": q.get("qid"),
+                "question": q.get("question", ""),
+                "difficulty": q.get("difficulty"),
+                "answer": q.get("answer", ""),
+            }
+            for q in doc.get("questions", [])
+        ],
+    }
+
+# ------------------------------------------------------------------------------
+# 2) Shard Writers
+# ------------------------------------------------------------------------------
+class ShardWriter:
+    """Rolls over to a new numbered shard after `max_records` records or
+    roughly `max_bytes` of serialized output, whichever comes first."""
+
+    extension = ""
+
+    def __init__(self, out_dir, prefix="part", max_records=100_000, max_bytes=256 * 1024 * 1024, start=0, replace=True):
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.start = start
+        self.shards = []
+        self._records = 0
+        self._bytes = 0
+        self._open = False
+        os.makedirs(out_dir, exist_ok=True)
+        # A full export replaces whatever an earlier run left behind.
+        if replace:
+            for name in os.listdir(out_dir):
+                if name.startswith(f"{prefix}-") and name.endswith(self.extension):
+                    os.remove(os.path.join(out_dir, name))
+
+    def _next_path(self):
+        return os.path.join(self.out_dir, f"{self.prefix}-{self.start + len(self.shards):05d}{self.extension}")
+
+    def current_shard(self):
+        return self.shards[-1]["path"]
+
+    def write(self, record):
+        if self._open and (self._records >= self.max_records or self._bytes >= self.max_bytes):
+            self._close_shard()
+        if not self._open:
+            path = self._next_path()
+            self._open_shard(path)
+            self.shards.append({"path": os.path.basename(path), "records": 0})
+            self._records = self._bytes = 0
+            self._open = True
+        self._bytes += self._write_record(record)
+        self._records += 1
+        self.shards[-1]["records"] = self._records
+
+    def close(self):
+        if self._open:
+            self._close_shard()
+        return self.shards
+
+    def _close_shard(self):
+        self._finish_shard()
+        self._open = False
+
+    def rewrite(self, name, updates):
+        """Stream shard `name` into a replacement, swapping in the records in
+        `updates` (content_id -> record, or None to drop it). Returns the
+        number of records kept; a shard left empty is removed."""
+        path = os.path.join(self.out_dir, name)
+        tmp = path + ".tmp"
+        kept = 0
+        self._open_shard(tmp)
+        try:
+            for record in self._read_shard(path):
+                if record["content_id"] in updates:
+                    record = updates[record["content_id"]]
+                    if record is None:
+                        continue
+                self._write_record(record)
+                kept += 1
+        finally:
+            self._finish_shard()
+        os.replace(tmp, path)
+        if not kept:
+            os.remove(path)
+        return kept
+
+class JsonlShardWriter(ShardWriter):
+    def __init__(self, out_dir, compress=False, **kwargs):
+        self.compress = compress
+        self.extension = ".jsonl.gz" if compress else ".jsonl"
+        self._file = None
+        super().__init__(out_dir, **kwargs)
+
+    def _open_shard(self, path):
+        self._file = gzip.open(path, "wb") if self.compress else open(path, "wb")
+
+    def _read_shard(self, path):
+        with (gzip.open(path, "rb") if self.compress else open(path, "rb")) as f:
+            for line in f:
+                yield json.loads(line)
+
+    def _write_record(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self._file.write(line)
+        return len(line)
+
+    def _finish_shard(self):
+        self._file.close()
+        self._file = None
+
+class ParquetShardWriter(ShardWriter):
+    extension = ".parquet"
+
+    def __init__(self, out_dir, compression="zstd", row_group_size=1000, **kwargs):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow") from e
+        self._pa = pa
+        self._pq = pq
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([
+            ("content_id", pa.string()),
+            ("content", pa.string()),
+            ("questions", pa.list_(pa.struct([
+                ("qid", pa.string()),
+                ("question", pa.string()),
+                ("difficulty", pa.string()),
+                ("answer", pa.string()),
+            ]))),
+        ])
+        self._writer = None
+        self._rows = []
+        super().__init__(out_dir, **kwargs)
+
+    def _open_shard(self, path):
+        self._writer = self._pq.ParquetWriter(path, self.schema, compression=self.compression)
+
+    def _read_shard(self, path):
+        for batch in self._pq.ParquetFile(path).iter_batches(batch_size=self.row_group_size):
+            yield from batch.to_pylist()
+
+    def _flush_rows(self):
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self.schema))
+            self._rows = []
+
+    def _write_record(self, record):
+        self._rows.append(record)
+        if len(self._rows) >= self.row_group_size:
+            self._flush_rows()
+        # Uncompressed estimate; good enough to bound shard size.
+        return len(record["content"].encode("utf-8")) + sum(len(q["question"].encode("utf-8")) for q in record["questions"])
+
+    def _finish_shard(self):
+        self._flush_rows()
+        self._writer.close()
+        self._writer = None
+
+# ------------------------------------------------------------------------------
+# 3) Shard Index
+# ------------------------------------------------------------------------------
+class ShardIndex:
+    """Which shard holds each content_id, per format, in `index.sqlite`.
+
+    Changed documents of a delta are staged in a temporary table and
+    joined against the index, so neither the index nor the delta has to
+    fit in memory.
+    """
+
+    def __init__(self, out_dir, reset=False):
+        path = os.path.join(out_dir, INDEX_FILE)
+        if reset and os.path.exists(path):
+            os.remove(path)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS shard_index ("
+            " format TEXT, content_id TEXT, shard TEXT, PRIMARY KEY (format, content_id)"
+            ") WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS shard_index_shard ON shard_index (format, shard)")
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS pending (content_id TEXT PRIMARY KEY, record TEXT)")
+
+    def add(self, fmt, rows):
+        """Record (content_id, shard) pairs for `fmt`."""
+        self.db.executemany(
+            "INSERT OR REPLACE INTO shard_index (format, content_id, shard) VALUES (?, ?, ?)",
+            ((fmt, content_id, shard) for content_id, shard in rows),
+        )
+
+    def stage(self, content_id, record):
+        """Queue a changed record, or None to drop `content_id` from the export."""
+        self.db.execute(
+            "INSERT OR REPLACE INTO pending (content_id, record) VALUES (?, ?)",
+            (content_id, None if record is None else json.dumps(record, ensure_ascii=False)),
+        )
+
+    def staged(self):
+        return self.db.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def affected_shards(self, fmt):
+        return [row[0] for row in self.db.execute(
+            "SELECT DISTINCT s.shard FROM pending p"
+            " JOIN shard_index s ON s.format = ? AND s.content_id = p.content_id",
+            (fmt,),
+        )]
+
+    def updates_for(self, fmt, shard):
+        rows = self.db.execute(
+            "SELECT p.content_id, p.record FROM pending p"
+            " JOIN shard_index s ON s.format = ? AND s.content_id = p.content_id"
+            " WHERE s.shard = ?",
+            (fmt, shard),
+        )
+        return {content_id: None if record is None else json.loads(record) for content_id, record in rows}
+
+    def new_records(self, fmt):
+        """Staged records not yet in any shard of `fmt`, in content_id order."""
+        rows = self.db.execute(
+            "SELECT p.record FROM pending p"
+            " LEFT JOIN shard_index s ON s.format = ? AND s.content_id = p.content_id"
+            " WHERE s.content_id IS NULL AND p.record IS NOT NULL ORDER BY p.content_id",
+            (fmt,),
+        )
+        for (record,) in rows:
+            yield json.loads(record)
+
+    def drop_removed(self, fmt):
+        self.db.execute(
+            "DELETE FROM shard_index WHERE format = ?"
+            " AND content_id IN (SELECT content_id FROM pending WHERE record IS NULL)",
+            (fmt,),
+        )
+
+    def drop_shard(self, fmt, shard):
+        self.db.execute("DELETE FROM shard_index WHERE format = ? AND shard = ?", (fmt, shard))
+
+    def clear_pending(self):
+        self.db.execute("DELETE FROM pending")
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+# ------------------------------------------------------------------------------
+# 4) Full Export
+# ------------------------------------------------------------------------------
+def make_writer(out_dir, fmt, compress=False, max_records=100_000, max_bytes=256 * 1024 * 1024, start=0, replace=True):
+    if fmt == "jsonl":
+        return JsonlShardWriter(
+            os.path.join(out_dir, "jsonl"), compress=compress,
+            max_records=max_records, max_bytes=max_bytes, start=start, replace=replace,
+        )
+    if fmt == "parquet":
+        return ParquetShardWriter(
+            os.path.join(out_dir, "parquet"), compression="zstd" if compress else "none",
+            max_records=max_records, max_bytes=max_bytes, start=start, replace=replace,
+        )
+    raise ValueError(f"Unknown export format: {fmt}")
+
+def make_writers(out_dir, formats, compress=False, max_records=100_000, max_bytes=256 * 1024 * 1024):
+    return [make_writer(out_dir, fmt, compress, max_records, max_bytes) for fmt in formats]
+
+def read_manifest(out_dir):
+    path = os.path.join(out_dir, "manifest.json")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No manifest.json in {out_dir}; run a full export first")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def write_manifest(out_dir, manifest):
+    tmp = os.path.join(out_dir, "manifest.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(out_dir, "manifest.json"))
+
+def server_time(content_collection):
+    """The server's clock, which is what `$currentDate` stamps `updated_at` with."""
+    try:
+        now = content_collection.database.command("hello")["localTime"]
+    except (PyMongoError, KeyError):
+        now = datetime.now(timezone.utc)
+    return now if now.tzinfo else now.replace(tzinfo=timezone.utc)
+
+def export(content_collection, out_dir, formats=("jsonl",), compress=False, min_questions=0,
+           per_difficulty=0, max_records=100_000, max_bytes=256 * 1024 * 1024, batch_size=500):
+    """Export matching passages to `out_dir`. Returns the manifest written there."""
+    formats = tuple(formats)
+    if not formats:
+        raise ValueError("No export format given")
+    started = time.perf_counter()
+    watermark = server_time(content_collection) - WATERMARK_SLACK
+    query = export_query(min_questions, per_difficulty)
+    writers = make_writers(out_dir, formats, compress, max_records, max_bytes)
+    index = ShardIndex(out_dir, reset=True)
+    placed = {fmt: [] for fmt in formats}
+
+    exported = 0
+    cursor = content_collection.find(query, EXPORT_FIELDS, batch_size=batch_size).sort("content_id", ASCENDING)
+    try:
+        for doc in cursor:
+            record = to_record(doc)
+            for fmt, writer in zip(formats, writers):
+                writer.write(record)
+                placed[fmt].append((record["content_id"], writer.current_shard()))
+            exported += 1
+            if len(placed[formats[0]]) >= batch_size:
+                for fmt, rows in placed.items():
+                    index.add(fmt, rows)
+                    rows.clear()
+    finally:
+        cursor.close()
+        shards = {fmt: writer.close() for fmt, writer in zip(formats, writers)}
+        for fmt, rows in placed.items():
+            index.add(fmt, rows)
+        index.close()
+
+    manifest = {
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "watermark": watermark.isoformat(),
+        "query": {"min_questions": min_questions, "per_difficulty": per_difficulty},
+        "options": {"compress": compress, "max_records": max_records, "max_bytes": max_bytes},
+        "records": exported,
+        "shards": shards,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    write_manifest(out_dir, manifest)
+    return manifest
+
+# ------------------------------------------------------------------------------
+# 5) Delta Export
+# ------------------------------------------------------------------------------
+def _shard_number(name):
+    return int(name.split("-", 1)[1].split(".", 1)[0])
+
+def _stage_docs(index, docs, query):
+    for doc in docs:
+        record = to_record(doc)
+        index.stage(record["content_id"], record if record_matches(record, **query) else None)
+
+def apply_staged(index, out_dir, manifest):
+    """Merge the records staged in `index` into the shards listed in
+    `manifest` (updated in place). Records already exported are rewritten
+    inside the shard that holds them; new ones go to fresh shards numbered
+    after the existing ones. Returns the number of shards rewritten."""
+    options = manifest["options"]
+    rewritten = 0
+    for fmt, shards in manifest["shards"].items():
+        by_name = {s["path"]: s for s in shards}
+        writer = make_writer(out_dir, fmt, options["compress"], options["max_records"], options["max_bytes"], replace=False)
+        for name in index.affected_shards(fmt):
+            kept = writer.rewrite(name, index.updates_for(fmt, name))
+            rewritten += 1
+            if kept:
+                by_name[name]["records"] = kept
+            else:
+                del by_name[name]
+                index.drop_shard(fmt, name)
+        index.drop_removed(fmt)
+
+        start = max((_shard_number(name) for name in by_name), default=-1) + 1
+        writer = make_writer(out_dir, fmt, options["compress"], options["max_records"], options["max_bytes"], start=start, replace=False)
+        placed = []
+        for record in index.new_records(fmt):
+            writer.write(record)
+            placed.append((record["content_id"], writer.current_shard()))
+        index.add(fmt, placed)
+        manifest["shards"][fmt] = sorted([*by_name.values(), *writer.close()], key=lambda s: s["path"])
+        index.commit()
+
+    first = next(iter(manifest["shards"].values()), [])
+    manifest["records"] = sum(s["records"] for s in first)
+    manifest["exported_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return rewritten
+
+def export_delta(content_collection, out_dir, batch_size=500):
+    """Bring a full export in `out_dir` up to date with the documents whose
+    `updated_at` is at or after the manifest's watermark.
+
+    Uses the query and options of the full export. Passages that no
+    longer pass the query are dropped from their shard. Shards only grow
+    by appending, so a periodic full export is still useful to restore
+    strict content_id order. Returns the updated manifest.
+    """
+    started = time.perf_counter()
+    manifest = read_manifest(out_dir)
+    since = datetime.fromisoformat(manifest["watermark"])
+    watermark = server_time(content_collection) - WATERMARK_SLACK
+
+    index = ShardIndex(out_dir)
+    cursor = content_collection.find({"updated_at": {"$gte": since}}, EXPORT_FIELDS, batch_size=batch_size)
+    try:
+        _stage_docs(index, cursor, manifest["query"])
+    finally:
+        cursor.close()
+    try:
+        changed = index.staged()
+        rewritten = apply_staged(index, out_dir, manifest)
+    finally:
+        index.close()
+
+    manifest["watermark"] = watermark.isoformat()
+    manifest["delta"] = {"changed": changed, "shards_rewritten": rewritten, "seconds": round(time.perf_counter() - started, 3)}
+    write_manifest(out_dir, manifest)
+    return manifest
+
+# ------------------------------------------------------------------------------
+# 6) Change Stream
+# ------------------------------------------------------------------------------
+CHANGE_PIPELINE = [
+    {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+    {"$project": {"clusterTime": 1, **{f"fullDocument.{field}": 1 for field in EXPORT_FIELDS if field != "_id"}}},
+]
+
+def follow(content_collection, out_dir, batch_size=500, flush_interval=10.0, stop=None):
+    """Tail the content_data change stream into the export in `out_dir`.
+
+    Needs a replica set. Changes are applied in batches of up to
+    `batch_size` documents or every `flush_interval` seconds; after each
+    batch the resume token and watermark are saved in the manifest, so
+    `follow` resumes where it left off and `export_delta` only sees what
+    came after. Runs until `stop` (a threading.Event) is set or the
+    process is interrupted. Document deletes are not followed; no app
+    deletes passages.
+    """
+    manifest = read_manifest(out_dir)
+    pending = 0
+    last_flush = time.monotonic()
+    last_change = None
+    index = ShardIndex(out_dir)
+
+    def flush(stream):
+        nonlocal pending, last_flush
+        if pending:
+            apply_staged(index, out_dir, manifest)
+            index.clear_pending()
+            manifest["watermark"] = (last_change.as_datetime() - WATERMARK_SLACK).isoformat()
+        manifest["resume_token"] = stream.resume_token
+        write_manifest(out_dir, manifest)
+        pending = 0
+        last_flush = time.monotonic()
+
+    try:
+        with content_collection.watch(
+            CHANGE_PIPELINE,
+            full_document="updateLookup",
+            resume_after=manifest.get("resume_token"),
+            max_await_time_ms=1000,
+        ) as stream:
+            while stream.alive and not (stop and stop.is_set()):
+                change = stream.try_next()
+                doc = change and change.get("fullDocument")
+                if doc:
+                    _stage_docs(index, [doc], manifest["query"])
+                    last_change = change["clusterTime"]
+                    pending += 1
+                if pending >= batch_size or time.monotonic() - last_flush >= flush_interval:
+                    flush(stream)
+            flush(stream)
+    except OperationFailure as e:
+        if e.code == 40573:
+            raise RuntimeError("Change streams need a replica set; use `export --delta` instead") from e
+        raise
+    finally:
+        index.close()
@@ -1,14 +1,33 @@
+import os
+
 import streamlit as st
-from pymongo import MongoClient
 
-# Initialize connection to MongoDB
+import content_cache
+import metrics
+import storage
+
+# Initialize storage: STORAGE_URL (or [storage] url in secrets), else the Mongo cluster
+def storage_url():
+    url = os.environ.get("STORAGE_URL") or st.secrets.get("storage", {}).get("url")
+    return url or st.secrets["mongo"]["uri"]
+
 @st.cache_resource
-def init_connection():
-    return MongoClient(st.secrets["mongo"]["uri"])
+def init_storage():
+    """On Mongo, passage bodies are served from an LRU shared by all sessions."""
+    metrics.start()
+    url = storage_url()
+    if storage.is_mongo_url(url):
+        return storage.open_storage(url, body_cache=content_cache.LRUCache())
+    return storage.open_storage(url)
 
-client = init_connection()
-db = client["Q_and_A"]  # Database Name
-collection = db["content_data"]  # Collection Name
+store = init_storage()
+
+def open_passage(doc):
+    """Keep the questions and version the edit widgets are drawn from, and
+    that Save Changes merges against."""
+    st.session_state["current_content_id"] = doc["content_id"]
+    st.session_state["questions"] = doc.get("questions", [])
+    st.session_state["version"] = doc.get("version", 0)
 
 # Streamlit UI
 st.title("📖 Fetch & Edit Content from MongoDB")
@@ -17,11 +36,10 @@ st.subheader("🔍 Enter Content ID to Fetch Content")
 content_id_input = st.text_input("Enter Content ID (e.g., 000001):")
 
 if st.button("Fetch Content"):
-    content_data = collection.find_one({"content_id": content_id_input})
+    content_data = store.get_content(content_id_input)
 
     if content_data:
-        st.session_state["current_content_id"] = content_id_input
-        st.session_state["questions"] = content_data.get("questions", [])
+        open_passage(content_data)
         st.rerun()
 
     else:
@@ -29,36 +47,40 @@ if st.button("Fetch Content"):
 
 # Show fetched content & existing questions
 if "current_content_id" in st.session_state:
-    content_data = collection.find_one({"content_id": st.session_state["current_content_id"]})
+    content_data = store.get_content(st.session_state["current_content_id"])
 
     if content_data:
         st.subheader("📜 Retrieved Content")
         st.text_area("Content:", value=content_data["content"], height=300, disabled=True)
 
-        st.write(f"📌 **Total Questions:** {len(content_data.get('questions', []))}")
+        questions = st.session_state["questions"]
+        st.write(f"📌 **Total Questions:** {len(questions)}")
 
         # Display Existing Questions with Edit Option
-        if len(content_data["questions"]) > 0:
+        if len(questions) > 0:
             st.write("📋 **Existing Questions (Editable):**")
             updated_questions = []
-            for index, q in enumerate(content_data["questions"], start=1):
+            for index, q in enumerate(questions, start=1):
                 st.write(f"**Question {index}:**")
-                question_text = st.text_area(f"Edit Question {index}", value=q["question"], key=f"edit_q_{index}")
+                question_text = st.text_area(f"Edit Question {index}", value=q["question"], key=f"edit_q_{q['qid']}")
                 difficulty = st.selectbox(
                     f"Difficulty Level {index}", 
                     ["easy", "medium", "hard"], 
                     index=["easy", "medium", "hard"].index(q["difficulty"]),
-                    key=f"edit_d_{index}"
+                    key=f"edit_d_{q['qid']}"
                 )
 
-                updated_questions.append({"question": question_text, "difficulty": difficulty, "answer": q.get("answer", "")})
+                updated_questions.append({"qid": q["qid"], "question": question_text, "difficulty": difficulty, "answer": q.get("answer", "")})
 
             if st.button("Save Changes"):
-                collection.update_one(
-                    {"content_id": st.session_state["current_content_id"]},
-                    {"$set": {"questions": updated_questions}}
+                saved, conflicts = store.save_question_edits(
+                    content_data["content_id"], st.session_state["version"], questions, updated_questions
                 )
-                st.success("✅ Changes saved successfully!")
+                open_passage(store.get_content(content_data["content_id"]))
+                if conflicts:
+                    st.warning("⚠️ Someone else changed some of these questions at the same time; their version was kept.")
+                elif saved:
+                    st.success("✅ Changes saved successfully!")
                 st.rerun()
 
         # Add New Question Section
@@ -68,11 +90,8 @@ if "current_content_id" in st.session_state:
 
         if st.button("Save Question"):
             if new_question.strip():
-                collection.update_one(
-                    {"content_id": st.session_state["current_content_id"]},
-                    {"$push": {"questions": {"question": new_question, "difficulty": new_difficulty, "answer": ""}}},
-                    upsert=True
-                )
+                store.add_question(content_data["content_id"], {"question": new_question, "difficulty": new_difficulty, "answer": ""})
+                open_passage(store.get_content(content_data["content_id"]))
                 st.success("✅ New question added successfully!")
                 st.rerun()
             else:
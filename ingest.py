@@ -0,0 +1,190 @@
+"""Streaming bulk import of passages into content_data.
+
+Sources are read one record at a time (JSONL, CSV, or a folder of .txt
+files), normalized to the fields the apps expect, and upserted by
+`content_id` in unordered bulk_write batches. After every batch the
+source position is written to a checkpoint file, so a rerun with the
+same checkpoint resumes where the last one stopped.
+"""
+import csv
+import json
+import os
+import sys
+import time
+
+from pymongo import UpdateOne
+
+import content_cache
+import content_ops
+import text_norm
+
+# ------------------------------------------------------------------------------
+# 1) Readers: yield (position, raw record), resuming after `start`
+# ------------------------------------------------------------------------------
+def iter_jsonl(path, start=None):
+    """Position is the byte offset just past the record. A line that is not
+    valid JSON yields None, to be counted as invalid."""
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start)
+        for line in iter(f.readline, b""):
+            position = f.tell()
+            line = line.strip()
+            if line:
+                try:
+                    yield position, json.loads(line)
+                except ValueError:
+                    yield position, None
+
+def iter_csv(path, start=None):
+    """Position is the number of data rows consumed."""
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline="", encoding="utf-8") as f:
+        for row_number, row in enumerate(csv.DictReader(f), start=1):
+            if start and row_number <= start:
+                continue
+            yield row_number, row
+
+def iter_text_folder(path, start=None):
+    """One passage per .txt file, content_id taken from the file name.
+
+    Position is the file name; files are visited in sorted order.
+    """
+    names = sorted(n for n in os.listdir(path) if n.endswith(".txt"))
+    for name in names:
+        if start and name <= start:
+            continue
+        with open(os.path.join(path, name), encoding="utf-8") as f:
+            yield name, {"content_id": os.path.splitext(name)[0], "content": f.read()}
+
+READERS = {"jsonl": iter_jsonl, "csv": iter_csv, "folder": iter_text_folder}
+
+def detect_format(path):
+    if os.path.isdir(path):
+        return "folder"
+    if path.lower().endswith(".csv"):
+        return "csv"
+    return "jsonl"
+
+# ------------------------------------------------------------------------------
+# 2) Normalization
+# ------------------------------------------------------------------------------
+def normalize_record(raw, id_field="content_id", text_field="content", id_width=0):
+    """Return {content_id, content} or None if the record is unusable."""
+    if not isinstance(raw, dict):
+        return None
+    content_id = raw.get(id_field)
+    content = raw.get(text_field)
+    if content_id is None or content_id == "" or not isinstance(content, str):
+        return None
+    content_id = str(content_id).strip()
+    if id_width and content_id.isdigit():
+        content_id = content_id.zfill(id_width)
+    content = content.strip()
+    if not content:
+        return None
+    return {"content_id": content_id, "content": content}
+
+def upsert_op(record):
+    """Insert a new passage with an empty question list, or refresh the body
+    of an existing one without touching its questions."""
+    return UpdateOne(
+        {"content_id": record["content_id"]},
+        {
+            "$set": {
+                "content": record["content"],
+                "content_hash": content_cache.content_hash(record["content"]),
+                "content_norm": text_norm.normalize(record["content"]),
+                "norm_version": text_norm.NORM_VERSION,
+            },
+            "$setOnInsert": {"questions": [], "question_count": 0, "version": 0},
+            "$currentDate": content_ops.TOUCH,
+        },
+        upsert=True,
+    )
+
+# ------------------------------------------------------------------------------
+# 3) Checkpoints
+# ------------------------------------------------------------------------------
+def load_checkpoint(path, source):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        state = json.load(f)
+    return state["position"] if state.get("source") == os.path.abspath(source) else None
+
+def save_checkpoint(path, source, position):
+    if not path:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.abspath(source), "position": position}, f)
+    os.replace(tmp, path)
+
+# ------------------------------------------------------------------------------
+# 4) Import Loop
+# ------------------------------------------------------------------------------
+def ingest(content_collection, source, fmt=None, batch_size=1000, checkpoint=None,
+           id_field="content_id", text_field="content", id_width=0, report_every=10, out=sys.stdout):
+    """Stream `source` into `content_collection`. Returns a stats dict."""
+    fmt = fmt or detect_format(source)
+    reader = READERS[fmt]
+    start = load_checkpoint(checkpoint, source)
+    content_ops.ensure_indexes(content_collection)
+
+    stats = {"read": 0, "invalid": 0, "inserted": 0, "updated": 0, "batches": 0}
+    started = time.perf_counter()
+    ops = []
+    position = start
+
+    def flush():
+        result = content_collection.bulk_write(ops, ordered=False)
+        stats["inserted"] += result.upserted_count
+        stats["updated"] += result.modified_count
+        stats["batches"] += 1
+        save_checkpoint(checkpoint, source, position)
+        if report_every and stats["batches"] % report_every == 0:
+            elapsed = time.perf_counter() - started
+            print(f"{stats['read']} records, {stats['read'] / elapsed:,.0f} rec/s", file=out)
+
+    for position, raw in reader(source, start):
+        stats["read"] += 1
+        record = normalize_record(raw, id_field, text_field, id_width)
+        if record is None:
+            stats["invalid"] += 1
+            continue
+        ops.append(upsert_op(record))
+        if len(ops) >= batch_size:
+            flush()
+            ops = []
+    if ops:
+        flush()
+    elif position != start:
+        save_checkpoint(checkpoint, source, position)
+
+    stats["seconds"] = time.perf_counter() - started
+    stats["rate"] = stats["read"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+def ingest_into(store, source, fmt=None, batch_size=1000, id_field="content_id", text_field="content", id_width=0):
+    """Load `source` into a storage.Storage backend (SQLite or in-memory) in
+    batches, without checkpoints. Returns a stats dict."""
+    reader = READERS[fmt or detect_format(source)]
+    stats = {"read": 0, "invalid": 0, "written": 0}
+    started = time.perf_counter()
+    batch = []
+    for _, raw in reader(source):
+        stats["read"] += 1
+        record = normalize_record(raw, id_field, text_field, id_width)
+        if record is None:
+            stats["invalid"] += 1
+            continue
+        batch.append(record)
+        if len(batch) >= batch_size:
+            stats["written"] += store.add_passages(batch)
+            batch = []
+    if batch:
+        stats["written"] += store.add_passages(batch)
+    stats["seconds"] = time.perf_counter() - started
+    stats["rate"] = stats["read"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
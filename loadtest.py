@@ -0,0 +1,338 @@
+"""Load test: N virtual annotators working one storage backend at once.
+
+Each virtual annotator is a thread, as each browser session is in one
+Streamlit process. It logs in, then until the time is up repeats the
+annotator's loop: fetch the next passage, add questions until it has
+TARGET_QUESTIONS, edit one of them, and move on; a share of passages is
+skipped straight after the fetch instead. Writes are logged as the app
+logs them. The operations go through storage.py exactly as
+app_1_working.py calls it: on Mongo that is the content_ops / work_queue /
+events code with the per-session prefetch buffer, the shared body cache
+and the write-behind event log.
+
+memory:// and sqlite:// runs measure storage.py's local backends, which
+reimplement leasing and merging on their own; they are useful for
+single-machine deployments and for checking the harness, but say nothing
+about the Mongo paths production runs. The report says so.
+
+Reported per operation: count, errors, throughput and p50/p95/p99/max
+latency. Collisions are fetches that returned a passage another virtual
+annotator was still holding (leases should keep this at zero); conflicts
+are saves whose edits lost to someone else's (see save_question_edits).
+
+Usage:
+    python loadtest.py --storage memory:// --annotators 20 --duration 30
+    python loadtest.py --storage sqlite:///loadtest.sqlite --passages 5000
+    python loadtest.py --storage mongodb://localhost:27017 --database Q_and_A_loadtest
+
+Mongo runs use their own database (Q_and_A_loadtest by default), seeded
+with synthetic passages; never point this at the production database.
+Set BCRYPT_ROUNDS low (e.g. 4) unless login cost is what you are testing.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from pymongo import MongoClient
+
+import content_cache
+import content_ops
+import passwords
+import storage
+
+PASSWORD = "loadtest-password"
+
+# Syllables for synthetic Telugu passages and questions.
+SYLLABLES = ["క", "మ", "ల", "ర", "న", "త", "ప", "వ", "స", "గ", "ది", "లు", "ను", "కి", "గా", "ని"]
+
+# ------------------------------------------------------------------------------
+# 1) Setup
+# ------------------------------------------------------------------------------
+def open_target(url, database):
+    if storage.is_mongo_url(url):
+        if database == "Q_and_A":
+            raise SystemExit("Refusing to load-test the production database; pass another --database.")
+        # Configured as app_1_working.py configures it.
+        return storage.MongoStorage(MongoClient(url)[database], write_behind=True, body_cache=content_cache.LRUCache())
+    return storage.open_storage(url)
+
+def synthetic_text(rng, words):
+    return " ".join("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(words))
+
+def seed(store, passages, rng, batch_size=1000):
+    """Add `passages` synthetic passages with ids lt-000000, lt-000001, ..."""
+    for start in range(0, passages, batch_size):
+        store.add_passages([
+            {"content_id": f"lt-{i:06d}", "content": synthetic_text(rng, 120)}
+            for i in range(start, min(start + batch_size, passages))
+        ])
+
+# ------------------------------------------------------------------------------
+# 2) Measurements
+# ------------------------------------------------------------------------------
+class Recorder:
+    """Latencies and counters for one virtual annotator (merged at the end,
+    so threads never contend on it)."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def timed(self, op):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors[op] += 1
+            raise
+        self.latencies[op].append(time.perf_counter() - started)
+
+    def merge(self, other):
+        for op, values in other.latencies.items():
+            self.latencies[op].extend(values)
+        for op, n in other.errors.items():
+            self.errors[op] += n
+        for name, n in other.counters.items():
+            self.counters[name] += n
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+class Holders:
+    """Which virtual annotator has which passage open right now."""
+
+    def __init__(self):
+        self._held = {}
+        self._lock = threading.Lock()
+
+    def take(self, content_id, username):
+        """Record that `username` opened `content_id`; True if someone else had it."""
+        with self._lock:
+            other = self._held.get(content_id)
+            self._held[content_id] = username
+            return other is not None and other != username
+
+    def drop(self, content_id, username):
+        with self._lock:
+            if self._held.get(content_id) == username:
+                del self._held[content_id]
+
+# ------------------------------------------------------------------------------
+# 3) Virtual Annotator
+# ------------------------------------------------------------------------------
+def annotator(store, username, deadline, holders, recorder, rng, skip_rate, think):
+    def pause():
+        if think:
+            time.sleep(rng.uniform(0, 2 * think))
+
+    while True:
+        try:
+            with recorder.timed("login"):
+                logged_in = store.login_user(username, PASSWORD)
+            break
+        except passwords.PasswordBusy:
+            # What the app shows as "server busy"; the annotator tries again.
+            recorder.counters["login_busy"] += 1
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(0.05)
+        except Exception:
+            return
+    if not logged_in:
+        recorder.errors["login"] += 1
+        return
+
+    # One per browser session in the app.
+    buffer = store.prefetch_buffer(username)
+    while time.monotonic() < deadline:
+        try:
+            with recorder.timed("fetch_next"):
+                doc = store.fetch_next(username, buffer=buffer)
+        except Exception:
+            continue
+        if not doc:
+            recorder.counters["empty_fetches"] += 1
+            break
+        content_id = doc["content_id"]
+        recorder.counters["fetches"] += 1
+        if holders.take(content_id, username):
+            recorder.counters["collisions"] += 1
+        pause()
+
+        try:
+            if rng.random() < skip_rate:
+                # Hand the passage back in `holders` first, so the instant it is
+                # claimable again nobody is still recorded as holding it.
+                holders.drop(content_id, username)
+                with recorder.timed("skip"):
+                    store.skip(username, content_id)
+                with recorder.timed("log_action"):
+                    store.log_action(username, content_id, "skipped")
+                continue
+
+            questions = doc.get("questions", [])
+            for _ in range(max(0, content_ops.TARGET_QUESTIONS - len(questions))):
+                question = {
+                    "question": synthetic_text(rng, 8) + "?",
+                    "difficulty": rng.choice(content_ops.DIFFICULTIES),
+                    "answer": "",
+                }
+                with recorder.timed("add_question"):
+                    store.add_question(content_id, question)
+                with recorder.timed("log_action"):
+                    store.log_action(username, content_id, "added question")
+                pause()
+
+            with recorder.timed("get_content"):
+                current = store.get_content(content_id)
+            if current and current["questions"]:
+                original = current["questions"]
+                edited = [dict(q) for q in original]
+                target = rng.randrange(len(edited))
+                edited[target]["question"] = synthetic_text(rng, 8) + "?"
+                with recorder.timed("save_edits"):
+                    _, conflicts = store.save_question_edits(content_id, current["version"], original, edited)
+                recorder.counters["saves"] += 1
+                recorder.counters["conflicts"] += bool(conflicts)
+                with recorder.timed("log_action"):
+                    store.log_action(username, content_id, "edited questions")
+            holders.drop(content_id, username)
+            with recorder.timed("release"):
+                store.release(content_id, username)
+        except Exception:
+            # Counted under the failing operation; carry on with the next passage.
+            pass
+        finally:
+            holders.drop(content_id, username)
+
+# ------------------------------------------------------------------------------
+# 4) Run & Report
+# ------------------------------------------------------------------------------
+def run(store, annotators=10, duration=30.0, skip_rate=0.2, think=0.0, seed_value=0, prefix="annotator"):
+    """Drive `annotators` threads for `duration` seconds. Returns the report dict."""
+    usernames = [f"{prefix}-{i:03d}" for i in range(annotators)]
+    for username in usernames:
+        store.register_user(username, PASSWORD)
+
+    holders = Holders()
+    recorders = [Recorder() for _ in usernames]
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(
+            target=annotator,
+            args=(store, username, deadline, holders, recorder, random.Random(seed_value + i), skip_rate, think),
+            name=username,
+            daemon=True,
+        )
+        for i, (username, recorder) in enumerate(zip(usernames, recorders))
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = Recorder()
+    for recorder in recorders:
+        total.merge(recorder)
+    return report(total, elapsed, annotators, isinstance(store, storage.MongoStorage))
+
+def report(recorder, elapsed, annotators, mongo=True):
+    operations = {}
+    for op in sorted(set(recorder.latencies) | set(recorder.errors)):
+        values = sorted(recorder.latencies[op])
+        operations[op] = {
+            "count": len(values),
+            "errors": recorder.errors[op],
+            "per_second": len(values) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": (values[-1] if values else 0.0) * 1000,
+        }
+    counters = recorder.counters
+    return {
+        "annotators": annotators,
+        "mongo": mongo,
+        "seconds": elapsed,
+        "operations": operations,
+        "fetches": counters["fetches"],
+        "collisions": counters["collisions"],
+        "collision_rate": counters["collisions"] / counters["fetches"] if counters["fetches"] else 0.0,
+        "saves": counters["saves"],
+        "conflicts": counters["conflicts"],
+        "conflict_rate": counters["conflicts"] / counters["saves"] if counters["saves"] else 0.0,
+        "empty_fetches": counters["empty_fetches"],
+        "login_busy": counters["login_busy"],
+    }
+
+def print_report(result, out=sys.stdout):
+    print(f"{result['annotators']} annotators, {result['seconds']:.1f}s", file=out)
+    print(f"{'operation':<14}{'count':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}", file=out)
+    for op, s in result["operations"].items():
+        print(
+            f"{op:<14}{s['count']:>8}{s['errors']:>8}{s['per_second']:>10.1f}"
+            f"{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['max_ms']:>10.2f}",
+            file=out,
+        )
+    print(
+        f"collisions: {result['collisions']} of {result['fetches']} fetches ({result['collision_rate']:.2%}); "
+        f"edit conflicts: {result['conflicts']} of {result['saves']} saves ({result['conflict_rate']:.2%})",
+        file=out,
+    )
+    if result["login_busy"]:
+        print(f"{result['login_busy']} login attempt(s) got PasswordBusy and were retried.", file=out)
+    if result["empty_fetches"]:
+        print(f"{result['empty_fetches']} annotator(s) ran out of passages; seed more with --passages.", file=out)
+    if not result["mongo"]:
+        print(
+            "Note: this measured storage.py's local backend, not the Mongo lease / prefetch / merge "
+            "code production runs; use --storage mongodb://... for that.",
+            file=out,
+        )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--storage", default="memory://", help="Storage URL (see storage.py).")
+    parser.add_argument("--database", default="Q_and_A_loadtest", help="Mongo database to use and seed.")
+    parser.add_argument("--annotators", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run.")
+    parser.add_argument("--passages", type=int, default=2000, help="Synthetic passages to seed first (0 = none).")
+    parser.add_argument("--skip-rate", type=float, default=0.2, help="Share of fetched passages skipped unworked.")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between an annotator's actions.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args(argv)
+
+    store = open_target(args.storage, args.database)
+    try:
+        if args.passages:
+            seed(store, args.passages, random.Random(args.seed))
+        result = run(
+            store, annotators=args.annotators, duration=args.duration, skip_rate=args.skip_rate,
+            think=args.think_ms / 1000, seed_value=args.seed,
+        )
+    except passwords.PasswordBusy:
+        raise SystemExit("Password pool saturated while registering; lower --annotators or BCRYPT_ROUNDS.")
+    finally:
+        store.close()
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+if __name__ == "__main__":
+    main()
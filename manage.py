@@ -0,0 +1,238 @@
+"""Maintenance commands for the Q_and_A database.
+
+Usage:
+    python manage.py backfill-question-count
+    python manage.py backfill-content-hash
+    python manage.py migrate-events
+    python manage.py backfill-question-ids
+    python manage.py unique-content-id
+    python manage.py rebuild-daily-counts
+    python manage.py normalize-text
+    python manage.py dedup-scan [--out pairs.jsonl] [--threshold 0.7]
+    python manage.py build-search-index [--path search_index.sqlite]
+    python manage.py ingest SOURCE [--format jsonl|csv|folder] [--checkpoint FILE]
+    python manage.py ingest SOURCE --storage sqlite:///qa.sqlite
+    python manage.py export OUT_DIR [--format jsonl --format parquet] [--compress]
+    python manage.py export OUT_DIR --delta | --follow
+
+The Mongo URI is read from the MONGO_URI environment variable, falling
+back to the same .streamlit/secrets.toml the apps use.
+"""
+import argparse
+import os
+import tomllib
+
+from pymongo import MongoClient
+
+import content_cache
+import content_ops
+import dedup
+import events
+import export
+import ingest
+import search_index
+import storage
+import text_norm
+
+SECRETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+
+# ------------------------------------------------------------------------------
+# 1) Connection
+# ------------------------------------------------------------------------------
+def mongo_uri():
+    uri = os.environ.get("MONGO_URI")
+    if uri:
+        return uri
+    with open(SECRETS_PATH, "rb") as f:
+        return tomllib.load(f)["mongo"]["uri"]
+
+def get_db():
+    return MongoClient(mongo_uri())["Q_and_A"]
+
+# ------------------------------------------------------------------------------
+# 2) Commands
+# ------------------------------------------------------------------------------
+def cmd_backfill_question_count(args):
+    content_collection = get_db()["content_data"]
+    content_ops.ensure_indexes(content_collection)
+    modified = content_ops.backfill_question_count(content_collection)
+    print(f"question_count backfilled on {modified} document(s).")
+
+def cmd_backfill_content_hash(args):
+    content_collection = get_db()["content_data"]
+    modified = content_cache.backfill_content_hash(content_collection, batch_size=args.batch_size)
+    print(f"content_hash backfilled on {modified} document(s).")
+
+def cmd_migrate_events(args):
+    inserted, content_cleared, users_cleared = events.migrate_embedded_logs(get_db(), batch_size=args.batch_size)
+    print(
+        f"Moved {inserted} event(s) into events; cleared users on {content_cleared} content "
+        f"document(s) and activity_logs on {users_cleared} user document(s)."
+    )
+
+def cmd_backfill_question_ids(args):
+    content_collection = get_db()["content_data"]
+    modified = content_ops.backfill_question_ids(content_collection, batch_size=args.batch_size)
+    print(f"Question ids assigned on {modified} document(s).")
+
+def cmd_unique_content_id(args):
+    duplicates = content_ops.make_content_id_unique(get_db()["content_data"])
+    if duplicates:
+        raise SystemExit(f"content_id is stored more than once for: {', '.join(map(str, duplicates))}. "
+                         "Merge or remove those documents, then run this again.")
+    print("content_id is uniquely indexed.")
+
+def cmd_rebuild_daily_counts(args):
+    written = events.rebuild_daily_counts(get_db())
+    print(f"Rebuilt {written} per-user daily counter document(s).")
+
+def cmd_normalize_text(args):
+    modified = text_norm.backfill_normalized(get_db()["content_data"], batch_size=args.batch_size)
+    print(f"Stored normalized text on {modified} document(s).")
+
+def cmd_dedup_scan(args):
+    db = get_db()
+    with open(args.out, "w", encoding="utf-8") as out:
+        indexed, pairs = dedup.scan_corpus(
+            db["content_data"], db["question_signatures"],
+            threshold=args.threshold, batch_size=args.batch_size, out=out,
+        )
+    print(f"Indexed {indexed} question(s); wrote {pairs} near-duplicate pair(s) to {args.out}.")
+
+def cmd_build_search_index(args):
+    indexed = search_index.build(get_db()["content_data"], path=args.path, batch_size=args.batch_size)
+    print(f"Indexed {indexed} passage(s) into {args.path}.")
+
+def cmd_ingest(args):
+    if args.storage:
+        store = storage.open_storage(args.storage)
+        try:
+            stats = ingest.ingest_into(
+                store, args.source, fmt=args.format, batch_size=args.batch_size,
+                id_field=args.id_field, text_field=args.text_field, id_width=args.id_width,
+            )
+        finally:
+            store.close()
+        print(
+            f"Read {stats['read']} record(s) in {stats['seconds']:.1f}s ({stats['rate']:,.0f} rec/s): "
+            f"{stats['written']} written, {stats['invalid']} invalid."
+        )
+        return
+    stats = ingest.ingest(
+        get_db()["content_data"],
+        args.source,
+        fmt=args.format,
+        batch_size=args.batch_size,
+        checkpoint=args.checkpoint,
+        id_field=args.id_field,
+        text_field=args.text_field,
+        id_width=args.id_width,
+    )
+    print(
+        f"Read {stats['read']} record(s) in {stats['seconds']:.1f}s ({stats['rate']:,.0f} rec/s): "
+        f"{stats['inserted']} inserted, {stats['updated']} updated, {stats['invalid']} invalid."
+    )
+
+def cmd_export(args):
+    content_collection = get_db()["content_data"]
+    if args.follow:
+        try:
+            export.follow(content_collection, args.out_dir, batch_size=args.batch_size)
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.delta:
+        manifest = export.export_delta(content_collection, args.out_dir, batch_size=args.batch_size)
+        delta = manifest["delta"]
+        print(
+            f"Merged {delta['changed']} changed passage(s) into {delta['shards_rewritten']} rewritten shard(s) "
+            f"in {delta['seconds']}s; {manifest['records']} passage(s) exported."
+        )
+        return
+    manifest = export.export(
+        content_collection,
+        args.out_dir,
+        formats=args.format or ["jsonl"],
+        compress=args.compress,
+        min_questions=args.min_questions,
+        per_difficulty=args.per_difficulty,
+        max_records=args.shard_records,
+        max_bytes=args.shard_mb * 1024 * 1024,
+        batch_size=args.batch_size,
+    )
+    shard_count = sum(len(s) for s in manifest["shards"].values())
+    print(f"Exported {manifest['records']} passage(s) to {shard_count} shard(s) in {manifest['seconds']}s.")
+
+# ------------------------------------------------------------------------------
+# 3) Entry Point
+# ------------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("backfill-question-count", help="Populate question_count from the questions array.")
+    p.set_defaults(func=cmd_backfill_question_count)
+
+    p = sub.add_parser("backfill-content-hash", help="Store content_hash used to key the content body cache.")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.set_defaults(func=cmd_backfill_content_hash)
+
+    p = sub.add_parser("migrate-events", help="Move embedded activity logs into the events collection.")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.set_defaults(func=cmd_migrate_events)
+
+    p = sub.add_parser("backfill-question-ids", help="Give every question a stable qid.")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.set_defaults(func=cmd_backfill_question_ids)
+
+    p = sub.add_parser("unique-content-id", help="Replace the plain content_id index with a unique one.")
+    p.set_defaults(func=cmd_unique_content_id)
+
+    p = sub.add_parser("rebuild-daily-counts", help="Recompute the per-user daily counters from events.")
+    p.set_defaults(func=cmd_rebuild_daily_counts)
+
+    p = sub.add_parser("normalize-text", help="Store content_norm / question_norm on every document.")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.set_defaults(func=cmd_normalize_text)
+
+    p = sub.add_parser("dedup-scan", help="Rebuild the near-duplicate index and list duplicate question pairs.")
+    p.add_argument("--out", default="duplicates.jsonl")
+    p.add_argument("--threshold", type=float, default=dedup.THRESHOLD)
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.set_defaults(func=cmd_dedup_scan)
+
+    p = sub.add_parser("build-search-index", help="Build the full-text search index from scratch.")
+    p.add_argument("--path", default=search_index.DEFAULT_PATH)
+    p.add_argument("--batch-size", type=int, default=5000)
+    p.set_defaults(func=cmd_build_search_index)
+
+    p = sub.add_parser("ingest", help="Stream passages from JSONL, CSV or a folder of .txt files.")
+    p.add_argument("source")
+    p.add_argument("--format", choices=sorted(ingest.READERS), help="Defaults to a guess from the path.")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.add_argument("--checkpoint", help="File recording progress; rerun with the same file to resume.")
+    p.add_argument("--id-field", default="content_id")
+    p.add_argument("--text-field", default="content")
+    p.add_argument("--id-width", type=int, default=0, help="Zero-pad numeric ids to this width (e.g. 6).")
+    p.add_argument("--storage", help="Load into this storage URL (e.g. sqlite:///qa.sqlite) instead of Mongo.")
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser("export", help="Stream the Q&A dataset to JSONL/Parquet shards.")
+    p.add_argument("out_dir")
+    p.add_argument("--format", action="append", choices=["jsonl", "parquet"], help="Repeatable; default jsonl.")
+    p.add_argument("--compress", action="store_true", help="gzip JSONL shards / zstd Parquet shards.")
+    p.add_argument("--min-questions", type=int, default=0)
+    p.add_argument("--per-difficulty", type=int, default=0, help="Require this many easy, medium and hard questions.")
+    p.add_argument("--shard-records", type=int, default=100_000)
+    p.add_argument("--shard-mb", type=int, default=256)
+    p.add_argument("--batch-size", type=int, default=500)
+    mode = p.add_mutually_exclusive_group()
+    mode.add_argument("--delta", action="store_true", help="Merge documents changed since the last export into its shards.")
+    mode.add_argument("--follow", action="store_true", help="Keep merging changes from the change stream (replica set only).")
+    p.set_defaults(func=cmd_export)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Latency histograms and counters for the app, in Prometheus text format.
+
+Recorded when enabled:
+
+- `mongo_command_seconds{command, collection, shape}` for every command
+  the driver sends (a pymongo CommandListener), plus
+  `mongo_command_failures_total`. `shape` is the sorted top-level filter
+  fields (or the pipeline stages), never the values, so label
+  cardinality stays bounded.
+- `bcrypt_seconds{op}` for hashes and checks, and
+  `password_busy_total` for attempts turned away by the pool.
+- `content_cache_requests_total{result}` (hit / miss).
+- `rerun_seconds{script, outcome}` for whole Streamlit script runs.
+
+Metrics are enabled by setting either output:
+
+- `METRICS_PORT` serves `/metrics` on that port from a daemon thread
+  (Streamlit has no route of its own for it).
+- `METRICS_LOG_SECONDS` logs one JSON line with every counter and each
+  histogram's count, sum and p50/p95/p99 at that interval.
+
+With neither set, every hook is a constant check that returns at once
+and no listener is attached to MongoClient.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+PORT = int(os.environ.get("METRICS_PORT", "0"))
+LOG_SECONDS = float(os.environ.get("METRICS_LOG_SECONDS", "0"))
+ENABLED = bool(PORT or LOG_SECONDS)
+
+# Upper bounds in seconds, from a 0.5 ms cache hit to a 10 s rerun.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "mongo_command_seconds": "Mongo command round trips, by command, collection and query shape.",
+    "mongo_command_failures_total": "Mongo commands that returned an error.",
+    "bcrypt_seconds": "bcrypt hashes and checks, including the wait for a pool thread.",
+    "password_busy_total": "Password attempts rejected because the bcrypt pool was full.",
+    "content_cache_requests_total": "Passage body lookups in the content cache.",
+    "rerun_seconds": "Whole Streamlit script runs.",
+}
+
+# ------------------------------------------------------------------------------
+# 1) Registry
+# ------------------------------------------------------------------------------
+class Registry:
+    """Counters and fixed-bucket histograms keyed by (name, labels)."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts (last one is +Inf), then sum and count.
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def _snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+        return counters, histograms
+
+    # -- output -----------------------------------------------------------------
+    def render(self):
+        """Everything in the Prometheus text exposition format."""
+        counters, histograms = self._snapshot()
+        lines = []
+        for name in sorted({n for n, _ in counters}):
+            lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} counter"]
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        for name in sorted({n for n, _ in histograms}):
+            lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} histogram"]
+            for (n, labels), (counts, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Counters, and count/sum/p50/p95/p99 per histogram (bucket upper
+        bounds; None past the last bucket), for the log line."""
+        counters, histograms = self._snapshot()
+        out = {"counters": [{"name": n, **dict(labels), "value": v} for (n, labels), v in sorted(counters.items())]}
+        out["histograms"] = [
+            {
+                "name": n, **dict(labels), "count": count, "sum": round(total, 6),
+                **{f"p{q}": self._quantile(counts, count, q / 100) for q in (50, 95, 99)},
+            }
+            for (n, labels), (counts, total, count) in sorted(histograms.items())
+        ]
+        return out
+
+    def _quantile(self, counts, count, q):
+        rank = q * count
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound if bound != float("inf") else None
+        return None
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+REGISTRY = Registry()
+
+# ------------------------------------------------------------------------------
+# 2) Recording (no-ops when disabled)
+# ------------------------------------------------------------------------------
+_NULL = nullcontext()
+
+def inc(name, amount=1, **labels):
+    if ENABLED:
+        REGISTRY.inc(name, tuple(sorted(labels.items())), amount)
+
+def observe(name, seconds, **labels):
+    if ENABLED:
+        REGISTRY.observe(name, tuple(sorted(labels.items())), seconds)
+
+class _Timer:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        REGISTRY.observe(self.name, self.labels, time.perf_counter() - self.started)
+        return False
+
+def timer(name, **labels):
+    """Context manager observing its duration in histogram `name`."""
+    if not ENABLED:
+        return _NULL
+    return _Timer(name, tuple(sorted(labels.items())))
+
+class RerunTimer:
+    """Times one Streamlit script run. Create it at the top of the script and
+    call `finish` before st.stop() / st.rerun() and at the end; only the
+    first call counts. Runs that raise or are interrupted by new input are
+    not recorded."""
+
+    __slots__ = ("script", "started")
+
+    def __init__(self, script):
+        self.script = script
+        self.started = time.perf_counter() if ENABLED else None
+
+    def finish(self, outcome="done"):
+        if self.started is not None:
+            observe("rerun_seconds", time.perf_counter() - self.started, script=self.script, outcome=outcome)
+            self.started = None
+
+# ------------------------------------------------------------------------------
+# 3) Mongo Commands
+# ------------------------------------------------------------------------------
+# Commands whose filter lives under another field than "filter".
+_FILTER_FIELDS = {"find": "filter", "count": "query", "distinct": "query", "findAndModify": "query"}
+
+def query_shape(command_name, command):
+    """Sorted top-level fields of the command's filter, or its pipeline
+    stages; values are never included."""
+    if command_name == "aggregate":
+        return ">".join(next(iter(stage), "?") for stage in command.get("pipeline", []))
+    if command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or []
+        query = statements[0].get("q", {}) if statements else {}
+    else:
+        query = command.get(_FILTER_FIELDS.get(command_name, "filter"))
+    if not isinstance(query, dict):
+        return ""
+    return ",".join(sorted(query))
+
+class CommandMetrics(monitoring.CommandListener):
+    """Observes every command's round trip in `mongo_command_seconds`."""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        labels = (
+            ("collection", collection if isinstance(collection, str) else ""),
+            ("command", event.command_name),
+            ("shape", query_shape(event.command_name, event.command)),
+        )
+        with self._lock:
+            self._pending[(event.request_id, event.connection_id)] = labels
+
+    def _labels(self, event):
+        with self._lock:
+            return self._pending.pop((event.request_id, event.connection_id), None) or (
+                ("collection", ""), ("command", event.command_name), ("shape", ""),
+            )
+
+    def succeeded(self, event):
+        REGISTRY.observe("mongo_command_seconds", self._labels(event), event.duration_micros / 1e6)
+
+    def failed(self, event):
+        labels = self._labels(event)
+        REGISTRY.observe("mongo_command_seconds", labels, event.duration_micros / 1e6)
+        REGISTRY.inc("mongo_command_failures_total", labels)
+
+def mongo_listeners():
+    """`event_listeners` for MongoClient: empty unless metrics are enabled."""
+    return [CommandMetrics()] if ENABLED else []
+
+# ------------------------------------------------------------------------------
+# 4) Output
+# ------------------------------------------------------------------------------
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_started = False
+_start_lock = threading.Lock()
+
+def start():
+    """Start the configured outputs once per process (no-op when disabled)."""
+    global _started
+    with _start_lock:
+        if _started or not ENABLED:
+            return
+        _started = True
+    if PORT:
+        try:
+            server = ThreadingHTTPServer(("", PORT), _Handler)
+        except OSError:
+            logger.exception("Could not serve metrics on port %s", PORT)
+        else:
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    if LOG_SECONDS:
+        if not logger.handlers:
+            # Streamlit leaves the root logger unconfigured; give the line its own handler.
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+
+        def run():
+            while True:
+                time.sleep(LOG_SECONDS)
+                logger.info("metrics %s", json.dumps(REGISTRY.summary(), default=str))
+        threading.Thread(target=run, name="metrics-log", daemon=True).start()
@@ -0,0 +1,103 @@
+"""Password hashing off the Streamlit script thread, plus login throttling.
+
+bcrypt is deliberately slow, and it releases the GIL while it works, so
+hashes run in a small process-wide thread pool: at most WORKERS run at
+once and at most MAX_PENDING wait, beyond which callers get PasswordBusy
+straight away instead of piling up, as do callers whose hash has not
+finished within TIMEOUT_SECONDS. The cost factor comes from the
+BCRYPT_ROUNDS environment variable; hashes made at another cost are
+upgraded on the next successful login (see `needs_rehash`).
+
+`Throttle` is a sliding-window attempt limit kept in memory, used per
+username and per client IP so one client cannot keep the pool busy.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent import futures
+
+import bcrypt  # Requires "pip install bcrypt"
+
+import metrics
+
+ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+MAX_PENDING = WORKERS * 8
+TIMEOUT_SECONDS = 30
+
+class PasswordBusy(RuntimeError):
+    """Too many password checks are already queued, or this one timed out
+    waiting; try again shortly."""
+
+_pool = futures.ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="bcrypt")
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+
+# ------------------------------------------------------------------------------
+# 1) Hashing
+# ------------------------------------------------------------------------------
+def _run(op, fn, *args):
+    if not _slots.acquire(blocking=False):
+        metrics.inc("password_busy_total")
+        raise PasswordBusy()
+    try:
+        future = _pool.submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    # A job that timed out is still queued or running, so its slot is only
+    # freed once it is done, not when the caller gives up on it.
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        with metrics.timer("bcrypt_seconds", op=op):
+            return future.result(timeout=TIMEOUT_SECONDS)
+    except futures.TimeoutError:
+        metrics.inc("password_busy_total")
+        raise PasswordBusy() from None
+
+def hash_password(password: str, rounds: int = ROUNDS) -> bytes:
+    """Generate a salted hash for the given password."""
+    return _run("hash", lambda: bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)))
+
+def check_password(password: str, hashed: bytes) -> bool:
+    """Compare a plain password with the hashed password."""
+    return _run("check", bcrypt.checkpw, password.encode("utf-8"), hashed)
+
+def hash_rounds(hashed: bytes) -> int:
+    """Cost factor of a bcrypt hash ($2b$<rounds>$...)."""
+    return int(hashed.split(b"$")[2])
+
+def needs_rehash(hashed: bytes, rounds: int = ROUNDS) -> bool:
+    return hash_rounds(hashed) != rounds
+
+# ------------------------------------------------------------------------------
+# 2) Throttling
+# ------------------------------------------------------------------------------
+class Throttle:
+    """At most `limit` attempts per key in any `window` seconds."""
+
+    def __init__(self, limit, window=60.0):
+        self.limit = limit
+        self.window = window
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """Record an attempt for `key`. Returns 0 if allowed, otherwise the
+        number of seconds until the next attempt would be."""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.setdefault(key, deque())
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if len(attempts) >= self.limit:
+                return attempts[0] + self.window - now
+            attempts.append(now)
+            if len(self._attempts) > 10_000:
+                self._prune(now)
+            return 0
+
+    def _prune(self, now):
+        stale = [k for k, a in self._attempts.items() if not a or a[-1] <= now - self.window]
+        for key in stale:
+            del self._attempts[key]
@@ -0,0 +1,95 @@
+import threading
+from collections import deque
+
+import work_queue
+
+# How many upcoming passages to keep in memory per session, and the level
+# at which a background refill is started.
+BUFFER_SIZE = 5
+LOW_WATER = 2
+
+class PrefetchBuffer:
+    """Per-session queue of upcoming passages, bodies included.
+
+    Candidates are pulled `BUFFER_SIZE` at a time in one batched query and
+    topped up on a background thread once fewer than `LOW_WATER` remain,
+    so advancing to the next item is normally served from memory. Buffered
+    items are not leased; `take` claims each one before handing it out and
+    drops any that someone else has claimed or completed meanwhile.
+    """
+
+    def __init__(self, content_collection, skips_collection, username, size=BUFFER_SIZE, low_water=LOW_WATER):
+        self.content_collection = content_collection
+        self.skips_collection = skips_collection
+        self.username = username
+        self.size = size
+        self.low_water = low_water
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._refilling = False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def _fill(self):
+        with self._lock:
+            wanted = self.size - len(self._items)
+            buffered = {d["content_id"] for d in self._items}
+        if wanted > 0:
+            found = work_queue.candidates(
+                self.content_collection,
+                self.skips_collection,
+                self.username,
+                wanted,
+                fields=("content", "content_hash"),
+                exclude_ids=buffered,
+            )
+            with self._lock:
+                buffered = {d["content_id"] for d in self._items}
+                self._items.extend(d for d in found if d["content_id"] not in buffered)
+
+    def _refill_in_background(self):
+        with self._lock:
+            if self._refilling or len(self._items) >= self.low_water:
+                return
+            self._refilling = True
+
+        def run():
+            try:
+                self._fill()
+            finally:
+                with self._lock:
+                    self._refilling = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def take(self, lease_seconds=work_queue.LEASE_SECONDS):
+        """Claim and return the next buffered passage, or None if none are left.
+
+        The returned document carries `content_id`, `questions`,
+        `question_count` and the buffered `content` and `content_hash`.
+        """
+        while True:
+            with self._lock:
+                item = self._items.popleft() if self._items else None
+            if item is None:
+                # Buffer ran dry (first use, or the refill has not landed yet).
+                self._fill()
+                with self._lock:
+                    item = self._items.popleft() if self._items else None
+                if item is None:
+                    return None
+
+            doc = work_queue.claim(
+                self.content_collection,
+                item["content_id"],
+                self.username,
+                lease_seconds,
+                incomplete_only=True,
+            )
+            if doc:
+                doc["content"] = item.get("content", "")
+                doc["content_hash"] = item.get("content_hash")
+                self._refill_in_background()
+                return doc
@@ -0,0 +1,105 @@
+"""Corpus progress numbers for the supervisor dashboard.
+
+One `$facet` aggregation computes everything in a single pass over
+`content_data`. `ProgressStats` runs it on a background thread every
+`ttl` seconds and hands out the last result, so rendering the dashboard
+never waits on the scan, however many people have it open.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from pymongo.errors import PyMongoError
+
+from content_ops import DIFFICULTIES, PER_DIFFICULTY, TARGET_QUESTIONS
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = 300
+
+# ------------------------------------------------------------------------------
+# 1) Aggregation
+# ------------------------------------------------------------------------------
+def _level_count(level):
+    return {"$size": {"$filter": {"input": "$difficulties", "cond": {"$eq": ["$$this", level]}}}}
+
+def progress_pipeline():
+    """Coverage buckets (0, 1..TARGET-1, >= TARGET questions), questions per
+    difficulty, and how many passages meet PER_DIFFICULTY on every level."""
+    return [
+        {"$project": {
+            "_id": 0,
+            "question_count": {"$ifNull": ["$question_count", 0]},
+            "difficulties": {"$ifNull": ["$questions.difficulty", []]},
+        }},
+        {"$facet": {
+            "coverage": [
+                {"$bucket": {
+                    "groupBy": "$question_count",
+                    "boundaries": [0, 1, TARGET_QUESTIONS],
+                    "default": TARGET_QUESTIONS,
+                    "output": {"passages": {"$sum": 1}},
+                }},
+            ],
+            "difficulty": [
+                {"$unwind": "$difficulties"},
+                {"$group": {"_id": "$difficulties", "questions": {"$sum": 1}}},
+            ],
+            "balanced": [
+                {"$match": {"question_count": {"$gte": TARGET_QUESTIONS}}},
+                {"$match": {"$expr": {"$and": [
+                    {"$gte": [_level_count(level), PER_DIFFICULTY]} for level in DIFFICULTIES
+                ]}}},
+                {"$count": "passages"},
+            ],
+        }},
+    ]
+
+def compute_progress(content_collection):
+    """Run the aggregation and flatten its facets into one dict."""
+    result = next(content_collection.aggregate(progress_pipeline(), allowDiskUse=True), {})
+    coverage = {b["_id"]: b["passages"] for b in result.get("coverage", [])}
+    by_level = {d["_id"]: d["questions"] for d in result.get("difficulty", [])}
+    balanced = result.get("balanced") or [{"passages": 0}]
+    return {
+        "passages": sum(coverage.values()),
+        "empty": coverage.get(0, 0),
+        "partial": coverage.get(1, 0),
+        "complete": coverage.get(TARGET_QUESTIONS, 0),
+        "balanced": balanced[0]["passages"],
+        "difficulty": {level: by_level.get(level, 0) for level in DIFFICULTIES},
+        "computed_at": datetime.now(timezone.utc),
+    }
+
+# ------------------------------------------------------------------------------
+# 2) Background Refresh
+# ------------------------------------------------------------------------------
+class ProgressStats:
+    """Keeps the latest `compute_progress` result, recomputed every `ttl` seconds
+    on a daemon thread. `snapshot` returns None until the first run finishes."""
+
+    def __init__(self, content_collection, ttl=REFRESH_SECONDS):
+        self.content_collection = content_collection
+        self.ttl = ttl
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="progress-stats", daemon=True)
+        self._thread.start()
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                snapshot = compute_progress(self.content_collection)
+                snapshot["seconds"] = round(time.monotonic() - started, 3)
+                with self._lock:
+                    self._snapshot = snapshot
+            except PyMongoError:
+                # Keep serving the previous numbers; try again next round.
+                logger.exception("Progress aggregation failed")
+            time.sleep(self.ttl)
@@ -0,0 +1,223 @@
+"""Full-text search over passages and their questions.
+
+Telugu has no stemmer and whitespace is not a reliable word boundary, so
+the index is character trigrams: an SQLite FTS5 table with the `trigram`
+tokenizer (SQLite 3.34+), stored in a local file next to the app. Every
+query term of three or more characters is matched as a substring and
+results are ranked with bm25, question text weighted above the body.
+Passages and queries are indexed in their `text_norm` form, so NFC/NFD
+variants and stray zero-width joiners still match.
+
+The index follows `content_data` through `updated_at`: `catch_up` re-reads
+only the passages written since its last watermark, so writes made by
+any app or by ingest show up without a rebuild. `build` does the initial
+load in bulk into a fresh file.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from pymongo.errors import PyMongoError
+
+import text_norm
+from export import WATERMARK_SLACK, server_time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.environ.get("SEARCH_INDEX_PATH", "search_index.sqlite")
+SYNC_SECONDS = 30
+
+SOURCE_FIELDS = {
+    "_id": 0, "content_id": 1, "content": 1, "content_norm": 1,
+    "questions.question": 1, "questions.question_norm": 1,
+}
+
+# bm25 weights for (content_id, content, questions).
+RANK = "bm25(passages, 0.0, 1.0, 2.0)"
+
+# Around matched text in snippets (Markdown bold).
+HIGHLIGHT = "**"
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS ids (rowid INTEGER PRIMARY KEY, content_id TEXT UNIQUE NOT NULL)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5("
+    " content_id UNINDEXED, content, questions, tokenize = 'trigram')",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+)
+
+# ------------------------------------------------------------------------------
+# 1) Documents and Queries
+# ------------------------------------------------------------------------------
+def _stored_norm(doc, field):
+    # Use the normalized copy written next to the text; older documents get it computed.
+    if field + "_norm" in doc:
+        return doc[field + "_norm"]
+    return text_norm.normalize(doc.get(field, ""))
+
+def to_row(doc):
+    """(content_id, content, questions) as indexed."""
+    questions = "\n".join(_stored_norm(q, "question") for q in doc.get("questions", []))
+    return doc["content_id"], _stored_norm(doc, "content"), questions
+
+def match_expression(query):
+    """AND of one quoted phrase per word of the query (`text_norm.tokens`,
+    so "DNA?" looks for "dna"). Words shorter than a trigram cannot be
+    matched and are dropped; returns None if no word is left."""
+    terms = [t for t in text_norm.tokens(query) if len(t) >= 3]
+    if not terms:
+        return None
+    return " AND ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+# ------------------------------------------------------------------------------
+# 2) Index
+# ------------------------------------------------------------------------------
+class SearchIndex:
+    """One SQLite connection shared by all sessions of the app; access is
+    serialized with a lock."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        for statement in SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+        self._sync_thread = None
+
+    # -- writes -----------------------------------------------------------------
+    def _upsert(self, rows):
+        for content_id, content, questions in rows:
+            found = self._db.execute("SELECT rowid FROM ids WHERE content_id = ?", (content_id,)).fetchone()
+            if found:
+                rowid = found[0]
+                self._db.execute("DELETE FROM passages WHERE rowid = ?", (rowid,))
+            else:
+                rowid = self._db.execute("INSERT INTO ids (content_id) VALUES (?)", (content_id,)).lastrowid
+            self._db.execute(
+                "INSERT INTO passages (rowid, content_id, content, questions) VALUES (?, ?, ?, ?)",
+                (rowid, content_id, content, questions),
+            )
+
+    def upsert_docs(self, docs):
+        with self._lock:
+            self._upsert(to_row(doc) for doc in docs)
+            self._db.commit()
+
+    def refresh(self, content_collection, content_id):
+        """Re-index one passage right after this process wrote it."""
+        doc = content_collection.find_one({"content_id": content_id}, SOURCE_FIELDS)
+        if doc:
+            self.upsert_docs([doc])
+
+    def watermark(self):
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'watermark'").fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def _set_watermark(self, watermark):
+        self._db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('watermark', ?)", (watermark.isoformat(),)
+        )
+
+    def catch_up(self, content_collection, batch_size=1000):
+        """Index every passage written since the last watermark (all of them
+        on an empty index). Returns the number of passages indexed."""
+        since = self.watermark()
+        watermark = server_time(content_collection) - WATERMARK_SLACK
+        query = {"updated_at": {"$gte": since}} if since else {}
+        indexed = 0
+        batch = []
+        cursor = content_collection.find(query, SOURCE_FIELDS, batch_size=batch_size)
+        try:
+            for doc in cursor:
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    self.upsert_docs(batch)
+                    indexed += len(batch)
+                    batch = []
+        finally:
+            cursor.close()
+        with self._lock:
+            self._upsert(to_row(doc) for doc in batch)
+            self._set_watermark(watermark)
+            self._db.commit()
+        return indexed + len(batch)
+
+    def start_sync(self, content_collection, interval=SYNC_SECONDS):
+        """Run `catch_up` every `interval` seconds on a daemon thread."""
+        if self._sync_thread:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.catch_up(content_collection)
+                except (PyMongoError, sqlite3.Error):
+                    # Keep serving the last state; try again next round.
+                    logger.exception("Search index sync failed")
+                time.sleep(interval)
+
+        self._sync_thread = threading.Thread(target=run, name="search-sync", daemon=True)
+        self._sync_thread.start()
+
+    # -- reads ------------------------------------------------------------------
+    def search(self, query, limit=20):
+        """Ranked matches as {content_id, snippet, question_snippet, score}
+        (lower score is better, as bm25 reports it). `question_snippet` is
+        None unless the match is in a question."""
+        expression = match_expression(query)
+        if not expression:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT content_id, snippet(passages, 1, ?1, ?1, '…', 24),"
+                f" snippet(passages, 2, ?1, ?1, '…', 24), {RANK} AS score"
+                " FROM passages WHERE passages MATCH ?2 ORDER BY score LIMIT ?3",
+                (HIGHLIGHT, expression, limit),
+            ).fetchall()
+        # A column without a match still yields a snippet, just an unhighlighted one.
+        return [
+            {
+                "content_id": cid,
+                "snippet": snippet,
+                "question_snippet": question_snippet if HIGHLIGHT in question_snippet else None,
+                "score": score,
+            }
+            for cid, snippet, question_snippet, score in rows
+        ]
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM ids").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+# ------------------------------------------------------------------------------
+# 3) Bulk Build
+# ------------------------------------------------------------------------------
+def build(content_collection, path=DEFAULT_PATH, batch_size=5000):
+    """Index every passage into a fresh file, then swap it in place of `path`.
+    Run it while the app is stopped. Returns the number of passages indexed."""
+    tmp = path + ".building"
+    for stale in (tmp, tmp + "-wal", tmp + "-shm"):
+        if os.path.exists(stale):
+            os.remove(stale)
+    index = SearchIndex(tmp)
+    try:
+        indexed = index.catch_up(content_collection, batch_size=batch_size)
+        with index._lock:
+            index._db.execute("INSERT INTO passages (passages) VALUES ('optimize')")
+            index._db.execute("PRAGMA journal_mode = DELETE")
+            index._db.commit()
+    finally:
+        index.close()
+    for stale in (path + "-wal", path + "-shm"):
+        if os.path.exists(stale):
+            os.remove(stale)
+    os.replace(tmp, path)
+    return indexed
@@ -0,0 +1,142 @@
+"""Signed, expiring session tokens so a reload does not mean a new login.
+
+A token is `<session id>.<expiry>.<signature>`, signed with HMAC-SHA256.
+Forged or expired tokens are rejected without touching the database. A
+valid one is resolved through a small in-process cache, or else with one
+`_id` lookup in the `sessions` collection, whose TTL index removes
+expired sessions. The session also records the passage the annotator had
+open, so they can be put back on it.
+
+The app keeps the token in a cookie (COOKIE_NAME), never in the URL, where
+history, logs and shared links would leak it. `revoke` ends a session on
+logout; other processes notice within CACHE_SECONDS.
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING
+
+logger = logging.getLogger(__name__)
+
+SESSION_SECONDS = 7 * 24 * 3600
+# Cached sessions are re-read after this long, so deleting one from the
+# collection takes effect within a minute everywhere.
+CACHE_SECONDS = 60
+CACHE_SIZE = 10_000
+
+SESSION_FIELDS = {"_id": 0, "username": 1, "content_id": 1}
+
+COOKIE_NAME = "qa_session"
+
+def ensure_indexes(sessions_collection):
+    sessions_collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+
+def _secret():
+    secret = os.environ.get("SESSION_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    # Without a configured key tokens still work, but only for this process.
+    logger.warning("SESSION_SECRET is not set; session tokens will not survive a restart")
+    return secrets.token_bytes(32)
+
+class SessionStore:
+    def __init__(self, sessions_collection, secret=None, lifetime=SESSION_SECONDS):
+        self.sessions_collection = sessions_collection
+        self.secret = secret or _secret()
+        self.lifetime = lifetime
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    # -- tokens -----------------------------------------------------------------
+    def _sign(self, payload):
+        digest = hmac.new(self.secret, payload.encode("ascii"), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:18]).decode("ascii")
+
+    def _verify(self, token):
+        """(session id, expiry) if `token` is authentic and unexpired, else None."""
+        try:
+            session_id, expires, signature = token.split(".")
+            expires = int(expires)
+        except (AttributeError, ValueError):
+            return None
+        if not hmac.compare_digest(signature, self._sign(f"{session_id}.{expires}")):
+            return None
+        if expires <= time.time():
+            return None
+        return session_id, expires
+
+    # -- cache ------------------------------------------------------------------
+    def _cache_get(self, session_id):
+        with self._lock:
+            entry = self._cache.get(session_id)
+            if entry is None or entry["cached_at"] <= time.monotonic() - CACHE_SECONDS:
+                return None
+            self._cache.move_to_end(session_id)
+            return entry
+
+    def _cache_put(self, session_id, username, content_id):
+        with self._lock:
+            self._cache[session_id] = {"username": username, "content_id": content_id, "cached_at": time.monotonic()}
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    # -- sessions ---------------------------------------------------------------
+    def issue(self, username, content_id=None):
+        """Start a session for `username` and return its token."""
+        session_id = secrets.token_urlsafe(16)
+        expires = int(time.time()) + self.lifetime
+        self.sessions_collection.insert_one({
+            "_id": session_id,
+            "username": username,
+            "content_id": content_id,
+            "expires_at": datetime.fromtimestamp(expires, timezone.utc),
+        })
+        self._cache_put(session_id, username, content_id)
+        return f"{session_id}.{expires}.{self._sign(f'{session_id}.{expires}')}"
+
+    def resolve(self, token):
+        """{"username", "content_id"} for a live session, else None."""
+        verified = self._verify(token)
+        if not verified:
+            return None
+        session_id, _ = verified
+        entry = self._cache_get(session_id)
+        if entry:
+            return {"username": entry["username"], "content_id": entry["content_id"]}
+        doc = self.sessions_collection.find_one(
+            {"_id": session_id, "expires_at": {"$gt": datetime.now(timezone.utc)}}, SESSION_FIELDS
+        )
+        if not doc:
+            return None
+        self._cache_put(session_id, doc["username"], doc.get("content_id"))
+        return {"username": doc["username"], "content_id": doc.get("content_id")}
+
+    def revoke(self, token):
+        """End the session behind `token` (logout)."""
+        verified = self._verify(token)
+        if not verified:
+            return
+        session_id, _ = verified
+        self.sessions_collection.delete_one({"_id": session_id})
+        with self._lock:
+            self._cache.pop(session_id, None)
+
+    def remember_content(self, token, content_id):
+        """Record the passage the session has open. Call it when that changes."""
+        verified = self._verify(token)
+        if not verified:
+            return
+        session_id, _ = verified
+        self.sessions_collection.update_one({"_id": session_id}, {"$set": {"content_id": content_id}})
+        entry = self._cache_get(session_id)
+        if entry:
+            self._cache_put(session_id, entry["username"], content_id)
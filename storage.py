@@ -0,0 +1,761 @@
+"""One storage interface with Mongo, SQLite and in-memory backends.
+
+The apps only need a handful of operations: claim the next passage to
+work on, read one by id, save an edit of its questions, add a question,
+skip it, log an action, and register / log in a user (or, for the
+username-only apps, just record the name). `Storage` names
+them; every backend returns the same documents
+({content_id, content, questions, question_count, version}) and follows
+the same rules:
+
+- Questions are stored with a `qid` and `question_norm`
+  (content_ops.prepare_question), and every write bumps `version`.
+- Edits are three-way merged onto whatever is stored now
+  (content_ops.merge_question_edits), so concurrent edits are not lost.
+- A claimed passage is leased to one annotator for LEASE_SECONDS; passages
+  are offered emptiest first, then the user's skips, oldest first.
+
+`MongoStorage` maps the operations onto content_ops / work_queue / events,
+optionally with the prefetch buffer, body cache and write-behind event log
+app_1_working.py runs with. `SQLiteStorage` keeps everything in one local file in WAL mode, so several
+app processes on one machine can share it; `MemoryStorage` keeps it in
+dicts, for tests and benchmarks. `open_storage` picks one from a URL:
+
+    mongodb://... or mongodb+srv://...   MongoStorage (database Q_and_A)
+    sqlite:///path/to/file.sqlite        SQLiteStorage
+    memory://                            MemoryStorage
+
+Every app goes through a Storage for all of the above. The Mongo-only
+features (search, dedup, dashboards, login sessions) work on
+`MongoStorage.db` directly.
+"""
+import bisect
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import MongoClient, UpdateOne
+
+import content_cache
+import content_ops
+import events
+import ingest
+import metrics
+import passwords
+import prefetch
+import text_norm
+import work_queue
+from work_queue import LEASE_SECONDS, SKIP_TTL_SECONDS
+
+# What every backend returns for a passage.
+DOC_FIELDS = {**content_ops.QUEUE_FIELDS, "content": 1}
+
+# ------------------------------------------------------------------------------
+# 1) Interface
+# ------------------------------------------------------------------------------
+class Storage:
+    """Base class: the operations the apps use. Password hashing lives here;
+    backends only store and look up the hashes."""
+
+    # -- passages ---------------------------------------------------------------
+    def fetch_next(self, username, lease_seconds=LEASE_SECONDS, buffer=None):
+        """Lease the next passage for `username` and return it, or None.
+        `buffer` is what prefetch_buffer returned for this user, if anything."""
+        raise NotImplementedError
+
+    def prefetch_buffer(self, username):
+        """A per-session read-ahead for fetch_next, or None if the backend
+        has no use for one."""
+        return None
+
+    def claim(self, content_id, username, lease_seconds=LEASE_SECONDS):
+        """Lease a specific passage unless someone else holds it (reopening
+        it after a reload). Returns it, or None."""
+        raise NotImplementedError
+
+    def get_content(self, content_id):
+        raise NotImplementedError
+
+    def renew(self, content_id, username, lease_seconds=LEASE_SECONDS):
+        """Extend the caller's lease. Returns False if the lease was lost."""
+        raise NotImplementedError
+
+    def release(self, content_id, username):
+        raise NotImplementedError
+
+    def skip(self, username, content_id):
+        """Put the passage at the back of the user's queue and release it."""
+        raise NotImplementedError
+
+    def add_passages(self, records):
+        """Insert or refresh {content_id, content} records, keeping any
+        questions already stored. Returns the number of records written."""
+        raise NotImplementedError
+
+    def import_documents(self, docs):
+        """Store whole {content_id, content, questions} documents, replacing
+        any with the same content_id (seeding a store from an export, or
+        for benchmarks). Returns the number of documents written."""
+        raise NotImplementedError
+
+    # -- questions --------------------------------------------------------------
+    def save_question_edits(self, content_id, version, original, edited, deleted=(), added=()):
+        """Same contract as content_ops.save_question_edits: (saved, conflicts)."""
+        raise NotImplementedError
+
+    def add_question(self, content_id, question):
+        """Append one question; it gets its `qid` in place."""
+        raise NotImplementedError
+
+    # -- events -----------------------------------------------------------------
+    def log_action(self, username, content_id, action):
+        raise NotImplementedError
+
+    # -- users ------------------------------------------------------------------
+    def _password_hash(self, username):
+        raise NotImplementedError
+
+    def _insert_user(self, username, hashed_password):
+        """Returns False if the username is taken."""
+        raise NotImplementedError
+
+    def _replace_password(self, username, old_hash, new_hash):
+        raise NotImplementedError
+
+    def register_user(self, username, password):
+        if self._password_hash(username) is not None:
+            return False
+        return self._insert_user(username, passwords.hash_password(password))
+
+    def login_user(self, username, password):
+        hashed = self._password_hash(username)
+        if not hashed or not passwords.check_password(password, hashed):
+            return False
+        if passwords.needs_rehash(hashed):
+            # Upgrade to the configured cost; skipped if the password changed meanwhile.
+            self._replace_password(username, hashed, passwords.hash_password(password))
+        return True
+
+    def ensure_user(self, username):
+        """Record `username` for the apps that log in by name alone. Such an
+        account has no password, so login_user never accepts it."""
+        if self._password_hash(username) is None:
+            self._insert_user(username, b"")
+
+    def close(self):
+        pass
+
+# ------------------------------------------------------------------------------
+# 2) Mongo
+# ------------------------------------------------------------------------------
+class MongoStorage(Storage):
+    """The `Q_and_A` database.
+
+    With `write_behind`, actions are logged through an events.EventWriter
+    instead of one insert each. A `body_cache` (content_cache.LRUCache)
+    serves passage bodies from memory, so get_content only reads the
+    questions from Mongo.
+    """
+
+    def __init__(self, db, write_behind=False, body_cache=None):
+        self.db = db
+        self.content_collection = db["content_data"]
+        self.users_collection = db["users"]
+        self.skips_collection = db["skips"]
+        self.events_collection = db["events"]
+        self.event_writer = events.EventWriter(self.events_collection) if write_behind else None
+        self.body_cache = body_cache
+        content_ops.ensure_indexes(self.content_collection)
+        work_queue.ensure_indexes(self.content_collection, self.skips_collection)
+        events.ensure_indexes(self.events_collection)
+
+    def _with_ids(self, doc):
+        # Documents saved before question ids existed get them on first load.
+        if doc:
+            content_ops.assign_question_ids(self.content_collection, doc)
+        return doc
+
+    def prefetch_buffer(self, username):
+        return prefetch.PrefetchBuffer(self.content_collection, self.skips_collection, username)
+
+    def fetch_next(self, username, lease_seconds=LEASE_SECONDS, buffer=None):
+        if buffer is not None:
+            # Empty first, then < TARGET_QUESTIONS, bodies already in memory.
+            doc = buffer.take(lease_seconds)
+            if doc and self.body_cache is not None:
+                self.body_cache.put((doc["content_id"], doc.get("content_hash")), doc["content"])
+        else:
+            doc = work_queue.claim_next(
+                self.content_collection, self.skips_collection, username, lease_seconds, projection=DOC_FIELDS
+            )
+        if not doc:
+            doc = work_queue.claim_oldest_skip(
+                self.content_collection, self.skips_collection, username, lease_seconds, projection=DOC_FIELDS
+            )
+        return self._with_ids(doc)
+
+    def claim(self, content_id, username, lease_seconds=LEASE_SECONDS):
+        # Runs once per reload, so reading the body separately (or from the
+        # cache) costs little.
+        if work_queue.claim(self.content_collection, content_id, username, lease_seconds):
+            return self.get_content(content_id)
+        return None
+
+    def get_content(self, content_id):
+        if self.body_cache is not None:
+            doc = content_cache.load_content(self.content_collection, self.body_cache, content_id)
+        else:
+            doc = self.content_collection.find_one({"content_id": content_id}, DOC_FIELDS)
+        return self._with_ids(doc)
+
+    def renew(self, content_id, username, lease_seconds=LEASE_SECONDS):
+        return work_queue.renew(self.content_collection, content_id, username, lease_seconds)
+
+    def release(self, content_id, username):
+        work_queue.release(self.content_collection, content_id, username)
+
+    def skip(self, username, content_id):
+        work_queue.record_skip(self.skips_collection, username, content_id)
+        work_queue.release(self.content_collection, content_id, username)
+
+    def add_passages(self, records):
+        ops = [ingest.upsert_op(record) for record in records]
+        if ops:
+            self.content_collection.bulk_write(ops, ordered=False)
+        return len(ops)
+
+    def import_documents(self, docs):
+        ops = []
+        for doc in docs:
+            questions = [content_ops.prepare_question(dict(q)) for q in doc.get("questions", [])]
+            ops.append(UpdateOne(
+                {"content_id": doc["content_id"]},
+                {
+                    "$set": {
+                        "content": doc["content"],
+                        "content_hash": content_cache.content_hash(doc["content"]),
+                        "content_norm": text_norm.normalize(doc["content"]),
+                        "norm_version": text_norm.NORM_VERSION,
+                        "questions": questions,
+                        "question_count": len(questions),
+                    },
+                    "$inc": {"version": 1},
+                    "$currentDate": content_ops.TOUCH,
+                },
+                upsert=True,
+            ))
+        if ops:
+            self.content_collection.bulk_write(ops, ordered=False)
+        return len(ops)
+
+    def save_question_edits(self, content_id, version, original, edited, deleted=(), added=()):
+        return content_ops.save_question_edits(
+            self.content_collection, content_id, version, original, edited, deleted=deleted, added=added
+        )
+
+    def add_question(self, content_id, question):
+        content_ops.push_question(self.content_collection, content_id, question)
+        return question
+
+    def log_action(self, username, content_id, action):
+        if self.event_writer:
+            self.event_writer.log(username, content_id, action)
+        else:
+            events.log_event(self.events_collection, username, content_id, action)
+
+    def _password_hash(self, username):
+        user_doc = self.users_collection.find_one({"username": username}, content_ops.PASSWORD_FIELDS)
+        # Accounts made by the username-only apps have no hash.
+        return user_doc.get("hashed_password", b"") if user_doc else None
+
+    def _insert_user(self, username, hashed_password):
+        self.users_collection.insert_one({"username": username, "hashed_password": hashed_password})
+        return True
+
+    def _replace_password(self, username, old_hash, new_hash):
+        self.users_collection.update_one(
+            {"username": username, "hashed_password": old_hash},
+            {"$set": {"hashed_password": new_hash}}
+        )
+
+    def close(self):
+        if self.event_writer:
+            self.event_writer.close()
+        self.db.client.close()
+
+# ------------------------------------------------------------------------------
+# 3) Shared by the local backends
+# ------------------------------------------------------------------------------
+def _claimable(claimed_by, lease_expires_at, username, now):
+    return lease_expires_at is None or lease_expires_at <= now or claimed_by == username
+
+def apply_question_edits(questions, original, edited, deleted=(), added=()):
+    """Apply an edit made against `original` to the stored `questions`,
+    merged as content_ops.save_question_edits would. `added` must already
+    be prepared. Returns (new questions, changed, conflicts)."""
+    changes = content_ops.question_changes(original, edited)
+    changes, deleted, added, conflicts = content_ops.merge_question_edits(
+        original, changes, list(deleted), added, questions
+    )
+    updated = []
+    for q in questions:
+        if q.get("qid") in deleted:
+            continue
+        fields = changes.get(q.get("qid"))
+        if fields:
+            q = {**q, **fields}
+            if "question" in fields:
+                text_norm.with_normalized_question(q)
+        updated.append(q)
+    updated.extend(added)
+    return updated, bool(changes or deleted or added), conflicts
+
+def _new_doc(content_id, content=""):
+    return {
+        "content_id": content_id,
+        "content": content,
+        "content_hash": content_cache.content_hash(content),
+        "questions": [],
+        "question_count": 0,
+        "version": 0,
+        "claimed_by": None,
+        "lease_expires_at": None,
+    }
+
+# ------------------------------------------------------------------------------
+# 4) SQLite
+# ------------------------------------------------------------------------------
+SQLITE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS content ("
+    " content_id TEXT PRIMARY KEY, content TEXT NOT NULL DEFAULT '', content_hash TEXT,"
+    " questions TEXT NOT NULL DEFAULT '[]', question_count INTEGER NOT NULL DEFAULT 0,"
+    " version INTEGER NOT NULL DEFAULT 0, claimed_by TEXT, lease_expires_at REAL, updated_at REAL)",
+    "CREATE INDEX IF NOT EXISTS content_queue ON content (question_count, content_id)",
+    "CREATE TABLE IF NOT EXISTS skips ("
+    " username TEXT NOT NULL, content_id TEXT NOT NULL, skipped_at REAL NOT NULL,"
+    " PRIMARY KEY (username, content_id))",
+    "CREATE INDEX IF NOT EXISTS skips_oldest ON skips (username, skipped_at)",
+    "CREATE TABLE IF NOT EXISTS events (ts REAL NOT NULL, username TEXT, content_id TEXT, action TEXT)",
+    "CREATE INDEX IF NOT EXISTS events_user ON events (username, ts)",
+    "CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, hashed_password BLOB NOT NULL)",
+)
+
+SQLITE_DOC_COLUMNS = "content_id, content, questions, question_count, version"
+
+# No live lease, or one the caller already holds.
+_SQLITE_CLAIMABLE = "(lease_expires_at IS NULL OR lease_expires_at <= ? OR claimed_by = ?)"
+
+class SQLiteStorage(Storage):
+    """One connection per process, serialized with a lock. Every write runs
+    in a BEGIN IMMEDIATE transaction, so read-merge-write sequences are
+    atomic even across processes sharing the file; WAL lets readers carry
+    on meanwhile."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        # Durable at checkpoints rather than at every commit, the usual WAL trade-off.
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("PRAGMA busy_timeout = 5000")
+        with self._transaction() as db:
+            for statement in SQLITE_SCHEMA:
+                db.execute(statement)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    @staticmethod
+    def _to_doc(row):
+        if row is None:
+            return None
+        content_id, content, questions, question_count, version = row
+        return {
+            "content_id": content_id,
+            "content": content,
+            "questions": json.loads(questions),
+            "question_count": question_count,
+            "version": version,
+        }
+
+    def _read(self, db, content_id):
+        return self._to_doc(db.execute(
+            f"SELECT {SQLITE_DOC_COLUMNS} FROM content WHERE content_id = ?", (content_id,)
+        ).fetchone())
+
+    def _write_questions(self, db, content_id, questions):
+        db.execute(
+            "UPDATE content SET questions = ?, question_count = ?, version = version + 1, updated_at = ?"
+            " WHERE content_id = ?",
+            (json.dumps(questions, ensure_ascii=False), len(questions), time.time(), content_id),
+        )
+
+    def _claim(self, db, content_id, username, now, lease_seconds, incomplete_only=False):
+        query = f"UPDATE content SET claimed_by = ?, lease_expires_at = ? WHERE content_id = ? AND {_SQLITE_CLAIMABLE}"
+        params = [username, now + lease_seconds, content_id, now, username]
+        if incomplete_only:
+            query += " AND question_count < ?"
+            params.append(content_ops.TARGET_QUESTIONS)
+        if db.execute(query, params).rowcount:
+            return self._read(db, content_id)
+        return None
+
+    # -- passages ---------------------------------------------------------------
+    def fetch_next(self, username, lease_seconds=LEASE_SECONDS, buffer=None):
+        now = time.time()
+        skip_cutoff = now - SKIP_TTL_SECONDS
+        with self._transaction() as db:
+            row = db.execute(
+                f"SELECT content_id FROM content WHERE question_count < ? AND {_SQLITE_CLAIMABLE}"
+                " AND content_id NOT IN (SELECT content_id FROM skips WHERE username = ? AND skipped_at > ?)"
+                " ORDER BY question_count, content_id LIMIT 1",
+                (content_ops.TARGET_QUESTIONS, now, username, username, skip_cutoff),
+            ).fetchone()
+            if row:
+                return self._claim(db, row[0], username, now, lease_seconds, incomplete_only=True)
+            # Nothing new: re-offer skips, oldest first, consuming each as it is offered.
+            skipped = db.execute(
+                "SELECT content_id FROM skips WHERE username = ? AND skipped_at > ? ORDER BY skipped_at",
+                (username, skip_cutoff),
+            ).fetchall()
+            for (content_id,) in skipped:
+                db.execute("DELETE FROM skips WHERE username = ? AND content_id = ?", (username, content_id))
+                doc = self._claim(db, content_id, username, now, lease_seconds)
+                if doc:
+                    return doc
+        return None
+
+    def claim(self, content_id, username, lease_seconds=LEASE_SECONDS):
+        with self._transaction() as db:
+            return self._claim(db, content_id, username, time.time(), lease_seconds)
+
+    def get_content(self, content_id):
+        with self._lock:
+            return self._read(self._db, content_id)
+
+    def renew(self, content_id, username, lease_seconds=LEASE_SECONDS):
+        with self._transaction() as db:
+            return db.execute(
+                "UPDATE content SET lease_expires_at = ? WHERE content_id = ? AND claimed_by = ?",
+                (time.time() + lease_seconds, content_id, username),
+            ).rowcount == 1
+
+    def release(self, content_id, username):
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE content SET claimed_by = NULL, lease_expires_at = NULL WHERE content_id = ? AND claimed_by = ?",
+                (content_id, username),
+            )
+
+    def skip(self, username, content_id):
+        with self._transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO skips (username, content_id, skipped_at) VALUES (?, ?, ?)",
+                (username, content_id, time.time()),
+            )
+            db.execute(
+                "UPDATE content SET claimed_by = NULL, lease_expires_at = NULL WHERE content_id = ? AND claimed_by = ?",
+                (content_id, username),
+            )
+
+    def add_passages(self, records):
+        rows = [
+            (r["content_id"], r["content"], content_cache.content_hash(r["content"]), time.time())
+            for r in records
+        ]
+        with self._transaction() as db:
+            db.executemany(
+                "INSERT INTO content (content_id, content, content_hash, updated_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (content_id) DO UPDATE SET"
+                " content = excluded.content, content_hash = excluded.content_hash, updated_at = excluded.updated_at",
+                rows,
+            )
+        return len(rows)
+
+    def import_documents(self, docs):
+        rows = []
+        for doc in docs:
+            questions = [content_ops.prepare_question(dict(q)) for q in doc.get("questions", [])]
+            rows.append((
+                doc["content_id"], doc["content"], content_cache.content_hash(doc["content"]),
+                json.dumps(questions, ensure_ascii=False), len(questions), time.time(),
+            ))
+        with self._transaction() as db:
+            db.executemany(
+                "INSERT INTO content (content_id, content, content_hash, questions, question_count, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (content_id) DO UPDATE SET"
+                " content = excluded.content, content_hash = excluded.content_hash, questions = excluded.questions,"
+                " question_count = excluded.question_count, version = version + 1, updated_at = excluded.updated_at",
+                rows,
+            )
+        return len(rows)
+
+    # -- questions --------------------------------------------------------------
+    def save_question_edits(self, content_id, version, original, edited, deleted=(), added=()):
+        # The write lock makes read-merge-write atomic, so `version` is not
+        # needed to detect a race here.
+        added = [content_ops.prepare_question(q) for q in added]
+        with self._transaction() as db:
+            current = self._read(db, content_id)
+            if current is None:
+                return False, []
+            questions, changed, conflicts = apply_question_edits(
+                current["questions"], original, edited, deleted, added
+            )
+            if changed:
+                self._write_questions(db, content_id, questions)
+        return changed, conflicts
+
+    def add_question(self, content_id, question):
+        content_ops.prepare_question(question)
+        with self._transaction() as db:
+            current = self._read(db, content_id)
+            if current is None:
+                db.execute("INSERT INTO content (content_id) VALUES (?)", (content_id,))
+                current = {"questions": []}
+            self._write_questions(db, content_id, current["questions"] + [question])
+        return question
+
+    # -- events -----------------------------------------------------------------
+    def log_action(self, username, content_id, action):
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO events (ts, username, content_id, action) VALUES (?, ?, ?, ?)",
+                (time.time(), username, content_id, action),
+            )
+
+    # -- users ------------------------------------------------------------------
+    def _password_hash(self, username):
+        with self._lock:
+            row = self._db.execute("SELECT hashed_password FROM users WHERE username = ?", (username,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def _insert_user(self, username, hashed_password):
+        with self._transaction() as db:
+            return db.execute(
+                "INSERT OR IGNORE INTO users (username, hashed_password) VALUES (?, ?)", (username, hashed_password)
+            ).rowcount == 1
+
+    def _replace_password(self, username, old_hash, new_hash):
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE users SET hashed_password = ? WHERE username = ? AND hashed_password = ?",
+                (new_hash, username, old_hash),
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+# ------------------------------------------------------------------------------
+# 5) In-memory
+# ------------------------------------------------------------------------------
+class MemoryStorage(Storage):
+    """Everything in dicts behind one lock; gone when the process exits.
+
+    Incomplete passages are kept in a sorted list of
+    (question_count, content_id), so fetch_next walks them in queue order
+    without sorting on every call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._queue = []
+        self._skips = {}
+        self._users = {}
+        self.events = []
+
+    def _public(self, doc):
+        return {
+            "content_id": doc["content_id"],
+            "content": doc["content"],
+            "questions": [dict(q) for q in doc["questions"]],
+            "question_count": doc["question_count"],
+            "version": doc["version"],
+        }
+
+    def _unqueue(self, doc):
+        key = (doc["question_count"], doc["content_id"])
+        i = bisect.bisect_left(self._queue, key)
+        if i < len(self._queue) and self._queue[i] == key:
+            del self._queue[i]
+
+    def _enqueue(self, doc):
+        if doc["question_count"] < content_ops.TARGET_QUESTIONS:
+            bisect.insort(self._queue, (doc["question_count"], doc["content_id"]))
+
+    def _set_questions(self, doc, questions):
+        self._unqueue(doc)
+        doc["questions"] = questions
+        doc["question_count"] = len(questions)
+        doc["version"] += 1
+        self._enqueue(doc)
+
+    def _claim(self, doc, username, now, lease_seconds):
+        if not _claimable(doc["claimed_by"], doc["lease_expires_at"], username, now):
+            return None
+        doc["claimed_by"] = username
+        doc["lease_expires_at"] = now + lease_seconds
+        return self._public(doc)
+
+    # -- passages ---------------------------------------------------------------
+    def fetch_next(self, username, lease_seconds=LEASE_SECONDS, buffer=None):
+        now = time.time()
+        with self._lock:
+            skips = self._skips.setdefault(username, {})
+            for stale in [cid for cid, at in skips.items() if at <= now - SKIP_TTL_SECONDS]:
+                del skips[stale]
+            for _, content_id in self._queue:
+                if content_id not in skips:
+                    doc = self._claim(self._docs[content_id], username, now, lease_seconds)
+                    if doc:
+                        return doc
+            # Nothing new: re-offer skips, oldest first, consuming each as it is offered.
+            for content_id in sorted(skips, key=skips.get):
+                del skips[content_id]
+                if content_id in self._docs:
+                    doc = self._claim(self._docs[content_id], username, now, lease_seconds)
+                    if doc:
+                        return doc
+        return None
+
+    def claim(self, content_id, username, lease_seconds=LEASE_SECONDS):
+        with self._lock:
+            doc = self._docs.get(content_id)
+            return self._claim(doc, username, time.time(), lease_seconds) if doc else None
+
+    def get_content(self, content_id):
+        with self._lock:
+            doc = self._docs.get(content_id)
+            return self._public(doc) if doc else None
+
+    def renew(self, content_id, username, lease_seconds=LEASE_SECONDS):
+        with self._lock:
+            doc = self._docs.get(content_id)
+            if not doc or doc["claimed_by"] != username:
+                return False
+            doc["lease_expires_at"] = time.time() + lease_seconds
+            return True
+
+    def _release(self, content_id, username):
+        doc = self._docs.get(content_id)
+        if doc and doc["claimed_by"] == username:
+            doc["claimed_by"] = doc["lease_expires_at"] = None
+
+    def release(self, content_id, username):
+        with self._lock:
+            self._release(content_id, username)
+
+    def skip(self, username, content_id):
+        with self._lock:
+            self._skips.setdefault(username, {})[content_id] = time.time()
+            self._release(content_id, username)
+
+    def add_passages(self, records):
+        written = 0
+        with self._lock:
+            for record in records:
+                doc = self._docs.get(record["content_id"])
+                if doc:
+                    doc["content"] = record["content"]
+                    doc["content_hash"] = content_cache.content_hash(record["content"])
+                else:
+                    doc = self._docs[record["content_id"]] = _new_doc(record["content_id"], record["content"])
+                    self._enqueue(doc)
+                written += 1
+        return written
+
+    def import_documents(self, docs):
+        imported = []
+        for doc in docs:
+            stored = _new_doc(doc["content_id"], doc["content"])
+            stored["questions"] = [content_ops.prepare_question(dict(q)) for q in doc.get("questions", [])]
+            stored["question_count"] = len(stored["questions"])
+            imported.append(stored)
+        with self._lock:
+            for doc in imported:
+                old = self._docs.get(doc["content_id"])
+                if old:
+                    self._unqueue(old)
+                    doc["version"] = old["version"] + 1
+                self._docs[doc["content_id"]] = doc
+            # One sort instead of an insort per document, for large imports.
+            self._queue.extend(
+                (doc["question_count"], doc["content_id"])
+                for doc in imported if doc["question_count"] < content_ops.TARGET_QUESTIONS
+            )
+            self._queue.sort()
+        return len(imported)
+
+    # -- questions --------------------------------------------------------------
+    def save_question_edits(self, content_id, version, original, edited, deleted=(), added=()):
+        added = [content_ops.prepare_question(q) for q in added]
+        with self._lock:
+            doc = self._docs.get(content_id)
+            if doc is None:
+                return False, []
+            questions, changed, conflicts = apply_question_edits(doc["questions"], original, edited, deleted, added)
+            if changed:
+                self._set_questions(doc, questions)
+        return changed, conflicts
+
+    def add_question(self, content_id, question):
+        content_ops.prepare_question(question)
+        with self._lock:
+            doc = self._docs.get(content_id)
+            if doc is None:
+                doc = self._docs[content_id] = _new_doc(content_id)
+                self._enqueue(doc)
+            self._set_questions(doc, doc["questions"] + [dict(question)])
+        return question
+
+    # -- events -----------------------------------------------------------------
+    def log_action(self, username, content_id, action):
+        with self._lock:
+            self.events.append(events.make_event(username, content_id, action))
+
+    # -- users ------------------------------------------------------------------
+    def _password_hash(self, username):
+        return self._users.get(username)
+
+    def _insert_user(self, username, hashed_password):
+        with self._lock:
+            if username in self._users:
+                return False
+            self._users[username] = hashed_password
+            return True
+
+    def _replace_password(self, username, old_hash, new_hash):
+        with self._lock:
+            if self._users.get(username) == old_hash:
+                self._users[username] = new_hash
+
+# ------------------------------------------------------------------------------
+# 6) Selection
+# ------------------------------------------------------------------------------
+def is_mongo_url(url):
+    return url.startswith(("mongodb://", "mongodb+srv://"))
+
+def open_storage(url, **kwargs):
+    """Backend for `url` (see the module docstring). Extra keyword arguments
+    go to MongoStorage."""
+    if is_mongo_url(url):
+        return MongoStorage(MongoClient(url, event_listeners=metrics.mongo_listeners())["Q_and_A"], **kwargs)
+    if url.startswith("sqlite:///"):
+        return SQLiteStorage(url[len("sqlite:///"):])
+    if url == "memory://":
+        return MemoryStorage()
+    raise ValueError(f"Unsupported storage URL: {url!r}")
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules live at the repository root, next to the apps.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Cheap hashes; must be set before passwords.py is imported.
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
@@ -0,0 +1,91 @@
+import mongomock
+import pytest
+
+import content_ops
+
+@pytest.fixture
+def content_collection():
+    return mongomock.MongoClient()["Q_and_A"]["content_data"]
+
+def stored_qids(content_collection, content_id):
+    doc = content_collection.find_one({"content_id": content_id})
+    return [q.get("qid") for q in doc["questions"]]
+
+# ------------------------------------------------------------------------------
+# Question ids
+# ------------------------------------------------------------------------------
+def test_assign_question_ids_stores_new_ids(content_collection):
+    content_collection.insert_one({"content_id": "a", "questions": [{"question": "x?"}, {"question": "y?"}], "version": 0})
+    doc = content_collection.find_one({"content_id": "a"}, content_ops.QUEUE_FIELDS)
+    assert content_ops.assign_question_ids(content_collection, doc) == 2
+    assert [q["qid"] for q in doc["questions"]] == stored_qids(content_collection, "a")
+
+def test_assign_question_ids_adopts_ids_from_a_winning_session(content_collection):
+    content_collection.insert_one({"content_id": "a", "questions": [{"question": "x?"}, {"question": "y?"}], "version": 0})
+    ours = content_collection.find_one({"content_id": "a"}, content_ops.QUEUE_FIELDS)
+    theirs = content_collection.find_one({"content_id": "a"}, content_ops.QUEUE_FIELDS)
+    content_ops.assign_question_ids(content_collection, theirs)
+
+    assert content_ops.assign_question_ids(content_collection, ours) == 0
+    assert [q["qid"] for q in ours["questions"]] == stored_qids(content_collection, "a")
+    assert [q["qid"] for q in ours["questions"]] == [q["qid"] for q in theirs["questions"]]
+
+# ------------------------------------------------------------------------------
+# Three-way merge
+# ------------------------------------------------------------------------------
+def question(qid, text, difficulty="easy"):
+    return {"qid": qid, "question": text, "difficulty": difficulty, "answer": ""}
+
+BASE = [question("a", "A?"), question("b", "B?"), question("c", "C?")]
+
+def test_merge_keeps_edits_to_questions_nobody_else_touched():
+    theirs = [question("a", "A?"), question("b", "B edited by them?"), question("c", "C?")]
+    merged = content_ops.merge_question_edits(BASE, {"a": {"question": "A edited by us?"}}, [], [], theirs)
+    assert merged == ({"a": {"question": "A edited by us?"}}, [], [], [])
+
+def test_merge_keeps_edits_to_other_fields_of_the_same_question():
+    theirs = [question("a", "A edited by them?"), question("b", "B?"), question("c", "C?")]
+    merged = content_ops.merge_question_edits(BASE, {"a": {"difficulty": "hard"}}, [], [], theirs)
+    assert merged == ({"a": {"difficulty": "hard"}}, [], [], [])
+
+def test_merge_drops_edits_already_made_identically():
+    theirs = [question("a", "Same?"), question("b", "B?"), question("c", "C?")]
+    merged = content_ops.merge_question_edits(BASE, {"a": {"question": "Same?"}}, [], [], theirs)
+    assert merged == ({}, [], [], [])
+
+def test_merge_reports_a_field_changed_on_both_sides():
+    theirs = [question("a", "Theirs?"), question("b", "B?"), question("c", "C?")]
+    merged = content_ops.merge_question_edits(BASE, {"a": {"question": "Ours?"}}, [], [], theirs)
+    assert merged == ({}, [], [], ["a"])
+
+def test_merge_reports_an_edit_to_a_question_they_deleted():
+    theirs = [question("b", "B?"), question("c", "C?")]
+    merged = content_ops.merge_question_edits(BASE, {"a": {"question": "Ours?"}}, [], [], theirs)
+    assert merged == ({}, [], [], ["a"])
+
+def test_merge_keeps_a_question_we_deleted_but_they_edited():
+    theirs = [question("a", "A?"), question("b", "B?", "hard"), question("c", "C?")]
+    merged = content_ops.merge_question_edits(BASE, {}, ["b", "c"], [], theirs)
+    assert merged == ({}, ["c"], [], ["b"])
+
+def test_merge_skips_deletes_and_adds_that_already_landed():
+    added = question("d", "D?")
+    theirs = [question("a", "A?"), added]
+    merged = content_ops.merge_question_edits(BASE, {}, ["b"], [added], theirs)
+    assert merged == ({}, [], [], [])
+
+# ------------------------------------------------------------------------------
+# Change detection
+# ------------------------------------------------------------------------------
+def test_question_changes_sees_case_and_punctuation_corrections():
+    original = [question("a", "what is dna?"), question("b", 'He said "yes" - twice'), question("c", "C?")]
+    edited = [question("a", "What is DNA?"), question("b", "He said “yes” — twice"), question("c", "C?")]
+    assert content_ops.question_changes(original, edited) == {
+        "a": {"question": "What is DNA?"},
+        "b": {"question": "He said “yes” — twice"},
+    }
+
+def test_question_changes_ignores_whitespace_and_unicode_form():
+    original = [question("a", "కి మాట?")]
+    edited = [question("a", "  కి\nమాట? ")]
+    assert content_ops.question_changes(original, edited) == {}
@@ -0,0 +1,24 @@
+import io
+import json
+
+import mongomock
+
+import dedup
+
+def test_scan_corpus_reports_each_near_duplicate_pair_once():
+    db = mongomock.MongoClient()["Q_and_A"]
+    db["content_data"].insert_many([
+        {"content_id": "000001", "question_count": 2, "questions": [
+            {"qid": "a", "question": "What is the powerhouse of the cell?"},
+            {"qid": "b", "question": "Where do plants get their water from?"},
+        ]},
+        {"content_id": "000002", "question_count": 1, "questions": [
+            {"qid": "c", "question": "What is the powerhouse of the cell!"},
+        ]},
+    ])
+    out = io.StringIO()
+    # A batch smaller than the corpus, so signatures and buckets span batches.
+    assert dedup.scan_corpus(db["content_data"], db["question_signatures"], batch_size=2, out=out) == (3, 1)
+    pair = json.loads(out.getvalue())
+    assert {pair["qid_a"], pair["qid_b"]} == {"a", "c"}
+    assert pair["similarity"] == 1.0 and not pair["same_passage"]
@@ -0,0 +1,10 @@
+import mongomock
+import pytest
+
+import export
+
+def test_export_needs_at_least_one_format(tmp_path):
+    content = mongomock.MongoClient()["Q_and_A"]["content_data"]
+    with pytest.raises(ValueError):
+        export.export(content, str(tmp_path), formats=())
+    assert not any(tmp_path.iterdir())
@@ -0,0 +1,33 @@
+import mongomock
+
+import content_ops
+import ingest
+import storage
+
+def write_jsonl(tmp_path, lines):
+    path = tmp_path / "passages.jsonl"
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+LINES = [
+    '{"content_id": "1", "content": "first"}',
+    '{"content_id": "2", "content": "sec',
+    '["not", "an", "object"]',
+    '"just a string"',
+    '{"content_id": "3", "content": "third"}',
+]
+
+def test_malformed_lines_are_counted_and_skipped(tmp_path):
+    content_collection = mongomock.MongoClient()["Q_and_A"]["content_data"]
+    stats = ingest.ingest(content_collection, write_jsonl(tmp_path, LINES), report_every=0)
+    assert (stats["read"], stats["invalid"], stats["inserted"]) == (5, 3, 2)
+    assert sorted(d["content_id"] for d in content_collection.find({}, {"content_id": 1})) == ["1", "3"]
+
+def test_malformed_lines_are_skipped_for_local_storage(tmp_path):
+    stats = ingest.ingest_into(storage.MemoryStorage(), write_jsonl(tmp_path, LINES))
+    assert (stats["read"], stats["invalid"], stats["written"]) == (5, 3, 2)
+
+def test_content_id_index_is_unique():
+    content_collection = mongomock.MongoClient()["Q_and_A"]["content_data"]
+    content_ops.ensure_indexes(content_collection)
+    assert content_collection.index_information()["content_id_1"].get("unique")
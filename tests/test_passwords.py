@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+import passwords
+
+def test_hash_and_check_round_trip():
+    hashed = passwords.hash_password("pw")
+    assert passwords.check_password("pw", hashed)
+    assert not passwords.check_password("other", hashed)
+
+def test_a_timed_out_hash_is_reported_as_busy(monkeypatch):
+    monkeypatch.setattr(passwords, "TIMEOUT_SECONDS", 0.01)
+    with pytest.raises(passwords.PasswordBusy):
+        passwords._run("check", time.sleep, 0.2)
+
+def test_a_timed_out_hash_keeps_its_slot_until_it_finishes(monkeypatch):
+    monkeypatch.setattr(passwords, "TIMEOUT_SECONDS", 0.01)
+    monkeypatch.setattr(passwords, "_slots", passwords.threading.BoundedSemaphore(1))
+    finish = passwords.threading.Event()
+    with pytest.raises(passwords.PasswordBusy):
+        passwords._run("check", finish.wait)
+    with pytest.raises(passwords.PasswordBusy):
+        passwords._run("check", lambda: True)
+    finish.set()
+    assert passwords._slots.acquire(timeout=5)
+
+def test_throttle_limits_attempts_per_key():
+    throttle = passwords.Throttle(2, window=60)
+    assert throttle.hit("alice") == 0
+    assert throttle.hit("alice") == 0
+    assert throttle.hit("alice") > 0
+    assert throttle.hit("bob") == 0
@@ -0,0 +1,144 @@
+"""Every read path names its fields: nothing fetches a whole document, the
+embedded activity arrays never travel, and only the reads that display a
+passage fetch its body."""
+import mongomock
+import pytest
+
+import content_cache
+import content_ops
+import passwords
+import prefetch
+import sessions
+import storage
+import work_queue
+
+# Fields that grow without bound on old documents.
+UNBOUNDED = ("users", "activity_logs")
+
+class RecordingCollection:
+    """A mongomock collection that records the projection of every read."""
+
+    def __init__(self, collection, reads):
+        self._collection = collection
+        self._reads = reads
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def _record(self, method, projection):
+        self._reads.append((self._collection.name, method, projection))
+
+    def find(self, filter=None, projection=None, *args, **kwargs):
+        self._record("find", projection)
+        return self._collection.find(filter, projection, *args, **kwargs)
+
+    def find_one(self, filter=None, projection=None, *args, **kwargs):
+        self._record("find_one", projection)
+        return self._collection.find_one(filter, projection, *args, **kwargs)
+
+    def find_one_and_update(self, filter, update, projection=None, **kwargs):
+        self._record("find_one_and_update", projection)
+        return self._collection.find_one_and_update(filter, update, projection=projection, **kwargs)
+
+    def find_one_and_delete(self, filter, projection=None, **kwargs):
+        self._record("find_one_and_delete", projection)
+        return self._collection.find_one_and_delete(filter, projection=projection, **kwargs)
+
+class RecordingDatabase:
+    def __init__(self, db):
+        self._db = db
+        self._collections = {}
+        self.reads = []
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = RecordingCollection(self._db[name], self.reads)
+        return self._collections[name]
+
+@pytest.fixture
+def db():
+    db = RecordingDatabase(mongomock.MongoClient()["Q_and_A"])
+    db["content_data"].insert_many([
+        {
+            "content_id": f"{i:06d}",
+            "content": f"passage {i}",
+            "content_hash": content_cache.content_hash(f"passage {i}"),
+            "questions": [{"qid": f"q{i}-{j}", "question": f"q{j}?", "difficulty": "easy", "answer": ""} for j in range(i)],
+            "question_count": i,
+            "version": 0,
+            "users": [{"username": "old", "action": "added question"}] * 50,
+        }
+        for i in range(8)
+    ])
+    db["users"].insert_one({
+        "username": "alice",
+        "hashed_password": passwords.hash_password("pw"),
+        "activity_logs": [{"content_id": "000001", "action": "skipped"}] * 50,
+    })
+    db.reads.clear()
+    return db
+
+def assert_lean(reads, body=()):
+    """Every read projects named fields; only collections in `body` may fetch `content`."""
+    assert reads
+    for collection, method, projection in reads:
+        assert projection, f"{collection}.{method} fetched the whole document"
+        assert any(v for k, v in projection.items() if k != "_id"), f"{collection}.{method} is an exclusion projection"
+        for field in UNBOUNDED:
+            assert not any(k.split(".")[0] == field for k in projection), f"{collection}.{method} fetched {field}"
+        if "content" in projection:
+            assert (collection, method) in body, f"{collection}.{method} fetched the passage body"
+
+def test_claim_next_reads_no_body(db):
+    doc = work_queue.claim_next(db["content_data"], db["skips"], "alice")
+    assert doc["content_id"] == "000000"
+    assert "content" not in doc and "users" not in doc
+    assert_lean(db.reads)
+
+def test_claim_oldest_skip_reads_no_body(db):
+    work_queue.record_skip(db["skips"], "alice", "000003")
+    doc = work_queue.claim_oldest_skip(db["content_data"], db["skips"], "alice")
+    assert doc["content_id"] == "000003"
+    assert_lean(db.reads)
+
+def test_prefetch_fetches_bodies_only_for_candidates(db):
+    doc = prefetch.PrefetchBuffer(db["content_data"], db["skips"], "alice").take()
+    assert doc["content"] == "passage 0"
+    assert_lean(db.reads, body={("content_data", "find")})
+    claims = [p for _, m, p in db.reads if m == "find_one_and_update"]
+    assert claims == [content_ops.QUEUE_FIELDS]
+
+def test_load_content_reads_body_only_on_a_miss(db):
+    cache = content_cache.LRUCache()
+    doc = content_cache.load_content(db["content_data"], cache, "000002")
+    assert doc["content"] == "passage 2" and len(doc["questions"]) == 2
+    assert [p for _, _, p in db.reads] == [content_ops.QUESTIONS_FIELDS, content_ops.BODY_FIELDS]
+    assert_lean(db.reads, body={("content_data", "find_one")})
+
+    db.reads.clear()
+    content_cache.load_content(db["content_data"], cache, "000002")
+    assert [p for _, _, p in db.reads] == [content_ops.QUESTIONS_FIELDS]
+
+def test_login_reads_only_the_hash(db):
+    store = storage.MongoStorage(db)
+    db.reads.clear()
+    assert store.login_user("alice", "pw")
+    assert not store.register_user("alice", "other")
+    assert_lean(db.reads)
+    assert all(p == content_ops.PASSWORD_FIELDS for _, _, p in db.reads)
+
+def test_storage_reads_are_lean(db):
+    store = storage.MongoStorage(db)
+    db.reads.clear()
+    doc = store.fetch_next("alice")
+    assert doc["content"] == "passage 0"
+    store.get_content("000004")
+    # MongoStorage returns whole passages, so its reads may fetch the body.
+    assert_lean(db.reads, body={("content_data", "find_one_and_update"), ("content_data", "find_one")})
+
+def test_session_resolve_reads_username_and_passage(db):
+    store = sessions.SessionStore(db["sessions"], secret=b"test")
+    token = store.issue("alice", "000001")
+    store._cache.clear()
+    assert store.resolve(token) == {"username": "alice", "content_id": "000001"}
+    assert [p for _, _, p in db.reads] == [sessions.SESSION_FIELDS]
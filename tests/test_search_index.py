@@ -0,0 +1,19 @@
+import pytest
+
+import search_index
+
+@pytest.fixture
+def index(tmp_path):
+    index = search_index.SearchIndex(str(tmp_path / "search.sqlite"))
+    index.upsert_docs([
+        {"content_id": "a", "content": "Mitochondria are the powerhouse of the cell.", "questions": [{"question": "What is ATP?"}]},
+        {"content_id": "b", "content": "Plants make sugar.", "questions": [{"question": "Where is the powerhouse?"}]},
+    ])
+    yield index
+    index.close()
+
+def test_question_snippet_only_when_a_question_matched(index):
+    hits = {hit["content_id"]: hit for hit in index.search("powerhouse")}
+    assert hits["a"]["question_snippet"] is None
+    assert search_index.HIGHLIGHT in hits["a"]["snippet"]
+    assert search_index.HIGHLIGHT in hits["b"]["question_snippet"]
@@ -0,0 +1,25 @@
+import mongomock
+
+import sessions
+
+def make_store():
+    return sessions.SessionStore(mongomock.MongoClient()["Q_and_A"]["sessions"], secret=b"test")
+
+def test_resolve_returns_the_session_behind_a_token():
+    store = make_store()
+    token = store.issue("alice", "000001")
+    assert store.resolve(token) == {"username": "alice", "content_id": "000001"}
+
+def test_resolve_rejects_a_tampered_token():
+    store = make_store()
+    token = store.issue("alice")
+    assert store.resolve(token[:-1] + ("0" if token[-1] != "0" else "1")) is None
+
+def test_revoke_ends_the_session_everywhere():
+    store = make_store()
+    other_process = sessions.SessionStore(store.sessions_collection, secret=b"test")
+    token = store.issue("alice")
+    store.revoke(token)
+    assert store.resolve(token) is None
+    assert other_process.resolve(token) is None
+    assert store.sessions_collection.count_documents({}) == 0
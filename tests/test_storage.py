@@ -0,0 +1,46 @@
+import mongomock
+import pytest
+
+import content_cache
+import storage
+
+@pytest.fixture(params=["memory", "sqlite", "mongo"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = storage.MemoryStorage()
+    elif request.param == "sqlite":
+        store = storage.SQLiteStorage(str(tmp_path / "store.sqlite"))
+    else:
+        store = storage.MongoStorage(mongomock.MongoClient()["Q_and_A"])
+    store.add_passages([{"content_id": f"{i:06d}", "content": f"passage {i}"} for i in range(3)])
+    return store
+
+def test_claim_reopens_a_passage_only_if_nobody_else_holds_it(store):
+    doc = store.fetch_next("alice")
+    assert store.claim(doc["content_id"], "bob") is None
+    reopened = store.claim(doc["content_id"], "alice")
+    assert reopened["content"] == doc["content"]
+    store.release(doc["content_id"], "alice")
+    assert store.claim(doc["content_id"], "bob")["content_id"] == doc["content_id"]
+
+def test_fetch_next_leases_distinct_passages(store):
+    buffers = {user: store.prefetch_buffer(user) for user in ("alice", "bob", "carol")}
+    fetched = [store.fetch_next(user, buffer=buffer)["content_id"] for user, buffer in buffers.items()]
+    assert sorted(fetched) == ["000000", "000001", "000002"]
+    assert store.fetch_next("dave", buffer=store.prefetch_buffer("dave")) is None
+
+def test_mongo_prefetched_bodies_land_in_the_body_cache():
+    cache = content_cache.LRUCache()
+    store = storage.MongoStorage(mongomock.MongoClient()["Q_and_A"], body_cache=cache)
+    store.add_passages([{"content_id": "000000", "content": "passage 0"}])
+    doc = store.fetch_next("alice", buffer=store.prefetch_buffer("alice"))
+    assert doc["content"] == "passage 0"
+    assert store.get_content("000000")["content"] == "passage 0"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 0
+
+def test_ensure_user_records_a_name_that_cannot_log_in(store):
+    store.ensure_user("alice")
+    store.ensure_user("alice")
+    assert not store.login_user("alice", "")
+    assert not store.register_user("alice", "pw")
+    assert store.register_user("bob", "pw") and store.login_user("bob", "pw")
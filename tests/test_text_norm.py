@@ -0,0 +1,19 @@
+import dedup
+import search_index
+import text_norm
+
+def test_graphemes_keep_aksharas_whole():
+    # క + ్ + ష is one conjunct; మ + ా takes its vowel sign.
+    assert text_norm.graphemes("క్షమా") == ["క్ష", "మా"]
+    # A consonant joined by virama + ZWJ stays in the same cluster, as do
+    # spacing marks such as the anusvara.
+    assert text_norm.graphemes("స" + "త్\u200dయం") == ["స", "త్\u200dయం"]
+
+def test_shingles_are_built_from_aksharas():
+    # Four code points but two aksharas: a single shingle.
+    assert len(dedup.shingle_hashes("కిలో")) == 1
+    assert len(dedup.shingle_hashes("కిలో గ్రాము")) == len(text_norm.graphemes(text_norm.match_key("కిలో గ్రాము"))) - 2
+
+def test_search_terms_drop_surrounding_punctuation():
+    assert search_index.match_expression("What is DNA?") == '"what" AND "dna"'
+    assert search_index.match_expression("is a?") is None
@@ -0,0 +1,168 @@
+"""Normalization and tokenization of Telugu (and mixed-script) text.
+
+Text is stored as typed, with a normalized copy next to it
+(`content_norm`, `questions[].question_norm`), so dedup, search and
+equality checks all see the same form without recomputing it:
+
+- Unicode NFC, so precomposed and decomposed vowel signs compare equal.
+- Zero-width joiners: ZWJ/ZWNJ are kept only right after a virama, where
+  they choose between a conjunct, half form or explicit virama; anywhere
+  else they are invisible noise and dropped, as are ZWSP, BOM, word joiner
+  and soft hyphen.
+- Typographic punctuation (curly quotes, dashes, ellipsis, full-width
+  forms) folded to ASCII; whitespace of any kind collapsed to one space.
+- Case-folded, for Latin text mixed into passages.
+
+That form is for matching (dedup, search) only. Whether an edit changed
+anything is decided on `canonical`, which keeps case, punctuation and
+joiners, since those may be exactly what an annotator is correcting.
+
+`normalize` is memoized for short strings, so repeated questions and
+templates cost one dictionary lookup; passage bodies are not cached.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+from pymongo import UpdateOne
+
+# Bump when the rules change; `backfill_normalized` recomputes older documents.
+NORM_VERSION = 1
+
+VIRAMA = "\u0c4d"
+ZWNJ = "\u200c"
+ZWJ = "\u200d"
+JOINERS = ZWNJ + ZWJ
+# Zero-width space, byte order mark, word joiner, soft hyphen.
+INVISIBLE = dict.fromkeys(map(ord, "\u200b\ufeff\u2060\u00ad"))
+
+PUNCTUATION = str.maketrans({
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"',
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-", "\u2014": "-", "\u2212": "-",
+    "\u2026": "...",
+    "\u0964": ".", "\u0965": ".",
+    "\uff1f": "?", "\uff01": "!", "\uff0c": ",", "\uff1a": ":", "\uff1b": ";",
+})
+
+_WHITESPACE = re.compile(r"\s+")
+
+def _is_telugu_consonant(ch):
+    return "\u0c15" <= ch <= "\u0c39" or "\u0c58" <= ch <= "\u0c5a"
+
+# ------------------------------------------------------------------------------
+# 1) Normalization
+# ------------------------------------------------------------------------------
+def clean_joiners(text):
+    """Drop zero-width characters except a single ZWJ/ZWNJ after a virama."""
+    kept = []
+    for ch in text.translate(INVISIBLE):
+        if ch in JOINERS and not (kept and kept[-1] == VIRAMA):
+            continue
+        kept.append(ch)
+    return "".join(kept)
+
+# Longer strings (passage bodies) are normalized without caching them.
+MEMO_MAX_CHARS = 1024
+
+def normalize(text):
+    """The canonical form stored next to raw text (see module docstring)."""
+    if not text:
+        return ""
+    if len(text) <= MEMO_MAX_CHARS:
+        return _normalize_memo(text)
+    return _normalize(text)
+
+@lru_cache(maxsize=65536)
+def _normalize_memo(text):
+    return _normalize(text)
+
+def _normalize(text):
+    text = unicodedata.normalize("NFC", text)
+    text = clean_joiners(text).translate(PUNCTUATION)
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+def canonical(text):
+    """NFC with whitespace runs collapsed and the ends trimmed: text that
+    differs only in ways nobody can see or type on purpose."""
+    if not text:
+        return ""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+def match_key(text):
+    """`normalize` plus no punctuation or joiners at all, for similarity and
+    equality checks where rendering differences should not matter."""
+    text = normalize(text).replace(ZWJ, "").replace(ZWNJ, "")
+    kept = "".join(ch if unicodedata.category(ch)[0] in "LMN" else " " for ch in text)
+    return " ".join(kept.split())
+
+# ------------------------------------------------------------------------------
+# 2) Tokenization
+# ------------------------------------------------------------------------------
+def graphemes(text):
+    """Split into user-perceived characters (aksharas for Telugu): a base
+    character with its combining marks, and consonants joined by a virama
+    (optionally followed by ZWJ) kept together as one conjunct."""
+    clusters = []
+    for ch in text:
+        if clusters and (
+            unicodedata.category(ch).startswith("M")
+            or ch in JOINERS
+            or (_is_telugu_consonant(ch) and clusters[-1].endswith((VIRAMA, VIRAMA + ZWJ)))
+        ):
+            clusters[-1] += ch
+        else:
+            clusters.append(ch)
+    return clusters
+
+def tokens(text):
+    """Words of the normalized text, with punctuation trimmed from their ends."""
+    words = (w.strip("\"'.,:;!?()[]{}-") for w in normalize(text).split(" "))
+    return [w for w in words if w]
+
+# ------------------------------------------------------------------------------
+# 3) Stored Forms
+# ------------------------------------------------------------------------------
+def with_normalized_question(question):
+    """Set `question_norm` on a question dict (in place) and return it."""
+    question["question_norm"] = normalize(question.get("question", ""))
+    return question
+
+def backfill_normalized(content_collection, batch_size=1000):
+    """Store `content_norm` and `questions[].question_norm` on every document
+    normalized under an older NORM_VERSION (or never), streaming in batches.
+
+    Questions are addressed by `qid` and only updated while their text is
+    still the text that was normalized, so concurrent edits are never
+    overwritten (those questions get their norm from their own write).
+    Returns the number of documents modified.
+    """
+    modified = 0
+    ops = []
+    cursor = content_collection.find(
+        {"norm_version": {"$ne": NORM_VERSION}},
+        {"_id": 1, "content": 1, "content_hash": 1, "questions.qid": 1, "questions.question": 1},
+        batch_size=batch_size,
+    )
+    for doc in cursor:
+        sets = {"norm_version": NORM_VERSION}
+        array_filters = []
+        if isinstance(doc.get("content"), str):
+            sets["content_norm"] = normalize(doc["content"])
+        for q in doc.get("questions", []):
+            if not q.get("qid"):
+                continue
+            ident = f"q{len(array_filters)}"
+            array_filters.append({f"{ident}.qid": q["qid"], f"{ident}.question": q.get("question")})
+            sets[f"questions.$[{ident}].question_norm"] = normalize(q.get("question", ""))
+        filter_ = {"_id": doc["_id"]}
+        if doc.get("content_hash"):
+            # Skip documents whose body was re-ingested since we read it.
+            filter_["content_hash"] = doc["content_hash"]
+        ops.append(UpdateOne(filter_, {"$set": sets}, array_filters=array_filters or None))
+        if len(ops) >= batch_size:
+            modified += content_collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        modified += content_collection.bulk_write(ops, ordered=False).modified_count
+    return modified
@@ -0,0 +1,187 @@
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, ReturnDocument
+
+from content_ops import QUEUE_FIELDS, TARGET_QUESTIONS
+
+# How long a claimed passage stays reserved for one annotator without a
+# heartbeat. Abandoned claims become available again once this runs out.
+LEASE_SECONDS = 300
+
+# Renew the lease once this much of it has been used up.
+HEARTBEAT_SECONDS = LEASE_SECONDS // 3
+
+# Skips are forgotten after this long, so a skipped passage eventually
+# re-enters the user's normal queue.
+SKIP_TTL_SECONDS = 7 * 24 * 3600
+
+# How many candidates to inspect per round trip when selecting work.
+CANDIDATE_BATCH = 20
+
+# ------------------------------------------------------------------------------
+# 1) Indexes
+# ------------------------------------------------------------------------------
+def ensure_indexes(content_collection, skips_collection):
+    content_collection.create_index([("question_count", ASCENDING), ("lease_expires_at", ASCENDING)])
+    content_collection.create_index([("question_count", ASCENDING), ("content_id", ASCENDING)])
+    skips_collection.create_index([("username", ASCENDING), ("content_id", ASCENDING)], unique=True)
+    skips_collection.create_index([("username", ASCENDING), ("skipped_at", ASCENDING)])
+    skips_collection.create_index("skipped_at", expireAfterSeconds=SKIP_TTL_SECONDS)
+
+# ------------------------------------------------------------------------------
+# 2) Claiming
+# ------------------------------------------------------------------------------
+def _now():
+    return datetime.now(timezone.utc)
+
+def _claimable_by(username, now):
+    """Filter for documents with no live lease, or a lease already held by `username`.
+
+    Pass username=None to match unleased documents only.
+    """
+    conditions = [
+        {"lease_expires_at": None},
+        {"lease_expires_at": {"$lte": now}},
+    ]
+    if username is not None:
+        conditions.append({"claimed_by": username})
+    return {"$or": conditions}
+
+def _lease_update(username, now, lease_seconds):
+    return {"$set": {"claimed_by": username, "lease_expires_at": now + timedelta(seconds=lease_seconds)}}
+
+def _candidate_batches(content_collection, skips_collection, username, batch_size, fields=(), include_own=True):
+    """Yield lists of unclaimed, unskipped candidate documents in priority order.
+
+    Each batch costs one range scan on (question_count, content_id) plus one
+    indexed lookup of the user's skips restricted to that batch, so the cost
+    does not grow with the number of items the user has skipped.
+    """
+    projection = {"_id": 0, "content_id": 1, "question_count": 1, **{f: 1 for f in fields}}
+    after = None
+    while True:
+        conditions = [
+            {"question_count": {"$lt": TARGET_QUESTIONS}},
+            _claimable_by(username if include_own else None, _now()),
+        ]
+        if after:
+            conditions.append({
+                "$or": [
+                    {"question_count": {"$gt": after[0]}},
+                    {"question_count": after[0], "content_id": {"$gt": after[1]}},
+                ]
+            })
+        page = list(
+            content_collection.find({"$and": conditions}, projection)
+            .sort([("question_count", ASCENDING), ("content_id", ASCENDING)])
+            .limit(batch_size)
+        )
+        if not page:
+            return
+        ids = [d["content_id"] for d in page]
+        skipped = {
+            d["content_id"]
+            for d in skips_collection.find({"username": username, "content_id": {"$in": ids}}, {"_id": 0, "content_id": 1})
+        }
+        yield [d for d in page if d["content_id"] not in skipped]
+        last = page[-1]
+        after = (last["question_count"], last["content_id"])
+
+def claim_next(content_collection, skips_collection, username, lease_seconds=LEASE_SECONDS, projection=QUEUE_FIELDS):
+    """Atomically reserve the emptiest unclaimed passage `username` has not skipped.
+
+    Candidates are taken in `question_count` order, which keeps the old
+    priority (empty passages first, then those with fewer than
+    TARGET_QUESTIONS). Each candidate is claimed with find_one_and_update,
+    so two annotators never receive the same document; a candidate lost to
+    a concurrent claim is simply passed over. Returns the claimed document
+    or None.
+    """
+    for batch in _candidate_batches(content_collection, skips_collection, username, CANDIDATE_BATCH):
+        for candidate in batch:
+            doc = claim(content_collection, candidate["content_id"], username, lease_seconds, incomplete_only=True, projection=projection)
+            if doc:
+                return doc
+    return None
+
+def candidates(content_collection, skips_collection, username, limit, fields=(), exclude_ids=()):
+    """Return up to `limit` claimable candidates without claiming them.
+
+    Normally a single batched query; `fields` adds extra fields (such as
+    `content`) to the projection. Passages the user already holds are left
+    out. Callers must still `claim` a candidate before showing it, since
+    nothing stops another annotator taking it.
+    """
+    found = []
+    batch_size = limit + len(exclude_ids)
+    for batch in _candidate_batches(content_collection, skips_collection, username, batch_size, fields, include_own=False):
+        found.extend(d for d in batch if d["content_id"] not in exclude_ids)
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+def claim(content_collection, content_id, username, lease_seconds=LEASE_SECONDS, incomplete_only=False, projection=QUEUE_FIELDS):
+    """Reserve a specific passage, unless someone else holds a live lease on it.
+
+    With `incomplete_only`, the claim also fails if the passage has reached
+    TARGET_QUESTIONS in the meantime, which makes it a cheap revalidation
+    of a candidate selected earlier.
+    """
+    now = _now()
+    query = {"content_id": content_id, **_claimable_by(username, now)}
+    if incomplete_only:
+        query["question_count"] = {"$lt": TARGET_QUESTIONS}
+    return content_collection.find_one_and_update(
+        query,
+        _lease_update(username, now, lease_seconds),
+        projection=projection,
+        return_document=ReturnDocument.AFTER,
+    )
+
+# ------------------------------------------------------------------------------
+# 3) Skips
+# ------------------------------------------------------------------------------
+def record_skip(skips_collection, username, content_id):
+    """Remember that `username` skipped `content_id` (re-skipping moves it to the back)."""
+    skips_collection.update_one(
+        {"username": username, "content_id": content_id},
+        {"$set": {"skipped_at": _now()}},
+        upsert=True,
+    )
+
+def claim_oldest_skip(content_collection, skips_collection, username, lease_seconds=LEASE_SECONDS, projection=QUEUE_FIELDS):
+    """Re-offer the user's skipped passages, oldest skip first.
+
+    Used once claim_next finds nothing new. Each skip is consumed as it is
+    offered; skips held under someone else's live lease are passed over.
+    """
+    while True:
+        skip = skips_collection.find_one_and_delete(
+            {"username": username},
+            projection={"_id": 0, "content_id": 1},
+            sort=[("skipped_at", ASCENDING)],
+        )
+        if not skip:
+            return None
+        doc = claim(content_collection, skip["content_id"], username, lease_seconds, projection=projection)
+        if doc:
+            return doc
+
+# ------------------------------------------------------------------------------
+# 4) Heartbeat & Release
+# ------------------------------------------------------------------------------
+def renew(content_collection, content_id, username, lease_seconds=LEASE_SECONDS):
+    """Extend the caller's lease. Returns False if the lease was lost."""
+    now = _now()
+    result = content_collection.update_one(
+        {"content_id": content_id, "claimed_by": username},
+        {"$set": {"lease_expires_at": now + timedelta(seconds=lease_seconds)}},
+    )
+    return result.matched_count == 1
+
+def release(content_collection, content_id, username):
+    """Give a passage back to the queue (only if `username` still holds it)."""
+    content_collection.update_one(
+        {"content_id": content_id, "claimed_by": username},
+        {"$unset": {"claimed_by": "", "lease_expires_at": ""}},
+    )